@@ -13,7 +13,11 @@ __license__ = "Apache 2.0"
 
 __copyright__ = "Copyright (c) 2019 Tim Rightnour"
 
-from .balboa import BalboaSpaWifi
-from .sundanceRS485 import SundanceRS485
+from .balboa import BalboaProtocol, BalboaSpaWifi
+from .sundanceRS485 import (LazySundanceProtocol, LazySundanceRS485,
+                            SundanceProtocol, SundanceRS485)
+from .fleet import SpaFleet
+from .state import SpaState
+from .history import SpaHistory
 
 if __name__ == '__main__': print(__version__)
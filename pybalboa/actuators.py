@@ -0,0 +1,271 @@
+""" Getting a spa to a setting by pressing its buttons until it reads right.
+
+    engine = ActuatorEngine([
+        SetpointActuator('settemp', 'status', lambda spa: spa.settemp,
+                         lambda current, target: UP if target > current
+                         else DOWN),
+        Actuator('pump0', 'status', lambda spa: spa.pump_status[0], P1),
+    ])
+    engine.set_target('settemp', 102)
+    ...
+    # after every status update
+    presses, finished = engine.update(spa, 'status', queued)
+
+Buttons on these buses don't always take, and some settings need a press
+per step, so each actuator runs its own little state machine: press, wait
+for the press to go out, give the spa a few updates to show it, look
+again.  Each has its own retry budget, so one that is stuck doesn't hold
+up the rest, and each has at most one press waiting at a time, so presses
+for different actuators take turns in the slots.
+
+A setpoint is the exception: waiting to see every step of a 10 degree
+change takes a long time, so SetpointActuator works out every press it
+needs up front and sends them as one burst, looking only once they are all
+out.  If that didn't land on the target it carries on a press at a time.
+
+Nothing here does any I/O; whoever owns the engine queues the presses.
+"""
+
+IDLE = 'idle'
+ACTIVE = 'active'
+DONE = 'done'
+FAILED = 'failed'
+
+# Presses in a row that don't move the reading before giving up
+DEFAULT_BUDGET = 8
+
+# Updates to wait after a press went out before pressing again
+DEFAULT_SETTLE = 2
+
+
+def equal(current, target):
+    return current == target
+
+
+class Press:
+    """ A button press an actuator wants queued.
+
+    key is what it waits under in the slot queue, the button itself unless
+    an actuator queues several of the same one.  follow marks the presses
+    of a burst after its first, which may let other actuators' presses go
+    ahead of them.
+    """
+    __slots__ = ('button', 'key', 'follow')
+
+    def __init__(self, button, key=None, follow=False):
+        self.button = button
+        self.key = button if key is None else key
+        self.follow = follow
+
+    def __repr__(self):
+        return 'Press({0!r}, {1!r})'.format(self.button, self.key)
+
+
+class Actuator:
+    """ One setting and the button that changes it.
+
+    read(spa) gives the setting's current value.  button is the button code
+    to press, or a function of (current, target) picking one.  confirm
+    (current, target) says whether the target has been reached.  source
+    names the update that shows the setting, the engine only looks at an
+    actuator when one of those came in.
+
+    budget is how many presses in a row may leave the reading where it was
+    before the actuator gives up; a press that moves it, towards the target
+    or not, starts the count again.
+    """
+
+    def __init__(self, name, source, read, button, confirm=equal,
+                 budget=DEFAULT_BUDGET, settle=DEFAULT_SETTLE):
+        self.name = name
+        self.source = source
+        self.read = read
+        self.button = button
+        self.confirm = confirm
+        self.budget = budget
+        self.settle = settle
+        self.target = None
+        self.state = IDLE
+        # keys of our presses that may still be waiting for a slot
+        self.pressed = ()
+        self.wait = 0
+        self.misses = 0
+        self.last = None
+        self.presses = 0
+
+    def __repr__(self):
+        return 'Actuator({0!r}, {1}, target={2!r})'.format(
+            self.name, self.state, self.target)
+
+    def set(self, target):
+        """ Head for target, or stop trying with None. """
+        self.target = target
+        self.state = IDLE if target is None else ACTIVE
+        self.wait = 0
+        self.misses = 0
+        self.last = None
+
+    def finish(self, state):
+        # target stays put, to say what was reached or given up on
+        self.state = state
+
+    def step(self, spa, queued):
+        """ An update from our source came in: the Presses to queue.
+
+        queued is anything `key in queued` answers for, saying whether a
+        press is still waiting to go out.
+        """
+        if self.state != ACTIVE:
+            return ()
+        current = self.read(spa)
+        if self.confirm(current, self.target):
+            self.finish(DONE)
+            return ()
+
+        if self.pressed:
+            if any(key in queued for key in self.pressed):
+                return ()
+            # it went out, give the spa time to show it
+            self.pressed = ()
+            self.wait = self.settle
+        if self.wait:
+            self.wait -= 1
+            if self.wait:
+                return ()
+
+        if current != self.last:
+            self.last = current
+            self.misses = 0
+        if self.misses >= self.budget:
+            self.finish(FAILED)
+            return ()
+        self.misses += 1
+        return self.press(spa, current)
+
+    def press(self, spa, current):
+        """ What to press next, one step towards the target. """
+        button = self.button
+        if callable(button):
+            button = button(current, self.target)
+        return self.queue([Press(button)])
+
+    def queue(self, presses):
+        self.presses += len(presses)
+        self.pressed = tuple(press.key for press in presses)
+        return presses
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'target': self.target,
+            'current': self.last,
+            'misses': self.misses,
+            'presses': self.presses,
+        }
+
+
+class SetpointActuator(Actuator):
+    """ An actuator that steps a number, e.g. the set temperature.
+
+    increment is how far one press moves it, or a function of the spa
+    giving that.  ready(spa) says whether the panel is already showing the
+    setpoint; when it isn't, the first press only brings it up and doesn't
+    change it.  Leave ready out for a panel that never needs waking.
+
+    With plan set, the first press for a target is instead a burst of all
+    the presses the change takes, wake up included.  After that, or with
+    plan off, it's a press at a time like any other actuator.
+    """
+
+    def __init__(self, name, source, read, button, increment=1, ready=None,
+                 plan=True, **kwargs):
+        super().__init__(name, source, read, button, **kwargs)
+        self.increment = increment
+        self.ready = ready
+        self.plan = plan
+        self.planned = False
+
+    def set(self, target):
+        super().set(target)
+        self.planned = False
+
+    def press(self, spa, current):
+        if not self.plan or self.planned:
+            return super().press(spa, current)
+        # one go at a burst per target, then step
+        self.planned = True
+        increment = self.increment
+        if callable(increment):
+            increment = increment(spa)
+        steps = int(round(abs(self.target - current) / increment))
+        if steps < 1:
+            return super().press(spa, current)
+        if self.ready is not None and not self.ready(spa):
+            steps += 1
+        button = self.button(current, self.target)
+        return self.queue([Press(button)] + [
+            Press(button, (button, i), follow=True)
+            for i in range(1, steps)])
+
+
+class ActuatorEngine:
+    """ Every actuator of a spa, stepped together.
+
+    The actuators are visited in turn starting one further along each
+    update, so when several want a press in the same update none of them
+    always gets the first slot.
+    """
+
+    def __init__(self, actuators):
+        self.actuators = {actuator.name: actuator for actuator in actuators}
+        self.order = list(self.actuators.values())
+        self.turn = 0
+
+    def __getitem__(self, name):
+        return self.actuators[name]
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def set_target(self, name, target):
+        self.actuators[name].set(target)
+
+    def target(self, name):
+        """ What name is converging on, None once it is done or gave up. """
+        actuator = self.actuators[name]
+        return actuator.target if actuator.state == ACTIVE else None
+
+    def active(self, source=None):
+        """ Is anything, or anything shown by source, still converging? """
+        return any(actuator.state == ACTIVE
+                   and (source is None or actuator.source == source)
+                   for actuator in self.order)
+
+    def update(self, spa, source, queued):
+        """ Step the actuators source shows.
+
+        Returns (presses, finished): the Presses, in the order to queue
+        them, and the actuators that reached their target or gave up
+        on it this time.
+        """
+        presses = []
+        finished = []
+        order = self.order
+        n = len(order)
+        if not n:
+            return presses, finished
+        start = self.turn % n
+        self.turn += 1
+        for i in range(n):
+            actuator = order[(start + i) % n]
+            if actuator.source != source or actuator.state != ACTIVE:
+                continue
+            wanted = actuator.step(spa, queued)
+            if wanted:
+                presses.extend(wanted)
+            elif actuator.state != ACTIVE:
+                finished.append(actuator)
+        return presses, finished
+
+    def stats(self):
+        return {actuator.name: actuator.stats() for actuator in self.order}
@@ -4,6 +4,7 @@ except ImportError:
     import sundanceRS485 as SundanceRS485
 
 import asyncio
+import logging
 import paho.mqtt.client as mqtt
 import os
 from datetime import datetime
@@ -98,7 +99,8 @@ def on_message(mqttc, obj, msg):
             # spa.lastBrightness = spa.brigthness
             loop.run_until_complete(spa.change_rgbbrightness(0, 0))
         else:
-            if spa.lightBrightnes == 0:
+            # this runs on paho's thread, read the published snapshot
+            if spa.state.lightBrightnes == 0:
                 loop.run_until_complete(spa.change_rgbbrightness(0, 100))
             # if spa.lastBrightness > 0:
                 # loop.run_until_complete(spa.change_rgbbrightness(0, spa.lastBrightness))
@@ -125,93 +127,86 @@ def on_message(mqttc, obj, msg):
         print("No logic for this topic, discarding.")
             
             
+def light_mode_text(spa):
+    return spa.LIGHT_MODE_MAP.text(spa.lightMode)
+
+
+def rgb_text(spa):
+    return "{},{},{}".format(spa.lightR, spa.lightG, spa.lightB)
+
+
+# spa field -> (topic, value) pairs to publish when that field changes
+field_topics = {
+    'curtemp': [(current_temperature_topic, lambda spa: spa.curtemp)],
+    'settemp': [(temperature_state_topic, lambda spa: spa.get_settemp())],
+    'heatstate': [(action_topic, lambda spa: spa.get_heatstate(True))],
+    'pump_status': [
+        (pump1_state_topic, lambda spa: spa.pump_status[0]),
+        (pump2_state_topic, lambda spa: spa.pump_status[1]),
+    ],
+    'circ_pump_status': [
+        (ciculationpump_state_topic, lambda spa: spa.get_circ_pump()),
+        (ciculationmanual_state_topic, lambda spa: spa.get_circ_pump()),
+    ],
+    'lightBrightnes': [(brightness_state_topic, lambda spa: spa.lightBrightnes)],
+    'lightR': [(rgb_state_topic, rgb_text)],
+    'lightG': [(rgb_state_topic, rgb_text)],
+    'lightB': [(rgb_state_topic, rgb_text)],
+    'lightMode': [
+        (effect_state_topic, light_mode_text),
+        (light_state_topic, lambda spa: 1 if spa.lightMode > 0 else 0),
+    ],
+}
+
+
+async def publish_change(field, old, new):
+    """Republish only the topics that depend on the field that changed."""
+    if any(field in fields for fields in unpublished.values()):
+        # read_spa_data() is about to publish it along with everything else
+        return
+    for topic, value in field_topics[field]:
+        mqtt_client.publish(topic, value(spa), retain=True)
+
+
+# The fields each update decodes into.  Nothing is reported as changed for a
+# field that still has its starting value, a pump that is off say, so every
+# topic is published once when its update is first decoded.
+first_updates = [
+    (sundanceRS485.STATUS_UPDATE, sundanceRS485.SUNDANCE_STATUS_FIELDS),
+    (sundanceRS485.LIGHTS_UPDATE, sundanceRS485.LIGHT_FIELDS),
+]
+
+
+def publish_fields(spa, fields):
+    """Publish every topic that depends on fields, each topic once."""
+    topics = OrderedDict()
+    for field in fields:
+        for topic, value in field_topics.get(field, []):
+            topics[topic] = value
+    for topic, value in topics.items():
+        mqtt_client.publish(topic, value(spa), retain=True)
+
+
+def publish_first_updates(spa):
+    for mtype, fields in list(unpublished.items()):
+        if mtype in spa.last_decoded:
+            publish_fields(spa, fields)
+            del unpublished[mtype]
+
+
+def subscribe_spa_data(spa):
+    global unpublished
+    unpublished = OrderedDict(first_updates)
+    for field in field_topics:
+        spa.subscribe(field, publish_change)
+
+
 async def read_spa_data(spa, lastupd):
     await asyncio.sleep(0.1)
-    if spa.lastupd != lastupd:
-        lastupd = spa.lastupd
-        #print(
-        #    "New data as of "
-        #    + datetime.utcfromtimestamp(spa.lastupd).strftime("%d-%m-%Y %H:%M:%S")
-        #)
-
-        data = OrderedDict()
-
-        #print("CRC Errors: {0}".format(spa.crcerror))
-        #print("Dropped Bytes: {0}".format(spa.dropped))
-        #print("Last Command Attempts: {0}".format(spa.attemptsToCommand))
-        
-        #print("Current Temp: {0}".format(spa.curtemp))
-        #print("Current Temp2: {0}".format(spa.temp2))
-        #print("Set Temp: {0}".format(spa.get_settemp()))          
-        #print("Target Temp: {0}".format(spa.targetTemp))  
-        #print("Heat State: {1} {0}".format(spa.get_heatstate(True),spa.heatState2))
-        #print("Pump Status: {0}".format(str(spa.pump_status)))
-        #print("Pump Target Status: {0}".format(str(spa.target_pump_status)))
-        #print("Circulation Pump: {0}  Auto:  {1}  Manual: {2}  Unkfield: {3}".format(spa.get_circ_pump(True), spa.autoCirc, spa.manualCirc, spa.unknownCirc))
-
-        res = "unknown"
-        for x,y in spa.DISPLAY_MAP:
-            if x == spa.get_displayText():
-               res = y 
-               break
-        
-        #print("Display Text: {} {} ".format(spa.get_displayText(),res))
-        
-        
-        res = "unknown"
-        for x,y in spa.HEAT_MODE_MAP:
-            if x == spa.get_heatMode():
-               res = y 
-               break
-        
-        #print("Heat Mode: {} {} ".format(spa.get_heatMode(), res))
-        
-        #print("UnknownField3: {}".format(spa.UnknownField3))
-        #print("UnknownField9: {}".format(spa.UnknownField9))
-
-        lightModeText = "unknown"
-        for x,y in spa.LIGHT_MODE_MAP:
-            if x == spa.lightMode:
-               lightModeText = y 
-               break
-
-        #print("Light Status: Mode: {0} {6} Brightness: {1} Time: {5} Colors: R: {2} G: {3} B: {4} ".format(spa.lightMode, spa.lightBrightnes, spa.lightR, spa.lightG, spa.lightB, spa.lightCycleTime, lightModeText))
-
-        res = "unknown"
-        for x,y in spa.LIGHT_MODE_MAP:
-            if x == spa.targetlightMode:
-               res = y 
-               break
-        
-
-        #print("Target Light Status: Mode: {0} {2} Brightness: {1} ".format(spa.targetlightMode, spa.targetlightBrightnes,  res))  
-
-        #print("Spa Time: Y{0:04d} M{1:02d} D{2:02d} {3:02d}:{4:02d} {5}".format(
-        #    spa.year,
-        #    spa.month,
-        #    spa.day,
-        #    spa.time_hour,
-        #    spa.time_minute,
-        #    spa.get_timescale(True)
-        #))
-        
-        mqtt_client.publish(current_temperature_topic, spa.curtemp, retain=True)      
-        mqtt_client.publish(temperature_state_topic, spa.get_settemp(), retain=True) 
-        mqtt_client.publish(action_topic, spa.get_heatstate(True), retain=True) 
-        mqtt_client.publish(pump1_state_topic, spa.pump_status[0], retain=True) 
-        mqtt_client.publish(pump2_state_topic, spa.pump_status[1], retain=True) 
-        mqtt_client.publish(ciculationpump_state_topic, spa.get_circ_pump(), retain=True) 
-        mqtt_client.publish(ciculationmanual_state_topic, spa.get_circ_pump(), retain=True)  
-        
-        mqtt_client.publish(brightness_state_topic, spa.lightBrightnes, retain=True)  
-        mqtt_client.publish(rgb_state_topic, "{},{},{}".format(spa.lightR,spa.lightG,spa.lightB,), retain=True)  
-        mqtt_client.publish(effect_state_topic, lightModeText, retain=True)  
-        
-        if(spa.lightMode > 0):
-            mqtt_client.publish(light_state_topic, 1, retain=True)   
-        else:
-            mqtt_client.publish(light_state_topic, 0, retain=True)   
- 
+    # the state topics are published in full after the first update, then
+    # by publish_change() as fields change
+    if unpublished:
+        publish_first_updates(spa)
     if spa.connected:     
         mqtt_client.publish(availability_topic, "online", retain=True) 
     else:
@@ -318,9 +313,7 @@ async def start_mqtt(spa):
     mqtt_client.publish(discovery_topic, json.dumps(payload), 1, True)
 
 
-    lightModes = []
-    for x,y in spa.LIGHT_MODE_MAP:
-        lightModes.append(y)
+    lightModes = list(spa.LIGHT_MODE_MAP.texts)
 
     discovery_topic = 'homeassistant/light/{}/{}/config'.format(flora_name.lower(), "Lights")
     payload = OrderedDict()
@@ -370,6 +363,7 @@ async def start_app():
 
     # Connect to MQTT
     await start_mqtt(spa)
+    subscribe_spa_data(spa)
 
     asyncio.ensure_future(spa.listen())
     lastupd = 0
@@ -379,4 +373,6 @@ async def start_app():
 
 
 if __name__ == "__main__":
+    logging.basicConfig()
+    logging.getLogger(sundanceRS485.__name__).setLevel(logging.DEBUG)
     asyncio.run(start_app())
\ No newline at end of file
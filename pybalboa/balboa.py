@@ -1,13 +1,44 @@
 import asyncio
 import errno
+import functools
 import logging
 import time
 import warnings
+from collections import deque
 from socket import error as SocketError
 
+try:
+    from .checksum import calc_cs
+    from .dispatch import MessageRegistry, frame_mtype, method_handler, pack_mtype
+    from .framing import FrameDecoder, M_STARTEND
+    from .layout import Field, Layout
+    from .outbound import OutboundScheduler
+    from .capture import CaptureWriter
+    from .state import (CONFIG_FIELDS, CONFIG_TRACKER, FILTER_FIELDS,
+                        FILTER_TRACKER, STATUS_FIELDS,
+                        ChangeTracker, SpaState)
+except ImportError:
+    from checksum import calc_cs
+    from dispatch import MessageRegistry, frame_mtype, method_handler, pack_mtype
+    from framing import FrameDecoder, M_STARTEND
+    from layout import Field, Layout
+    from outbound import OutboundScheduler
+    from capture import CaptureWriter
+    from state import (CONFIG_FIELDS, CONFIG_TRACKER, FILTER_FIELDS,
+                       FILTER_TRACKER, STATUS_FIELDS,
+                       ChangeTracker, SpaState)
+
 BALBOA_DEFAULT_PORT = 4257
 
-M_STARTEND = 0x7e
+# How much to ask the socket for in one go.
+READ_CHUNK_SIZE = 4096
+
+# Outbound pacing for the wifi module, in button presses per second.  Pumps
+# take the module about a second to settle on a new speed, so a pump press
+# costs two.  Queries are free.
+SEND_RATE = 2.0
+PRESS_COST = 1
+PUMP_PRESS_COST = 2
 
 C_PUMP1 = 0x04
 C_PUMP2 = 0x05
@@ -60,6 +91,9 @@ mtypes = [
     [0x0A, 0XBF, 0x25],  # BMTR_SETUP_PARAMS_RESP
 ]
 
+# packed type -> index into mtypes, the first entry wins for duplicates
+mtype_index = {pack_mtype(mtypes[i]): i for i in reversed(range(0, NROF_BMT))}
+
 text_heatmode = ["Ready", "Rest", "Ready in Rest"]
 text_heatstate = ["idle", "heating", "Heat Waiting"]
 text_tscale = ["Fahrenheit", "Celcius"]
@@ -70,25 +104,185 @@ text_blower = ["Off", "Low", "Medium", "High"]
 text_switch = ["Off", "On"]
 text_filter = ["Off", "Cycle 1", "Cycle 2", "Cycle 1 and 2"]
 
-"""	
-The CRC is annoying.  Doing CRC's in python is even more annoying than it	
-should be.  I hate it.	
- * Generated on Sun Apr  2 10:09:58 2017,	
- * by pycrc v0.9, https://pycrc.org	
- * using the configuration:	
- *    Width         = 8	
- *    Poly          = 0x07	
- *    Xor_In        = 0x02	
- *    ReflectIn     = False	
- *    Xor_Out       = 0x02	
- *    ReflectOut    = False	
- *    Algorithm     = bit-by-bit	
-https://github.com/garbled1/gnhast/blob/master/balboacoll/collector.c	
-"""
-
-
-class BalboaSpaWifi:
-    def __init__(self, hostname, port=BALBOA_DEFAULT_PORT):
+# Where things are in each message, offsets are into the whole frame.
+# The parse_* docstrings have the byte maps these come from.
+STATUS_LAYOUT = Layout('StatusUpdate', [
+    Field('curtemp', 7),
+    Field('time_hour', 8),
+    Field('time_minute', 9),
+    Field('heatmode', 10, mask=0x03),
+    Field('tempscale', 14, mask=0x01),
+    Field('timescale', 14, shift=1, mask=0x01),
+    Field('filter_mode', 14, shift=2, mask=0x03),
+    Field('temprange', 15, shift=2, mask=0x01),
+    Field('heatstate', 15, shift=4, mask=0x03),
+    Field('pump0', 16, mask=0x03),
+    Field('pump1', 16, shift=2, mask=0x03),
+    Field('pump2', 16, shift=4, mask=0x03),
+    Field('pump3', 16, shift=6, mask=0x03),
+    Field('pump4', 17, mask=0x03),
+    Field('pump5', 17, shift=2, mask=0x03),
+    Field('circ_pump', 18),  # 0x02 when running, the whole byte
+    Field('blower', 18, shift=2, mask=0x03),
+    Field('light0', 19, shift=1, mask=0x01),
+    Field('light1', 19, shift=3, mask=0x01),
+    Field('mister', 20, mask=0x01),
+    Field('aux0', 20, mask=0x08),
+    Field('aux1', 20, mask=0x10),
+    Field('settemp', 25),
+])
+
+# Which attributes each status field goes into, for change tracking
+STATUS_TRACKER = ChangeTracker(STATUS_FIELDS, STATUS_LAYOUT, {
+    'tempscale': ('tempscale', 'curtemp', 'settemp'),
+    'pump0': ('pump_status',), 'pump1': ('pump_status',),
+    'pump2': ('pump_status',), 'pump3': ('pump_status',),
+    'pump4': ('pump_status',), 'pump5': ('pump_status',),
+    'circ_pump': ('circ_pump_status',),
+    'blower': ('blower_status',),
+    'light0': ('light_status',), 'light1': ('light_status',),
+    'mister': ('mister_status',),
+    'aux0': ('aux_status',), 'aux1': ('aux_status',),
+})
+
+FILTER_LAYOUT = Layout('FilterCycleInfo', [
+    Field('filter1_hour', 5),
+    Field('filter1_minute', 6),
+    Field('filter1_duration_hours', 7),
+    Field('filter1_duration_minutes', 8),
+    Field('filter2_enabled', 9, shift=7, mask=0x01),
+    Field('filter2_hour', 9, mask=0x7f),
+    Field('filter2_minute', 10),
+    Field('filter2_duration_hours', 11),
+    Field('filter2_duration_minutes', 12),
+])
+
+DEVICE_CONFIG_LAYOUT = Layout('DeviceConfiguration', [
+    Field('pump0', 5, mask=0x03),
+    Field('pump1', 5, shift=2, mask=0x03),
+    Field('pump2', 5, shift=4, mask=0x03),
+    Field('pump3', 5, shift=6, mask=0x03),
+    Field('pump4', 6, mask=0x03),
+    Field('pump5', 6, shift=6, mask=0x03),
+    Field('light0', 7, mask=0x03),
+    Field('light1', 7, shift=2, mask=0x03),
+    Field('blower', 8, mask=0x03, flag=True),
+    Field('circ_pump', 8, mask=0x80, flag=True),
+    Field('aux0', 9, mask=0x01, flag=True),
+    Field('aux1', 9, mask=0x02, flag=True),
+    Field('mister', 9, mask=0x30, flag=True),
+])
+
+SYS_INFO_LAYOUT = Layout('SystemInformation', [
+    Field('ssid_major', 5),
+    Field('ssid_minor', 6),
+    Field('sw_major', 7),
+    Field('sw_minor', 8),
+    Field('model_name', 9, size=8),
+    Field('setup', 17),
+    Field('cfg_sig0', 18),
+    Field('cfg_sig1', 19),
+    Field('cfg_sig2', 20),
+    Field('cfg_sig3', 21),
+    Field('voltage', 22),
+    Field('heater_type', 23),
+    Field('dip_switch0', 24),
+    Field('dip_switch1', 25),
+])
+
+SETUP_PARAMS_LAYOUT = Layout('SetupParameters', [
+    Field('low_min', 7),
+    Field('low_max', 8),
+    Field('high_min', 9),
+    Field('high_max', 10),
+    Field('pumps', 12, mask=0x3f),
+])
+
+MOD_IDENT_LAYOUT = Layout('ModuleIdentification', [
+    Field('macaddr', 8, size=6),
+    Field('idigi_device_id', 14, size=16),
+])
+
+# How many frames with variable arguments (set temp, set time, ...) to keep
+FRAME_CACHE_SIZE = 128
+
+
+def build_frame(*message):
+    """ Wrap message bytes in M_STARTEND, length and checksum. """
+    message_length = len(message)+2
+    data = bytearray(message_length+2)
+    data[0] = M_STARTEND
+    data[1] = message_length
+    data[2:message_length] = message
+    data[-2] = calc_cs(data[1:message_length], message_length-1)
+    data[-1] = M_STARTEND
+    return bytes(data)
+
+
+def fixed_messages():
+    """ Every message we send that never has variable arguments. """
+    messages = [tuple(mtypes[BMTS_CONFIG_REQ])]
+    for button in (C_PUMP1, C_PUMP2, C_PUMP3, C_PUMP4, C_PUMP5, C_PUMP6,
+                   C_LIGHT1, C_LIGHT2, C_MISTER, C_AUX1, C_AUX2, C_BLOWER,
+                   C_TEMPRANGE, C_HEATMODE):
+        messages.append((*mtypes[BMTS_CONTROL_REQ], button, 0x00))
+    for ba, bb in ((0, 1), (1, 0), (2, 0), (4, 0)):
+        messages.append((*mtypes[BMTS_PANEL_REQ], ba, 0, bb))
+    for unit in (0, 1):
+        messages.append((*mtypes[BMTS_SET_TSCALE], 0x01, unit))
+    return messages
+
+
+# Built once at import and shared by every spa
+FIXED_FRAMES = {message: build_frame(*message) for message in fixed_messages()}
+
+
+@functools.lru_cache(maxsize=FRAME_CACHE_SIZE)
+def build_cached_frame(message):
+    return build_frame(*message)
+
+
+def encode_frame(*message):
+    """ The complete frame for a message, from the cache when possible. """
+    frame = FIXED_FRAMES.get(message)
+    if frame is None:
+        frame = build_cached_frame(message)
+    return frame
+
+
+EVENT_NEW_DATA = 'new_data'
+EVENT_UNKNOWN_MESSAGE = 'unknown_message'
+# data is a dict of field -> (old, new) for the fields a message changed
+EVENT_CHANGED = 'changed'
+
+class ProtocolEvent:
+    """ Something the protocol core wants the outside world to know. """
+    __slots__ = ('kind', 'mtype', 'data')
+
+    def __init__(self, kind, mtype=None, data=None):
+        self.kind = kind
+        self.mtype = mtype
+        self.data = data
+
+    def __repr__(self):
+        return f'ProtocolEvent({self.kind!r}, {self.mtype!r})'
+
+
+class BalboaProtocol:
+    """ The Balboa protocol without any I/O.
+
+    Feed it the bytes the spa sends with receive_data(); it keeps track of
+    the spa state, returns events and queues anything that needs to go back
+    to the spa for data_to_send().  There are no sockets, no event loop and
+    nothing to await, so recorded traffic can be pushed through at full
+    speed.  BalboaSpaWifi wraps it with the asyncio stream handling.
+
+    Every update that changes anything also publishes a new immutable
+    state_class snapshot to self.state, see state.py.
+    """
+    state_class = SpaState
+
+    def __init__(self):
         # API Constants
         self.TSCALE_C = 1
         self.TSCALE_F = 0
@@ -129,11 +323,6 @@ class BalboaSpaWifi:
         self.HEATERTYPE_UNKNOWN = "Unknown"
 
         # Internal states
-        self.host = hostname
-        self.port = port
-        self.reader = None
-        self.writer = None
-        self.connected = False
         self.config_loaded = False
         self.pump_array = [0, 0, 0, 0, 0, 0]
         self.nr_of_pumps = 0
@@ -158,14 +347,16 @@ class BalboaSpaWifi:
         self.aux_status = [0, 0]
         self.wifistate = 0
         self.lastupd = 0
-        self.sleep_time = 60
         self.macaddr = 'Unknown'
         self.idigi_device_id = 'Unknown'
         self.time_hour = 0
         self.time_minute = 0
         self.filter_mode = 0
         self.prior_status = None
-        self.new_data_cb = None
+        # the last raw frame of each message type, see repeated()
+        self.last_frames = {}
+        # and what it decoded to, see report_decoded()
+        self.last_decoded = {}
         self.model_name = 'Unknown'
         self.sw_vers = 'Unknown'
         self.cfg_sig = 'Unknown'
@@ -184,240 +375,155 @@ class BalboaSpaWifi:
         self.filter2_duration_hours = 0
         self.filter2_duration_minutes = 0
         self.log = logging.getLogger(__name__)
-        self.dropped = 0
-        self.crcerror = 0
+        self.decoder = FrameDecoder(log=self.log)
+        self.outgoing = bytearray()
+        self.events = []
+        # subclasses with a richer state_class capture that once their own
+        # attributes are set up
+        self.state = SpaState.capture(self)
+        # a SpaHistory to sample into on every new data, see history.py
+        self.history = None
+
+    @property
+    def dropped(self):
+        """ Bytes thrown away while hunting for valid frames. """
+        return self.decoder.dropped
+
+    @property
+    def crcerror(self):
+        """ Frames discarded because of a bad checksum. """
+        return self.decoder.crcerror
 
     def to_celsius(self, fahrenheit):
         return .5 * round(((fahrenheit-32) / 1.8) / .5)
 
     def balboa_calc_cs(self, data, length):
         """ Calculate the checksum byte for a balboa message """
-        crc = 0xb5
-        for cur in range(length):
-            for i in range(8):
-                bit = crc & 0x80
-                crc = ((crc << 1) & 0xff) | ((data[cur] >> (7 - i)) & 0x01)
-                if (bit):
-                    crc = crc ^ 0x07
-            crc &= 0xff
-        for i in range(8):
-            bit = crc & 0x80
-            crc = (crc << 1) & 0xff
-            if bit:
-                crc ^= 0x07
-        return crc ^ 0x02
-
-    async def connect(self):
-        """ Connect to the spa."""
-        try:
-            self.reader, self.writer = await asyncio.open_connection(self.host,
-                                                                     self.port)
-        except (asyncio.TimeoutError, ConnectionRefusedError):
-            self.log.error("Cannot connect to spa at {0}:{1}".format(self.host,
-                                                                     self.port))
-            return False
-        except Exception as e:
-            self.log.error(
-                f'Error connecting to spa at {self.host}:{self.port}: {e}')
-            return False
-        self.connected = True
-        return True
-
-    async def disconnect(self):
-        """ Stop talking to the spa."""
-        self.log.info("Disconnect requested")
-        self.connected = False
-        if not self.writer._loop.is_closed():
-            self.writer.close()
-            await self.writer.wait_closed()
-        await self.int_new_data_cb()
-
-    async def int_new_data_cb(self):
-        """ Internal new data callback.
-        Binds to self.new_data_cb()
+        return calc_cs(data, length)
+
+    def encode_message(self, *bytes):
+        """ Build a complete frame around the message bytes. """
+        return encode_frame(*bytes)
+
+    def queue_message(self, *bytes):
+        """ Queue a message for the spa, see data_to_send(). """
+        data = self.encode_message(*bytes)
+        self.log.debug(f'Queueing message: {data.hex()}')
+        self.outgoing += data
+
+    def data_to_send(self):
+        """ Return (and forget) everything queued for the spa. """
+        data = bytes(self.outgoing)
+        self.outgoing.clear()
+        return data
+
+    def emit(self, kind, mtype=None, data=None):
+        """ Record an event for whoever is driving the protocol. """
+        self.events.append(ProtocolEvent(kind, mtype, data))
+        if kind == EVENT_NEW_DATA and self.history is not None:
+            self.history.record(self.state, self.lastupd)
+
+    def next_events(self):
+        """ Return (and forget) the events produced so far. """
+        events = self.events
+        self.events = []
+        return events
+
+    def receive_data(self, data):
+        """ Feed raw bytes from the spa.
+
+        Every complete frame is decoded into our state.  Returns the list of
+        events this produced; anything the spa needs to be told in response
+        is waiting in data_to_send().
         """
-
-        if self.new_data_cb is None:
-            return
+        for frame in self.decoder.iter_frames(data):
+            self.handle_message(frame)
+        return self.next_events()
+
+    def handle_message(self, data):
+        """ Figure out what a single frame is and hand it to its handler. """
+        handler = self.registry.lookup(data)
+        if handler is not None:
+            return handler(self, data)
+        return self.unhandled_message(data)
+
+    def unhandled_message(self, data):
+        """ Nothing is registered for this frame, complain about it. """
+        mtype = self.find_balboa_mtype(data)
+        if mtype is None:
+            self.log.error(f"Spa sent an unknown message: {data.hex()}")
+            self.emit(EVENT_UNKNOWN_MESSAGE, data=bytes(data))
         else:
-            await self.new_data_cb()
-
-    async def send_config_req(self):
-        """ send_config_req() has been deprecated in favor of send_mod_ident_req() """
-        warnings.warn(
-            "send_config_req() has been deprecated in favor of send_mod_ident_req()", DeprecationWarning)
-        return await self.send_mod_ident_req()
-
-    async def send_mod_ident_req(self):
-        """ Ask for the module identification. """
-        await self.send_message(*mtypes[BMTS_CONFIG_REQ])
-
-    async def send_panel_req(self, ba, bb):
-        """ Send a panel request, 2 bytes of data.
-              0001020304 0506070809101112
-        0,1 - 7E0B0ABF2E 0A0001500000BF7E
-        2,0 - 7E1A0ABF24 64DC140042503230303047310451800C6B010A0200F97E
-        4,0 - 7E0E0ABF25 120432635068290341197E
-        """
-        await self.send_message(*mtypes[BMTS_PANEL_REQ], ba, 0, bb)
-
-    async def send_temp_change(self, newtemp):
-        """ Change the set temp to newtemp. """
-        # Check if the new temperature is valid for the current heat mode
-        if (newtemp < self.tmin[self.temprange][self.tempscale] or
-                newtemp > self.tmax[self.temprange][self.tempscale]):
-            self.log.error(
-                "Attempt to set temperature outside of heat mode boundary")
-            return
-
-        if self.tempscale == self.TSCALE_C:
-            newtemp *= 2.0
-
-        await self.send_message(*mtypes[BMTS_SET_TEMP], int(round(newtemp)))
-
-    async def change_light(self, light, newstate):
-        """ Change light #light to newstate. """
-        # sanity check
-        if (light > 1
-                or not self.light_array[light]
-                or self.light_status[light] == newstate):
-            return
-
-        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_LIGHT1 if light == 0 else C_LIGHT2, 0x00)
-
-    async def change_pump(self, pump, newstate):
-        """ Change pump #pump to newstate. """
-        # sanity check
-        if (pump > MAX_PUMPS
-                or newstate > self.pump_array[pump]
-                or self.pump_status[pump] == newstate):
-            return
-
-        # calculate how many times to push the button
-        iter = max(
-            (newstate-self.pump_status[pump]) % (self.pump_array[pump]+1), 1)
-        # now push the button that number of times
-        for i in range(0, iter):
-            await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_PUMP1 + pump, 0x00)
-            await asyncio.sleep(1.0)
-
-    async def change_heatmode(self, newmode):
-        """Change the spa's heat mode.
-
-        A spa cannot be put into Ready in Rest (RNR). It can be in RNR, but you cannot
-        force it into RNR. It's a tri-state, but a binary switch.
-
-        :param newmode: The new heat mode.
-        """
-        # sanity check
-        if (newmode > 2
-                or self.heatmode == newmode
-                or newmode == self.HEATMODE_RNR):  # also can't change mode to Ready in Rest
-            return
-
-        # if currently in ready in rest and changing to ready, the first toggle
-        # will set the heat mode to rest, so we need to toggle an additional time
-        if (newmode == self.HEATMODE_READY and self.heatmode == self.HEATMODE_RNR):
-            await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_HEATMODE, 0x00)
-            await asyncio.sleep(0.5)
-
-        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_HEATMODE, 0x00)
+            self.log.error("Unhandled mtype {0}".format(mtype))
+        return None
 
-    async def change_temperature_unit(self, temperature_unit):
-        """Change the spa's temperature unit.
+    def register_handler(self, mtype, handler):
+        """ Handle frames of mtype with handler(spa, data).
 
-        :param temperature_unit: The new temperature unit.
+        mtype is either a full 3 byte message type, e.g. [0x0A, 0xBF, 0x99],
+        or a single type byte to match regardless of the first two.  This
+        only affects this spa; the built in handlers are shared by all of
+        them until one is changed.
         """
-        # sanity check
-        if (temperature_unit > 1
-                or self.tempscale == temperature_unit):
-            return
-
-        await self.send_message(*mtypes[BMTS_SET_TSCALE], 0x01, temperature_unit)
-
-    async def change_temprange(self, newmode):
-        """ Change the spa's temprange to newmode. """
-        # sanity check
-        if (newmode > 1 or self.temprange == newmode):
-            return
-
-        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_TEMPRANGE, 0x00)
-
-    async def change_aux(self, aux, newstate):
-        """ Change aux #aux to newstate. """
-        # sanity check
-        if (aux > 1
-                or not self.aux_array[aux]
-                or self.aux_status[aux] == newstate):
-            return
-
-        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_AUX1 if aux == 0 else C_AUX2, 0x00)
-
-    async def change_mister(self, newmode):
-        """ Change the spa's mister to newmode. """
-        # sanity check
-        if (newmode > 1
-                or self.mister == newmode):
-            return
-
-        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_MISTER, 0x00)
-
-    async def change_blower(self, newstate):
-        """ Change blower to newstate. """
-        # sanity check
-        if (not self.have_blower()
-                or self.blower_status == newstate
-                or newstate > 3):
-            return
-
-        # toggle until we hit the desired state
-        for i in range(0, ((newstate-self.blower_status) % 4)):
-            await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_BLOWER, 0x00)
-            await asyncio.sleep(0.5)
-
-    async def set_time(self, new_time, timescale=None):
-        """ Set time on spa to new_time with optional timescale. """
-        # sanity check
-        if (not isinstance(new_time, time.struct_time)):
-            return
-
-        await self.send_message(*mtypes[BMTS_SET_TIME],
-                                ((self.timescale if timescale is None else timescale)
-                                 << 7) + new_time.tm_hour,
-                                new_time.tm_min)
+        if self.registry is type(self).registry:
+            self.registry = self.registry.copy()
+        self.registry.register(mtype, handler)
 
-    async def send_message(self, *bytes):
-        """ Sends a message to the spa with variable length bytes. """
-        # if not connected, we can't send a message
-        if not self.connected:
-            return
-
-        message_length = len(bytes)+2
-        data = bytearray(message_length+2)
-        data[0] = M_STARTEND
-        data[1] = message_length
-        data[2:message_length] = bytes
-        data[-2] = self.balboa_calc_cs(data[1:message_length],
-                                       message_length-1)
-        data[-1] = M_STARTEND
-
-        self.log.debug(f'Sending message: {data.hex()}')
-        try:
-            self.writer.write(data)
-            await self.writer.drain()
-        except Exception as e:
-            self.log.error(f'Error sending message: {e}')
+    def unregister_handler(self, mtype):
+        """ Stop handling frames of mtype on this spa. """
+        if self.registry is type(self).registry:
+            self.registry = self.registry.copy()
+        self.registry.unregister(mtype)
 
     def find_balboa_mtype(self, data):
         """ Look at a message and try to figure out what type it was. """
         if len(data) < 5:
             return None
-        for i in range(0, NROF_BMT):
-            if (data[2] == mtypes[i][0]
-                    and data[3] == mtypes[i][1]
-                    and data[4] == mtypes[i][2]):
-                return i
-        return None
+        return mtype_index.get(frame_mtype(data))
+
+    def report_changes(self, mtype, tracker, before):
+        """ Emit EVENT_CHANGED for whatever differs from tracker's snapshot.
+
+        Lists such as pump_status are reported as tuples.  The new state is
+        published before the event goes out.  Returns the change set, which
+        is empty if nothing changed.
+        """
+        changes = tracker.changes(self, before)
+        if changes:
+            self.state = self.state.evolve(changes)
+            self.emit(EVENT_CHANGED, mtype, changes)
+        return changes
+
+    def report_decoded(self, mtype, tracker, values):
+        """ report_changes() for a message decoded with tracker's layout.
+
+        Rather than snapshotting the attributes before and after, values,
+        the tuple the message decoded to, is compared with the last one of
+        mtype and only the attributes fed by fields that moved are checked
+        against self.state.
+        """
+        names = tracker.touched(self.last_decoded.get(mtype), values)
+        self.last_decoded[mtype] = values
+        if not names:
+            return {}
+        changes = tracker.compare(self, self.state, names)
+        if changes:
+            self.state = self.state.evolve(changes)
+            self.emit(EVENT_CHANGED, mtype, changes)
+        return changes
+
+    def repeated(self, data):
+        """ Is this frame byte for byte the last one of its type?
+
+        If not it is remembered for next time.  Spas repeat their status
+        far more often than anything changes, and one bytes comparison is a
+        lot cheaper than decoding the frame again.
+        """
+        key = frame_mtype(data)
+        if self.last_frames.get(key) == data:
+            return True
+        self.last_frames[key] = bytes(data)
+        return False
 
     def parse_noclue1(self, data):
         """ parse_noclue1(data) has been deprecated in favor of parse_system_information(data) """
@@ -452,14 +558,15 @@ class BalboaSpaWifi:
 
         """
 
-        self.sw_vers = f'{data[7]}.{data[8]}'
-        self.ssid = f'M{data[5]}_{data[6]} V{self.sw_vers}'
-        self.model_name = "".join(map(chr, data[9:17])).strip()
-        self.setup = data[17]
-        self.cfg_sig = f"{data[18]:x}{data[19]:x}{data[20]:x}{data[21]:x}"
-        self.voltage = self.VOLTAGE_240 if data[22] == 0x01 else self.VOLTAGE_UNKNOWN
-        self.heater_type = self.HEATERTYPE_STANDARD if data[23] == 0x0A else self.HEATERTYPE_UNKNOWN
-        self.dip_switch = f'{data[24]:08b}{data[25]:08b}'
+        info = SYS_INFO_LAYOUT.decode(data)
+        self.sw_vers = f'{info.sw_major}.{info.sw_minor}'
+        self.ssid = f'M{info.ssid_major}_{info.ssid_minor} V{self.sw_vers}'
+        self.model_name = "".join(map(chr, info.model_name)).strip()
+        self.setup = info.setup
+        self.cfg_sig = f"{info.cfg_sig0:x}{info.cfg_sig1:x}{info.cfg_sig2:x}{info.cfg_sig3:x}"
+        self.voltage = self.VOLTAGE_240 if info.voltage == 0x01 else self.VOLTAGE_UNKNOWN
+        self.heater_type = self.HEATERTYPE_STANDARD if info.heater_type == 0x0A else self.HEATERTYPE_UNKNOWN
+        self.dip_switch = f'{info.dip_switch0:08b}{info.dip_switch1:08b}'
 
     def parse_setup_parameters(self, data):
         """ Parse a setup parameters response.
@@ -479,20 +586,18 @@ class BalboaSpaWifi:
         13 - unknown
         """
 
+        params = SETUP_PARAMS_LAYOUT.decode(data)
+
         # store low range min and max temperatures as [°F, °C]
-        self.tmin[0] = [data[7], self.to_celsius(data[7])]
-        self.tmax[0] = [data[8], self.to_celsius(data[8])]
+        self.tmin[0] = [params.low_min, self.to_celsius(params.low_min)]
+        self.tmax[0] = [params.low_max, self.to_celsius(params.low_max)]
 
         # store high range min and max temperatures as [°F, °C]
-        self.tmin[1] = [data[9], self.to_celsius(data[9])]
-        self.tmax[1] = [data[10], self.to_celsius(data[10])]
+        self.tmin[1] = [params.high_min, self.to_celsius(params.high_min)]
+        self.tmax[1] = [params.high_max, self.to_celsius(params.high_max)]
 
-        self.nr_of_pumps = (data[12] & 1)\
-            + (data[12] >> 1 & 1)\
-            + (data[12] >> 2 & 1)\
-            + (data[12] >> 3 & 1)\
-            + (data[12] >> 4 & 1)\
-            + (data[12] >> 5 & 1)
+        # one bit per pump
+        self.nr_of_pumps = bin(params.pumps).count('1')
 
     def parse_config_resp(self, data):
         """ parse_config_resp(data) has been deprecated in favor of parse_module_identification(data) """
@@ -514,9 +619,10 @@ class BalboaSpaWifi:
         14-29 - iDigi device id (used to communicate with Balboa cloud API)
         """
 
-        self.macaddr = f'{data[8]:02x}:{data[9]:02x}:{data[10]:02x}'\
-            f':{data[11]:02x}:{data[12]:02x}:{data[13]:02x}'
-        self.idigi_device_id = f'{data[14:18].hex()}-{data[18:22].hex()}-{data[22:26].hex()}-{data[26:30].hex()}'.upper()
+        ident = MOD_IDENT_LAYOUT.decode(data)
+        self.macaddr = ':'.join(f'{b:02x}' for b in ident.macaddr)
+        device_id = ident.idigi_device_id
+        self.idigi_device_id = f'{device_id[0:4].hex()}-{device_id[4:8].hex()}-{device_id[8:12].hex()}-{device_id[12:16].hex()}'.upper()
 
     def parse_panel_config_resp(self, data):
         """ parse_panel_config_resp(data) has been deprecated in favor of parse_device_configuration(data) """
@@ -543,26 +649,27 @@ class BalboaSpaWifi:
 
         """
 
+        before = CONFIG_TRACKER.snapshot(self)
+
+        config = DEVICE_CONFIG_LAYOUT.decode(data)
+
         # pumps 0-5
-        self.pump_array[0] = int((data[5] & 0x03))
-        self.pump_array[1] = int((data[5] & 0x0c) >> 2)
-        self.pump_array[2] = int((data[5] & 0x30) >> 4)
-        self.pump_array[3] = int((data[5] & 0xc0) >> 6)
-        self.pump_array[4] = int((data[6] & 0x03))
-        self.pump_array[5] = int((data[6] & 0xc0) >> 6)
+        self.pump_array[:] = (config.pump0, config.pump1, config.pump2,
+                              config.pump3, config.pump4, config.pump5)
 
         # lights 0-1
-        self.light_array[0] = int((data[7] & 0x03))
-        self.light_array[1] = int((data[7] >> 2) & 0x03)
+        self.light_array[:] = (config.light0, config.light1)
 
-        self.circ_pump = int((data[8] & 0x80) != 0)
-        self.blower = int((data[8] & 0x03) != 0)
-        self.mister = int((data[9] & 0x30) != 0)
+        self.circ_pump = config.circ_pump
+        self.blower = config.blower
+        self.mister = config.mister
 
-        self.aux_array[0] = int((data[9] & 0x01) != 0)
-        self.aux_array[1] = int((data[9] & 0x02) != 0)
+        self.aux_array[:] = (config.aux0, config.aux1)
 
         self.config_loaded = True
+        # which status fields are stored may have changed, look at them all
+        self.last_decoded.pop(BMTR_STATUS_UPDATE, None)
+        self.report_changes(BMTR_DEVICE_CONFIG_RESP, CONFIG_TRACKER, before)
 
     def parse_filter_cycle_info(self, data):
         """ Parse a filter cycle info response.
@@ -580,17 +687,15 @@ class BalboaSpaWifi:
         2D - filter cycle 2's duration hours
         2E - filter cycle 2's duration minutes
         """
-        self.filter1_hour = data[5]
-        self.filter1_minute = data[6]
-        self.filter1_duration_hours = data[7]
-        self.filter1_duration_minutes = data[8]
-        self.filter2_enabled = data[9] >> 7
-        self.filter2_hour = data[9] ^ (self.filter2_enabled << 7)
-        self.filter2_minute = data[10]
-        self.filter2_duration_hours = data[11]
-        self.filter2_duration_minutes = data[12]
-
-    async def parse_status_update(self, data):
+        before = FILTER_TRACKER.snapshot(self)
+        (self.filter1_hour, self.filter1_minute,
+         self.filter1_duration_hours, self.filter1_duration_minutes,
+         self.filter2_enabled, self.filter2_hour, self.filter2_minute,
+         self.filter2_duration_hours,
+         self.filter2_duration_minutes) = FILTER_LAYOUT.unpack(data)
+        self.report_changes(BMTR_FILTER_INFO_RESP, FILTER_TRACKER, before)
+
+    def parse_status_update(self, data):
         """ Parse a status update from the spa.
         Normally the spa spams these at a very high rate of speed. However,
         once in a while it will decide to just stop.  If you send it a panel
@@ -606,296 +711,69 @@ class BalboaSpaWifi:
 
         # If we don't know the config, just ask for it and wait for that
         if not self.config_loaded:
-            await self.send_panel_req(0, 1)
+            self.queue_message(*mtypes[BMTS_PANEL_REQ], 0, 0, 1)
             return
 
         # Check if the spa had anything new to say.
         # This will cause our internal states to update once per minute due
         # to the hour/minute counter.  This is ok.
-        have_new_data = False
-        if self.prior_status is not None:
-            for i in range(0, 31):
-                if data[i] != self.prior_status[i]:
-                    have_new_data = True
-                    break
-        else:
-            have_new_data = True
-            self.prior_status = bytearray(31)
-
-        if not have_new_data:
+        if self.repeated(data):
             return
-
-        if data[14] & 0x01:
-            self.tempscale = self.TSCALE_C
-        else:
-            self.tempscale = self.TSCALE_F
-
-        self.time_hour = data[8]
-        self.time_minute = data[9]
-        if data[14] & 0x02 == 0:
-            self.timescale = self.TIMESCALE_12H
-        else:
-            self.timescale = self.TIMESCALE_24H
-
-        temp = float(data[7])
-        settemp = float(data[25])
-        self.curtemp = temp / (2 if self.tempscale ==
-                               self.TSCALE_C else 1) if temp != 255 else None
-        self.settemp = settemp / (2 if self.tempscale == self.TSCALE_C else 1)
-
-        # flag 2 is heatmode
-        self.heatmode = data[10] & 0x03
-
-        # flag 3 is filter mode
-        self.filter_mode = (data[14] & 0x0c) >> 2
-
-        # flag 4 heating, temp range
-        self.heatstate = (data[15] & 0x30) >> 4
-        self.temprange = (data[15] & 0x04) >> 2
-
+        # flag 2 is heatmode, flag 3 scales and filter mode, flag 4
+        # heating and temp range
+        values = STATUS_LAYOUT.unpack(data)
+        (curtemp, self.time_hour, self.time_minute, self.heatmode,
+         self.tempscale, self.timescale, self.filter_mode,
+         self.temprange, self.heatstate,
+         pump0, pump1, pump2, pump3, pump4, pump5, circ_pump, blower,
+         light0, light1, mister, aux0, aux1,
+         settemp) = values
+
+        scale = 2 if self.tempscale == self.TSCALE_C else 1
+        self.curtemp = curtemp / scale if curtemp != 255 else None
+        self.settemp = settemp / scale
+
+        pumps = (pump0, pump1, pump2, pump3, pump4, pump5)
         for i in range(0, 6):
-            if not self.pump_array[i]:
-                continue
-            # 1-4 are in one byte, 5/6 are in another
-            if i < 4:
-                self.pump_status[i] = (data[16] >> i*2) & 0x03
-            else:
-                self.pump_status[i] = (data[17] >> ((i - 4)*2)) & 0x03
+            if self.pump_array[i]:
+                self.pump_status[i] = pumps[i]
 
         if self.circ_pump:
-            if data[18] == 0x02:
-                self.circ_pump_status = 1
-            else:
-                self.circ_pump_status = 0
+            self.circ_pump_status = 1 if circ_pump == 0x02 else 0
 
-        for i in range(0, 2):
-            if not self.light_array[i]:
-                continue
-            self.light_status[i] = ((data[19] >> i*2) & 0x03) >> 1
+        if self.light_array[0]:
+            self.light_status[0] = light0
+        if self.light_array[1]:
+            self.light_status[1] = light1
 
         if self.mister:
-            self.mister_status = data[20] & 0x01
+            self.mister_status = mister
 
         if self.blower:
-            self.blower_status = (data[18] & 0x0c) >> 2
+            self.blower_status = blower
 
-        for i in range(0, 2):
-            if not self.aux_array[i]:
-                continue
-            if i == 0:
-                self.aux_status[i] = data[20] & 0x08
-            else:
-                self.aux_status[i] = data[20] & 0x10
+        if self.aux_array[0]:
+            self.aux_status[0] = aux0
+        if self.aux_array[1]:
+            self.aux_status[1] = aux1
 
         self.lastupd = time.time()
-        # populate prior_status
-        for i in range(0, 31):
-            self.prior_status[i] = data[i]
-        await self.int_new_data_cb()
+        self.prior_status = self.last_frames[frame_mtype(data)]
+        self.report_decoded(BMTR_STATUS_UPDATE, STATUS_TRACKER, values)
+        self.emit(EVENT_NEW_DATA, BMTR_STATUS_UPDATE)
 
-    async def read_one_message(self):
-        """ Listen to the spa babble once."""
-        if not self.connected:
-            print("notconnected")
-            return None
-            
-
-
-        headerFound = False
-        rlen = 0
-        while not headerFound or rlen == 0:     
-            try:
-                header = await self.reader.readexactly(1)
-            except SocketError as err:
-                if err.errno == errno.ECONNRESET:
-                    self.log.error('Connection reset by peer')
-                elif err.errno == errno.EHOSTUNREACH:
-                    self.log.error('Spa unreachable')
-                elif err.errno == errno.EPIPE:
-                    self.log.error('Broken pipe')
-                else:
-                    self.log.error('Spa socket error: {0}'.format(str(err)))
-                self.connected = False
-                await self.int_new_data_cb()
-                return None
-            except Exception as e:
-                self.log.error('Spa read failed: {0}'.format(str(e)))
-                return None
-            if header[0] == M_STARTEND:
-                if headerFound: 
-                    self.dropped += 1
-                headerFound = True              
-            elif headerFound and header[0] != M_STARTEND:
-                rlen = header[0]
-            else:
-                self.dropped += 1
-                
-                
-        header = bytes([ M_STARTEND, rlen])
-
-        if rlen > 128:
-            print("Length Too Long: {}",format(rlen))
-            self.dropped = self.dropped + 2
-            return None
+    # Simple accessors
+    def get_model_name(self):
+        return self.model_name
 
-        # now get the rest of the data
-        try:
-            data = await self.reader.readexactly(rlen)
-        except Exception as e:
-            self.log.errpr('Spa read failed: {0}'.format(str(e)))
-            return None
+    def get_sw_vers(self):
+        return self.sw_vers
 
-        full_data = header + data
-        
-        #print("".join(map("{:02X} ".format, bytes(full_data))))
-              
-        # don't count M_STARTENDs or CHKSUM (remember that rlen is 2 short)
-        crc = self.balboa_calc_cs(full_data[1:], rlen-1)
-        if crc != full_data[-2]:
-            self.dropped = self.dropped + rlen + 2
-            self.crcerror = self.crcerror + 1
-            self.log.error('Message had bad CRC, discarding')
-            print("".join(map("{:02X} ".format, bytes(full_data))))
-            return None
+    def get_cfg_sig(self):
+        return self.cfg_sig
 
-        #self.log.error('got update: {}'.format(full_data.hex()))
-        return full_data
-
-    async def check_connection_status(self):
-        """ Set this up to periodically check the spa connection and fix. """
-        while True:
-            if not self.connected:
-                self.log.error("Lost connection to spa, attempting reconnect.")
-                await self.connect()
-                await asyncio.sleep(10)
-                continue
-            if (self.lastupd + 5 * self.sleep_time) < time.time():
-                self.log.error(
-                    "Spa stopped responding, requesting panel config.")
-                await self.send_panel_req(0, 1)
-            await asyncio.sleep(self.sleep_time)
-
-    async def listen(self):
-        """ Listen to the spa babble forever. """
-
-        while True:
-            if not self.connected:
-                # sleep and hope the checker fixes us
-                await asyncio.sleep(5)
-                continue
-
-            data = await self.read_one_message()
-            if data is None:
-                await asyncio.sleep(1)
-                continue
-
-            mtype = self.find_balboa_mtype(data)
-            if mtype is None:
-                self.log.error(f"Spa sent an unknown message: {data.hex()}")
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_MOD_IDENT_RESP:
-                self.parse_module_identification(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_STATUS_UPDATE:
-                await self.parse_status_update(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_DEVICE_CONFIG_RESP:
-                self.parse_device_configuration(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_SYS_INFO_RESP:
-                self.parse_system_information(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_SETUP_PARAMS_RESP:
-                self.parse_setup_parameters(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_FILTER_INFO_RESP:
-                self.parse_filter_cycle_info(data)
-                await asyncio.sleep(0.1)
-                continue
-            self.log.error("Unhandled mtype {0}".format(mtype))
-
-    async def spa_configured(self):
-        """Check if the spa has been configured.
-        Use in conjunction with listen.  First listen, then send some config
-        commands to set the spa up.
-        """
-        await self.send_mod_ident_req()  # request module identification
-        await self.send_panel_req(0, 1)  # request device configuration
-        await self.send_panel_req(2, 0)  # request system information
-        await self.send_panel_req(4, 0)  # request setup parameters
-        await self.send_panel_req(1, 0)  # request filter cycle info
-        while True:
-            if (self.connected
-                    and self.config_loaded
-                    and self.macaddr != 'Unknown'
-                    and self.curtemp != 0.0):
-                return
-            await asyncio.sleep(1)
-
-    async def listen_until_configured(self, maxiter=20):
-        """ Listen to the spa babble until we are configured."""
-
-        if not self.connected:
-            return False
-        for i in range(0, maxiter):
-            if (self.config_loaded and self.macaddr != 'Unknown'
-                    and self.curtemp != 0.0):
-                return True
-            data = await self.read_one_message()
-            if data is None:
-                await asyncio.sleep(1)
-                continue
-            mtype = self.find_balboa_mtype(data)
-
-            if mtype is None:
-                self.log.error(f"Spa sent an unknown message: {data.hex()}")
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_MOD_IDENT_RESP:
-                self.parse_module_identification(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_STATUS_UPDATE:
-                await self.parse_status_update(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_DEVICE_CONFIG_RESP:
-                self.parse_device_configuration(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_SYS_INFO_RESP:
-                self.parse_system_information(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_SETUP_PARAMS_RESP:
-                self.parse_setup_parameters(data)
-                await asyncio.sleep(0.1)
-                continue
-            if mtype == BMTR_FILTER_INFO_RESP:
-                self.parse_filter_cycle_info(data)
-                await asyncio.sleep(0.1)
-                continue
-            self.log.error("Unhandled mtype {0}".format(mtype))
-        return False
-
-    # Simple accessors
-    def get_model_name(self):
-        return self.model_name
-
-    def get_sw_vers(self):
-        return self.sw_vers
-
-    def get_cfg_sig(self):
-        return self.cfg_sig
-
-    def get_setup(self):
-        return self.setup
+    def get_setup(self):
+        return self.setup
 
     def get_ssid(self):
         return self.ssid
@@ -1110,3 +988,445 @@ class BalboaSpaWifi:
     def get_aux_list(self):
         """Return the actual aux list."""
         return self.aux_array
+
+
+BalboaProtocol.registry = MessageRegistry({
+    tuple(mtypes[BMTR_MOD_IDENT_RESP]): method_handler('parse_module_identification'),
+    tuple(mtypes[BMTR_STATUS_UPDATE]): method_handler('parse_status_update'),
+    tuple(mtypes[BMTR_DEVICE_CONFIG_RESP]): method_handler('parse_device_configuration'),
+    tuple(mtypes[BMTR_SYS_INFO_RESP]): method_handler('parse_system_information'),
+    tuple(mtypes[BMTR_SETUP_PARAMS_RESP]): method_handler('parse_setup_parameters'),
+    tuple(mtypes[BMTR_FILTER_INFO_RESP]): method_handler('parse_filter_cycle_info'),
+})
+
+
+class BalboaSpaWifi(BalboaProtocol):
+    def __init__(self, hostname, port=BALBOA_DEFAULT_PORT):
+        super().__init__()
+
+        # Connection states
+        self.host = hostname
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self.pending = deque()
+        self.new_data_cb = None
+        # field -> callbacks, see subscribe()
+        self.subscribers = {}
+        self.sleep_time = 60
+        # Seconds to pause after each message in listen().  None drains
+        # everything the spa has sent as fast as it arrives.
+        self.pacing = None
+        self.outbound = OutboundScheduler(self.write, SEND_RATE, log=self.log)
+        # CaptureWriter recording everything read, see start_capture()
+        self.capture = None
+
+    async def connect(self):
+        """ Connect to the spa."""
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.host,
+                                                                     self.port)
+        except (asyncio.TimeoutError, ConnectionRefusedError):
+            self.log.error("Cannot connect to spa at {0}:{1}".format(self.host,
+                                                                     self.port))
+            return False
+        except Exception as e:
+            self.log.error(
+                f'Error connecting to spa at {self.host}:{self.port}: {e}')
+            return False
+        self.decoder.reset()
+        self.pending.clear()
+        self.connected = True
+        return True
+
+    async def disconnect(self):
+        """ Stop talking to the spa."""
+        self.log.info("Disconnect requested")
+        self.connected = False
+        self.outbound.clear()
+        if not self.writer._loop.is_closed():
+            self.writer.close()
+            await self.writer.wait_closed()
+        await self.int_new_data_cb()
+
+    async def int_new_data_cb(self):
+        """ Internal new data callback.
+        Binds to self.new_data_cb()
+        """
+
+        if self.new_data_cb is None:
+            return
+        else:
+            await self.new_data_cb()
+
+    def subscribe(self, field, callback):
+        """ Call await callback(field, old, new) whenever field changes.
+
+        field is an attribute name such as 'curtemp' or 'pump_status', or
+        None for every change.  Unlike new_data_cb this is only called for
+        what actually changed.
+        """
+        self.subscribers.setdefault(field, []).append(callback)
+
+    def unsubscribe(self, field, callback):
+        callbacks = self.subscribers.get(field)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.subscribers[field]
+
+    async def notify_changes(self, changes):
+        """ Hand a change set to the callbacks subscribed to it. """
+        everything = self.subscribers.get(None, [])
+        for field, (old, new) in changes.items():
+            for callback in self.subscribers.get(field, []) + everything:
+                await callback(field, old, new)
+
+    async def send_config_req(self):
+        """ send_config_req() has been deprecated in favor of send_mod_ident_req() """
+        warnings.warn(
+            "send_config_req() has been deprecated in favor of send_mod_ident_req()", DeprecationWarning)
+        return await self.send_mod_ident_req()
+
+    async def send_mod_ident_req(self):
+        """ Ask for the module identification. """
+        await self.send_message(*mtypes[BMTS_CONFIG_REQ])
+
+    async def send_panel_req(self, ba, bb):
+        """ Send a panel request, 2 bytes of data.
+              0001020304 0506070809101112
+        0,1 - 7E0B0ABF2E 0A0001500000BF7E
+        2,0 - 7E1A0ABF24 64DC140042503230303047310451800C6B010A0200F97E
+        4,0 - 7E0E0ABF25 120432635068290341197E
+        """
+        await self.send_message(*mtypes[BMTS_PANEL_REQ], ba, 0, bb)
+
+    async def send_temp_change(self, newtemp):
+        """ Change the set temp to newtemp. """
+        # Check if the new temperature is valid for the current heat mode
+        if (newtemp < self.tmin[self.temprange][self.tempscale] or
+                newtemp > self.tmax[self.temprange][self.tempscale]):
+            self.log.error(
+                "Attempt to set temperature outside of heat mode boundary")
+            return
+
+        if self.tempscale == self.TSCALE_C:
+            newtemp *= 2.0
+
+        await self.send_message(*mtypes[BMTS_SET_TEMP], int(round(newtemp)))
+
+    async def change_light(self, light, newstate):
+        """ Change light #light to newstate. """
+        # sanity check
+        if (light > 1
+                or not self.light_array[light]
+                or self.light_status[light] == newstate):
+            return
+
+        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_LIGHT1 if light == 0 else C_LIGHT2, 0x00)
+
+    async def change_pump(self, pump, newstate):
+        """ Change pump #pump to newstate. """
+        # sanity check
+        if (pump > MAX_PUMPS
+                or newstate > self.pump_array[pump]
+                or self.pump_status[pump] == newstate):
+            return
+
+        # calculate how many times to push the button
+        iter = max(
+            (newstate-self.pump_status[pump]) % (self.pump_array[pump]+1), 1)
+        # now push the button that number of times
+        for i in range(0, iter):
+            await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_PUMP1 + pump, 0x00)
+
+    async def change_heatmode(self, newmode):
+        """Change the spa's heat mode.
+
+        A spa cannot be put into Ready in Rest (RNR). It can be in RNR, but you cannot
+        force it into RNR. It's a tri-state, but a binary switch.
+
+        :param newmode: The new heat mode.
+        """
+        # sanity check
+        if (newmode > 2
+                or self.heatmode == newmode
+                or newmode == self.HEATMODE_RNR):  # also can't change mode to Ready in Rest
+            return
+
+        # if currently in ready in rest and changing to ready, the first toggle
+        # will set the heat mode to rest, so we need to toggle an additional time
+        if (newmode == self.HEATMODE_READY and self.heatmode == self.HEATMODE_RNR):
+            await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_HEATMODE, 0x00)
+
+        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_HEATMODE, 0x00)
+
+    async def change_temperature_unit(self, temperature_unit):
+        """Change the spa's temperature unit.
+
+        :param temperature_unit: The new temperature unit.
+        """
+        # sanity check
+        if (temperature_unit > 1
+                or self.tempscale == temperature_unit):
+            return
+
+        await self.send_message(*mtypes[BMTS_SET_TSCALE], 0x01, temperature_unit)
+
+    async def change_temprange(self, newmode):
+        """ Change the spa's temprange to newmode. """
+        # sanity check
+        if (newmode > 1 or self.temprange == newmode):
+            return
+
+        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_TEMPRANGE, 0x00)
+
+    async def change_aux(self, aux, newstate):
+        """ Change aux #aux to newstate. """
+        # sanity check
+        if (aux > 1
+                or not self.aux_array[aux]
+                or self.aux_status[aux] == newstate):
+            return
+
+        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_AUX1 if aux == 0 else C_AUX2, 0x00)
+
+    async def change_mister(self, newmode):
+        """ Change the spa's mister to newmode. """
+        # sanity check
+        if (newmode > 1
+                or self.mister == newmode):
+            return
+
+        await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_MISTER, 0x00)
+
+    async def change_blower(self, newstate):
+        """ Change blower to newstate. """
+        # sanity check
+        if (not self.have_blower()
+                or self.blower_status == newstate
+                or newstate > 3):
+            return
+
+        # toggle until we hit the desired state
+        for i in range(0, ((newstate-self.blower_status) % 4)):
+            await self.send_message(*mtypes[BMTS_CONTROL_REQ], C_BLOWER, 0x00)
+
+    async def set_time(self, new_time, timescale=None):
+        """ Set time on spa to new_time with optional timescale. """
+        # sanity check
+        if (not isinstance(new_time, time.struct_time)):
+            return
+
+        await self.send_message(*mtypes[BMTS_SET_TIME],
+                                ((self.timescale if timescale is None else timescale)
+                                 << 7) + new_time.tm_hour,
+                                new_time.tm_min)
+
+    def message_cost(self, *bytes):
+        """ How much of the module's send budget a message uses. """
+        mtype = list(bytes[0:3])
+        if mtype == mtypes[BMTS_CONFIG_REQ] or mtype == mtypes[BMTS_PANEL_REQ]:
+            return 0
+        if (mtype == mtypes[BMTS_CONTROL_REQ]
+                and C_PUMP1 <= bytes[3] <= C_PUMP6):
+            return PUMP_PRESS_COST
+        return PRESS_COST
+
+    async def send_message(self, *bytes):
+        """ Sends a message to the spa with variable length bytes.
+
+        The message is paced and coalesced with anything else going out, this
+        returns once it is on the wire: True if it was sent.
+        """
+        # if not connected, we can't send a message
+        if not self.connected:
+            return False
+
+        data = self.encode_message(*bytes)
+
+        self.log.debug(f'Sending message: {data.hex()}')
+        return await self.outbound.send(data, self.message_cost(*bytes))
+
+    async def write(self, data):
+        """ Put data on the wire, True if that worked. """
+        if not self.connected:
+            return False
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except Exception as e:
+            self.log.error(f'Error sending message: {e}')
+            return False
+        return True
+
+    async def flush(self):
+        """ Write out whatever the protocol core has queued for the spa. """
+        if not self.outgoing:
+            return
+        data = self.data_to_send()
+        if not self.connected:
+            return
+        await self.outbound.send(data, 0)
+
+    async def dispatch_events(self, events):
+        """ Let the outside world know about protocol events. """
+        for event in events:
+            if event.kind == EVENT_NEW_DATA:
+                await self.int_new_data_cb()
+            elif event.kind == EVENT_CHANGED and self.subscribers:
+                await self.notify_changes(event.data)
+
+    async def read_messages(self):
+        """ Read whatever the spa has sent and return all complete frames.
+
+        Returns an empty list if only part of a frame has arrived so far,
+        or None if the read failed.  The frames are views into the decoder's
+        buffer and are only good until the next read.
+        """
+        if not self.connected:
+            return None
+
+        # hand back anything read_one_message() left behind first
+        if self.pending:
+            frames = list(self.pending)
+            self.pending.clear()
+            return frames
+
+        try:
+            chunk = await self.reader.read(READ_CHUNK_SIZE)
+        except SocketError as err:
+            if err.errno == errno.ECONNRESET:
+                self.log.error('Connection reset by peer')
+            elif err.errno == errno.EHOSTUNREACH:
+                self.log.error('Spa unreachable')
+            elif err.errno == errno.EPIPE:
+                self.log.error('Broken pipe')
+            else:
+                self.log.error('Spa socket error: {0}'.format(str(err)))
+            self.connected = False
+            await self.int_new_data_cb()
+            return None
+        except Exception as e:
+            self.log.error('Spa read failed: {0}'.format(str(e)))
+            return None
+
+        if not chunk:
+            self.log.error('Spa closed the connection')
+            self.connected = False
+            await self.int_new_data_cb()
+            return None
+
+        if self.capture is not None:
+            self.capture.record(chunk)
+        return self.decoder.feed(chunk)
+
+    def start_capture(self, path):
+        """ Record everything the spa sends to path, for replaying later.
+
+        See capture.ReplayTransport.
+        """
+        self.stop_capture()
+        self.capture = CaptureWriter(path)
+
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    async def read_one_message(self):
+        """ Listen to the spa babble once."""
+        while not self.pending:
+            frames = await self.read_messages()
+            if frames is None:
+                return None
+            # the decoder hands out views into its buffer, which only live
+            # until the next read, so hold on to copies
+            self.pending.extend(bytes(frame) for frame in frames)
+        return self.pending.popleft()
+
+    async def check_connection_status(self):
+        """ Set this up to periodically check the spa connection and fix. """
+        while True:
+            if not self.connected:
+                self.log.error("Lost connection to spa, attempting reconnect.")
+                await self.connect()
+                await asyncio.sleep(10)
+                continue
+            if (self.lastupd + 5 * self.sleep_time) < time.time():
+                self.log.error(
+                    "Spa stopped responding, requesting panel config.")
+                await self.send_panel_req(0, 1)
+            await asyncio.sleep(self.sleep_time)
+
+    async def process_message(self, data):
+        """ Decode a single frame and act on the result. """
+        self.handle_message(data)
+        await self.flush()
+        if self.events:
+            await self.dispatch_events(self.next_events())
+        if self.pacing:
+            await asyncio.sleep(self.pacing)
+
+    async def listen(self):
+        """ Listen to the spa babble forever. """
+
+        while True:
+            if not self.connected:
+                # sleep and hope the checker fixes us
+                await asyncio.sleep(5)
+                continue
+
+            frames = await self.read_messages()
+            if frames is None:
+                await asyncio.sleep(1)
+                continue
+
+            for data in frames:
+                await self.process_message(data)
+            # the stream won't yield to other tasks while it has data
+            # buffered, so give them a turn between reads
+            await asyncio.sleep(0)
+
+    def configured(self):
+        """ Have we heard everything spa_configured() asks for? """
+        return (self.connected
+                and self.config_loaded
+                and self.macaddr != 'Unknown'
+                and self.curtemp != 0.0)
+
+    async def send_config_requests(self):
+        """ Ask the spa for everything we need to know about it. """
+        await self.send_mod_ident_req()  # request module identification
+        await self.send_panel_req(0, 1)  # request device configuration
+        await self.send_panel_req(2, 0)  # request system information
+        await self.send_panel_req(4, 0)  # request setup parameters
+        await self.send_panel_req(1, 0)  # request filter cycle info
+
+    async def spa_configured(self):
+        """Check if the spa has been configured.
+        Use in conjunction with listen.  First listen, then send some config
+        commands to set the spa up.
+        """
+        await self.send_config_requests()
+        while True:
+            if self.configured():
+                return
+            await asyncio.sleep(1)
+
+    async def listen_until_configured(self, maxiter=20):
+        """ Listen to the spa babble until we are configured."""
+
+        if not self.connected:
+            return False
+        for i in range(0, maxiter):
+            if (self.config_loaded and self.macaddr != 'Unknown'
+                    and self.curtemp != 0.0):
+                return True
+            data = await self.read_one_message()
+            if data is None:
+                await asyncio.sleep(1)
+                continue
+            await self.process_message(data)
+        return False
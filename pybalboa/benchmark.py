@@ -0,0 +1,595 @@
+""" Offline micro-benchmarks for the hot paths of pybalboa.
+
+Run with:  python -m pybalboa.benchmark [--json out.json] [--compare old.json]
+
+Everything runs on the fixed frames below, no spa needed.  Times are the
+best of several runs in ns per frame, allocations the peak bytes per frame
+while handling a batch.  Save the results of a release with --json and
+check a later tree against them with --compare.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from collections import deque
+
+try:
+    from .balboa import (BalboaSpaWifi, BMTR_STATUS_UPDATE, BMTS_CONTROL_REQ,
+                         BMTS_SET_TEMP, C_PUMP1, READ_CHUNK_SIZE,
+                         STATUS_LAYOUT, STATUS_TRACKER,
+                         build_frame as encode_uncached, encode_frame, mtypes)
+    from . import bulk
+    from .checksum import calc_cs, calc_cs_bitwise, verify_frames
+    from .emulator import SpaEmulator
+    from .fleet import ONLINE, SpaFleet
+    from .framing import FrameDecoder, M_STARTEND
+    from .sundance_emulator import EmulatedTub, SundanceBus
+    from .sundanceRS485 import LazySundanceProtocol, SundanceProtocol
+    from .xorcodec import xor_decode, xor_encode
+except ImportError:
+    from balboa import (BalboaSpaWifi, BMTR_STATUS_UPDATE, BMTS_CONTROL_REQ,
+                        BMTS_SET_TEMP, C_PUMP1, READ_CHUNK_SIZE,
+                        STATUS_LAYOUT, STATUS_TRACKER,
+                        build_frame as encode_uncached, encode_frame, mtypes)
+    import bulk
+    from checksum import calc_cs, calc_cs_bitwise, verify_frames
+    from emulator import SpaEmulator
+    from fleet import ONLINE, SpaFleet
+    from framing import FrameDecoder, M_STARTEND
+    from sundance_emulator import EmulatedTub, SundanceBus
+    from sundanceRS485 import LazySundanceProtocol, SundanceProtocol
+    from xorcodec import xor_decode, xor_encode
+
+# Real frames captured off a Sundance 780 and a Bullfrog Stil7.
+SAMPLE_FRAMES = [
+    # Sundance C4 status update
+    bytes.fromhex('7E26FFAFC4AEA7AAABA4A1C95DA5A1C2A19CBDCEBBE2B9BBADB4B5A7B7DF'
+                  'B1B29BD38D8E8F88F97E'),
+    # Sundance CA light status update
+    bytes.fromhex('7E22FFAFCA8A36CACBC4C5C6FBC0C1C23CDCDDDEDFD8D9DADBD4D5D6D7D0'
+                  'D1D2D3ECE57E'),
+    # Jacuzzi 16 status update
+    bytes.fromhex('7E25FFAF161012270B16420026FA260A140181000042011C00098000000A'
+                  '000000FF0000002F7E'),
+    # Balboa device configuration response
+    bytes.fromhex('7E0B0ABF2E0A0001500000BF7E'),
+    # Balboa system information response
+    bytes.fromhex('7E1A0ABF2464DC140042503230303047310451800C6B010A0200F97E'),
+]
+C4_FRAME = SAMPLE_FRAMES[0]
+CA_FRAME = SAMPLE_FRAMES[1]
+
+# A regression is anything this much worse than the baseline
+REGRESSION_THRESHOLD = 1.25
+
+
+def bench(func, number=None, repeat=5):
+    """ Time func() and return the best ns per call. """
+    timer = timeit.Timer(func)
+    if number is None:
+        number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best * 1e9 / number
+
+
+def bench_crc(frames=SAMPLE_FRAMES):
+    """ Compare the bit-by-bit and table driven checksum over real frames. """
+    def run(calc):
+        def inner():
+            for frame in frames:
+                rlen = frame[1]
+                calc(frame[1:], rlen - 1)
+        return inner
+
+    for frame in frames:
+        assert calc_cs(frame[1:], frame[1] - 1) == \
+            calc_cs_bitwise(frame[1:], frame[1] - 1)
+
+    n = len(frames)
+    results = {
+        'crc_bitwise': bench(run(calc_cs_bitwise)) / n,
+        'crc_table': bench(run(calc_cs)) / n,
+        'crc_verify_frames': bench(lambda: verify_frames(frames)) / n,
+    }
+    return results
+
+
+def alloc_per_frame(func, nframes):
+    """ Peak and retained bytes allocated per frame by one call of func. """
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return (peak - before) / nframes, (after - before) / nframes
+
+
+async def legacy_read_frames(reader):
+    """ The old read_one_message() framing: an awaited readexactly(1) per
+    header byte, then one for the rest of the frame, until reader runs dry.
+    """
+    frames = []
+    while True:
+        header_found = False
+        rlen = 0
+        try:
+            while not header_found or rlen == 0:
+                header = await reader.readexactly(1)
+                if header[0] == M_STARTEND:
+                    header_found = True
+                elif header_found:
+                    rlen = header[0]
+            data = await reader.readexactly(rlen)
+        except asyncio.IncompleteReadError:
+            return frames
+        full_data = bytes([M_STARTEND, rlen]) + data
+        if calc_cs(full_data[1:], rlen - 1) != full_data[-2]:
+            continue
+        frames.append(full_data)
+
+
+async def decoder_read_frames(reader, decoder):
+    """ What read_messages() does now: a socket read at a time through the
+    frame decoder, until reader runs dry.  Returns how many frames.
+    """
+    frames = 0
+    while True:
+        chunk = await reader.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return frames
+        for frame in decoder.iter_frames(chunk):
+            frames += 1
+
+
+def bench_framing(frames=SAMPLE_FRAMES, copies=200):
+    """ Byte-at-a-time framing against the buffered frame decoder, both
+    reading an asyncio.StreamReader like the client reads its socket.
+    """
+    stream = b''.join(frames) * copies
+    n = len(frames) * copies
+    decoder = FrameDecoder()
+    loop = asyncio.new_event_loop()
+
+    def reader_for(data):
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(data)
+        reader.feed_eof()
+        return reader
+
+    def legacy(data=stream):
+        return loop.run_until_complete(legacy_read_frames(reader_for(data)))
+
+    def buffered(data=stream):
+        return loop.run_until_complete(
+            decoder_read_frames(reader_for(data), decoder))
+
+    try:
+        assert len(legacy()) == buffered() == n
+        results = {
+            'framing_legacy': bench(legacy, repeat=3) / n,
+            'framing_decoder': bench(buffered, repeat=3) / n,
+        }
+        one_read = stream[:READ_CHUNK_SIZE]
+        per_read = len(FrameDecoder().feed(one_read))
+        decoder.reset()
+        results['framing_legacy_peak_bytes'], _ = alloc_per_frame(
+            lambda: legacy(one_read), per_read)
+        results['framing_decoder_peak_bytes'], _ = alloc_per_frame(
+            lambda: buffered(one_read), per_read)
+    finally:
+        loop.close()
+    return results
+
+
+def bench_encode():
+    """ Building a command frame from scratch against the frame cache. """
+    button = (*mtypes[BMTS_CONTROL_REQ], C_PUMP1, 0x00)
+    settemp = (*mtypes[BMTS_SET_TEMP], 100)
+    assert encode_frame(*button) == encode_uncached(*button)
+    assert encode_frame(*settemp) == encode_uncached(*settemp)
+    return {
+        'encode_button_uncached': bench(lambda: encode_uncached(*button)),
+        'encode_button_cached': bench(lambda: encode_frame(*button)),
+        'encode_settemp_uncached': bench(lambda: encode_uncached(*settemp)),
+        'encode_settemp_cached': bench(lambda: encode_frame(*settemp)),
+    }
+
+
+def bench_per_frame(name, handle, frames, copies=100):
+    """ Time handle(frame) over frames, and what it allocates doing so. """
+    batch = list(frames) * copies
+
+    def run():
+        for frame in batch:
+            handle(frame)
+
+    return {
+        name: bench(run, repeat=3) / len(batch),
+        name + '_peak_bytes': alloc_per_frame(run, len(batch))[0],
+    }
+
+
+def bench_read_one_message(frames=SAMPLE_FRAMES, copies=200):
+    """ BalboaSpaWifi.read_one_message() over an in-memory stream. """
+    stream = b''.join(frames) * copies
+    n = len(frames) * copies
+
+    async def run():
+        spa = BalboaSpaWifi('benchmark')
+        spa.reader = asyncio.StreamReader()
+        spa.reader.feed_data(stream)
+        spa.reader.feed_eof()
+        spa.connected = True
+        start = time.perf_counter_ns()
+        for i in range(n):
+            await spa.read_one_message()
+        return time.perf_counter_ns() - start
+
+    return {
+        'read_one_message': min(asyncio.run(run()) for i in range(3)) / n,
+    }
+
+
+def legacy_xormsg(data):
+    """ SundanceProtocol.xormsg() as it was, a list built a pair at a time,
+    as the baseline for the xormsg row.
+    """
+    lst = []
+    for i in range(0, len(data) - 1, 2):
+        lst.append(data[i] ^ data[i + 1] ^ 1)
+    return lst
+
+
+def bench_parsing():
+    """ The per message work: checksums, type lookup, parsers, decoding. """
+    spa = BalboaSpaWifi('benchmark')
+    spa.config_loaded = True
+    status = [status_frame(minute) for minute in range(2)]
+
+    def parse_status(frame):
+        spa.parse_status_update(frame)
+        spa.events.clear()
+
+    # what change tracking adds to a status update whose minute ticked:
+    # diffing the decoded tuple, checking the attribute and publishing
+    decoded = [STATUS_LAYOUT.unpack(frame) for frame in status]
+    minute = STATUS_LAYOUT.names.index('time_minute')
+
+    def track_status(values):
+        spa.time_minute = values[minute]
+        spa.report_decoded(BMTR_STATUS_UPDATE, STATUS_TRACKER, values)
+        spa.events.clear()
+
+    sundance = SundanceProtocol()
+
+    def parse_c4(frame):
+        sundance.parse_C4status_update(frame)
+        sundance.events.clear()
+
+    # two C4 updates a degree apart, so every one has to be decoded
+    values = bytearray(xor_decode(C4_FRAME[5:len(C4_FRAME) - 2]))
+    values[5] ^= 1
+    c4_frames = [C4_FRAME, encode_uncached(
+        *C4_FRAME[2:5], *xor_encode(values, len(C4_FRAME) - 7))]
+
+    lazy = LazySundanceProtocol()
+
+    def parse_c4_lazy(frame):
+        # what most callers look at
+        lazy.parse_C4status_update(frame)
+        lazy.curtemp, lazy.settemp, lazy.pump_status
+        lazy.events.clear()
+
+    def parse_ca(frame):
+        sundance.parse_CA_light_status_update(frame)
+        sundance.events.clear()
+
+    body = C4_FRAME[5:len(C4_FRAME) - 2]
+
+    results = {}
+    results.update(bench_per_frame(
+        'balboa_calc_cs',
+        lambda frame: spa.balboa_calc_cs(frame[1:], frame[1] - 1),
+        SAMPLE_FRAMES))
+    results.update(bench_per_frame(
+        'find_balboa_mtype', spa.find_balboa_mtype, SAMPLE_FRAMES[3:]))
+    results.update(bench_per_frame(
+        'parse_status_update', parse_status, status))
+    results.update(bench_per_frame(
+        'parse_status_update_repeated', parse_status, status[:1]))
+    results.update(bench_per_frame(
+        'status_change_tracking', track_status, decoded))
+    results.update(bench_per_frame(
+        'status_layout_unpack', STATUS_LAYOUT.unpack, status))
+    results.update(bench_per_frame(
+        'parse_C4status_update', parse_c4, [C4_FRAME]))
+    results.update(bench_per_frame(
+        'parse_C4status_update_changing', parse_c4, c4_frames))
+    results.update(bench_per_frame(
+        'parse_C4status_update_lazy', parse_c4_lazy, c4_frames))
+    results.update(bench_per_frame(
+        'parse_CA_light_status_update', parse_ca, [CA_FRAME]))
+    results.update(bench_per_frame(
+        'xormsg', lambda frame: sundance.xormsg(body), [C4_FRAME]))
+    results.update(bench_per_frame(
+        'xormsg_legacy', lambda frame: legacy_xormsg(body), [C4_FRAME]))
+    results.update(bench_per_frame(
+        'xor_decode', lambda frame: xor_decode(frame[5:len(frame) - 2]),
+        [C4_FRAME, CA_FRAME]))
+    values = xor_decode(body)
+    results.update(bench_per_frame(
+        'xor_encode', lambda frame: xor_encode(values, len(body)), [C4_FRAME]))
+    return results
+
+
+def setpoint_trips(plan, start=100, target=90):
+    """ Trips round the emulated bus a Sundance takes to change its set
+    temperature, with a topside that needs waking first.
+    """
+    bus = SundanceBus(tub=EmulatedTub(settemp=start, wake=True), seed=1)
+    spa = SundanceProtocol()
+    spa.actuators['settemp'].plan = plan
+    assert bus.drive(spa, lambda spa: spa.channel in spa.discoveredChannels
+                     and spa.settemp == start)
+    spa.set_target('settemp', target)
+    trips = bus.drive(spa, lambda spa: spa.settemp == target)
+    # and it has to stay there
+    bus.drive(spa, lambda spa: not spa.actuators.active())
+    assert bus.tub.settemp == target
+    return trips
+
+
+def bench_setpoint():
+    """ Time to setpoint, a press at a time and planned in one burst. """
+    return {
+        'setpoint_stepwise_trips': setpoint_trips(False),
+        'setpoint_planned_trips': setpoint_trips(True),
+    }
+
+
+def status_frame(minute=0, curtemp=100, settemp=102):
+    """ A BMTR_STATUS_UPDATE frame, the minute makes each one differ. """
+    message = STATUS_LAYOUT.pack(29, curtemp=curtemp,
+                                 time_hour=minute // 60 % 24,
+                                 time_minute=minute % 60, settemp=settemp)
+    message[2:5] = mtypes[BMTR_STATUS_UPDATE]
+    return encode_uncached(*message[2:])
+
+
+class NullWriter:
+    """ Stands in for the StreamWriter when nothing needs to be sent. """
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+
+async def run_listen(pacing, rate, burst, duration):
+    """ Feed BalboaSpaWifi.listen() status bursts, measure what it keeps up
+    with.  Returns (frames per second handled, mean and max queueing delay).
+    """
+    spa = BalboaSpaWifi('benchmark')
+    spa.pacing = pacing
+    spa.config_loaded = True
+    spa.reader = asyncio.StreamReader()
+    spa.writer = NullWriter()
+    spa.connected = True
+
+    sent = deque()
+    delays = []
+
+    def handled(spa, data):
+        delays.append(time.monotonic() - sent.popleft())
+        spa.parse_status_update(data)
+    spa.register_handler(mtypes[BMTR_STATUS_UPDATE], handled)
+
+    async def produce():
+        minute = 0
+        while True:
+            chunk = b''
+            now = time.monotonic()
+            for i in range(burst):
+                chunk += status_frame(minute)
+                sent.append(now)
+                minute += 1
+            spa.reader.feed_data(chunk)
+            await asyncio.sleep(burst / rate)
+
+    producer = asyncio.ensure_future(produce())
+    listener = asyncio.ensure_future(spa.listen())
+    await asyncio.sleep(duration)
+    producer.cancel()
+    listener.cancel()
+    await asyncio.gather(producer, listener, return_exceptions=True)
+    if not delays:
+        return 0.0, 0.0, 0.0
+    return (len(delays) / duration, sum(delays) / len(delays), max(delays))
+
+
+def bench_listen(rate=200, burst=10, duration=2.0):
+    """ listen() with the old 100 ms pacing against draining everything. """
+    results = {}
+    for name, pacing in (('listen_paced', 0.1), ('listen_drain', None)):
+        fps, mean, worst = asyncio.run(
+            run_listen(pacing, rate, burst, duration))
+        results[name + '_fps'] = fps
+        results[name + '_delay_ms'] = mean * 1000
+        results[name + '_max_delay_ms'] = worst * 1000
+    return results
+
+
+async def run_fleet(size, rate, duration):
+    """ Bring a fleet of size spas up against the emulator, then let it run.
+
+    Returns (python heap bytes per spa once everything is online, CPU
+    seconds per spa per second of running, seconds to bring it all up).
+    Both include the emulator's end of every connection, so they're upper
+    bounds.
+    """
+    emulator = SpaEmulator(port=0, rate=rate)
+    await emulator.start()
+    fleet = SpaFleet(stagger=0.002)
+    start = time.monotonic()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        for i in range(size):
+            fleet.add(i, BalboaSpaWifi('127.0.0.1', emulator.port))
+        await fleet.start()
+        while fleet.summary().get(ONLINE, 0) < size:
+            await asyncio.sleep(0.05)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    rampup = time.monotonic() - start
+
+    cpu = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+
+    await fleet.stop()
+    await emulator.stop()
+    return (after - before) / size, cpu / size / duration, rampup
+
+
+def bench_fleet(sizes=(10, 100, 300), rate=3.0, duration=3.0):
+    """ Memory and CPU per connected spa as the fleet grows. """
+    results = {}
+    for size in sizes:
+        memory, cpu, rampup = asyncio.run(run_fleet(size, rate, duration))
+        results['fleet_{0}_memory_per_spa'.format(size)] = memory
+        results['fleet_{0}_cpu_per_spa'.format(size)] = cpu * 1e6
+        results['fleet_{0}_rampup_ms'.format(size)] = rampup * 1000
+    return results
+
+
+def bench_bulk(copies=2000):
+    """ Decoding a recording of status frames one by one, and in bulk. """
+    frames = [status_frame(minute, curtemp=90 + minute % 10)
+              for minute in range(60)]
+    stream = b''.join(frames) * copies
+    n = len(frames) * copies
+
+    def objects():
+        spa = BalboaSpaWifi('benchmark')
+        spa.config_loaded = True
+        for frame in spa.decoder.iter_frames(stream):
+            spa.parse_status_update(frame)
+            spa.events.clear()
+
+    def columns():
+        return bulk.FrameBatch(stream).status()
+
+    assert len(columns()['curtemp']) == n
+    return {
+        'bulk_status_objects': bench(objects, repeat=1) / n,
+        'bulk_status_numpy': bench(columns, repeat=3) / n,
+    }
+
+
+def unit(name):
+    if name.endswith('_memory_per_spa'):
+        return 'bytes/spa'
+    if name.endswith('_cpu_per_spa'):
+        return 'us cpu/s/spa'
+    if name.endswith('_bytes'):
+        return 'bytes/frame'
+    if name.endswith('_fps'):
+        return 'frames/s'
+    if name.endswith('_ms'):
+        return 'ms'
+    if name.endswith('_trips'):
+        return 'bus trips'
+    return 'ns/frame'
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """ Names of the results that got worse than baseline by threshold. """
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not old or not value:
+            continue
+        # frames per second is the only thing where more is better
+        if name.endswith('_fps'):
+            ratio = old / value
+        else:
+            ratio = value / old
+        # allocation sizes are tiny and jitter, give them a few bytes slack
+        if name.endswith('_bytes') and value - old < 8:
+            continue
+        if ratio > threshold:
+            regressions.append((name, old, value, ratio))
+    return regressions
+
+
+def run_all(listen=True, fleet=False):
+    results = bench_crc()
+    results.update(bench_framing())
+    results.update(bench_read_one_message())
+    results.update(bench_parsing())
+    results.update(bench_encode())
+    results.update(bench_setpoint())
+    if listen:
+        results.update(bench_listen())
+    if fleet:
+        results.update(bench_fleet())
+    if bulk.np is not None:
+        results.update(bench_bulk())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--json', metavar='PATH',
+                        help='save the results to PATH')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare against results saved earlier')
+    parser.add_argument('--no-listen', action='store_true',
+                        help='skip the listen() throughput test, which '
+                             'takes a few seconds')
+    parser.add_argument('--fleet', action='store_true',
+                        help='also measure CPU and memory per spa for a '
+                             'growing SpaFleet, takes about half a minute')
+    args = parser.parse_args(argv)
+
+    results = run_all(listen=not args.no_listen, fleet=args.fleet)
+    for name, value in results.items():
+        print('{0:<40} {1:>10.{3}f} {2}'.format(
+            name, value, unit(name), 1 if unit(name) == 'ms' else 0))
+    print('{0:<40} {1:>10.1f}x'.format(
+        'table speedup', results['crc_bitwise'] / results['crc_table']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline)
+        for name, old, new, ratio in regressions:
+            print('REGRESSION {0}: {1:.0f} -> {2:.0f} {3} ({4:.2f}x)'.format(
+                name, old, new, unit(name), ratio))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
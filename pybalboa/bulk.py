@@ -0,0 +1,328 @@
+""" Decode recorded frames in bulk, as numpy column arrays.
+
+Going through parse_status_update() one frame at a time is fine for a live
+spa but far too slow for months of captures.  Here a whole capture is
+loaded into one uint8 array, frames are found and CRC checked for all of
+them at once, and every frame of a type ends up as a row of a 2-D array,
+so each field decodes for the whole batch in one numpy operation:
+
+    batch = load_capture('pool.cap')
+    status = batch.status()
+    status['curtemp'], status['pump'][:, 0], status['ts'] ...
+
+numpy is optional, install it with pip install pybalboa[bulk].  Nothing
+else in pybalboa needs it.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from .capture import MAGIC, RECORD, CaptureReader
+    from .checksum import CRC_TABLE, CRC_XOR_IN, CRC_XOR_OUT
+    from .dispatch import pack_mtype
+    from .framing import MAX_FRAME_LENGTH, M_STARTEND
+except ImportError:
+    from capture import MAGIC, RECORD, CaptureReader
+    from checksum import CRC_TABLE, CRC_XOR_IN, CRC_XOR_OUT
+    from dispatch import pack_mtype
+    from framing import MAX_FRAME_LENGTH, M_STARTEND
+
+BALBOA_STATUS = pack_mtype([0xFF, 0xAF, 0x13])
+SUNDANCE_STATUS = pack_mtype([0xFF, 0xAF, 0xC4])
+SUNDANCE_LIGHTS = pack_mtype([0xFF, 0xAF, 0xCA])
+JACUZZI_STATUS = pack_mtype([0xFF, 0xAF, 0x16])
+JACUZZI_LIGHTS = pack_mtype([0xFF, 0xAF, 0x23])
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError('Bulk decoding needs numpy, '
+                          'pip install pybalboa[bulk]')
+
+
+def find_frames(buf):
+    """ Start offsets and lengths of everything in buf shaped like a frame.
+
+    A frame is 7E LL ... 7E with the second 7E LL + 1 bytes on.  The spa
+    doesn't escape 7E inside frames, so a few of these are just body bytes
+    that happen to line up; the CRC check weeds those out.
+    """
+    n = len(buf)
+    starts = np.flatnonzero(buf[:n - 1] == M_STARTEND)
+    lengths = buf[starts + 1].astype(np.intp)
+    ends = starts + lengths + 1
+    # long enough for a message type, short enough to believe
+    ok = (lengths >= 5) & (lengths <= MAX_FRAME_LENGTH) & (ends < n)
+    starts, lengths, ends = starts[ok], lengths[ok], ends[ok]
+    ok = buf[ends] == M_STARTEND
+    return starts[ok], lengths[ok]
+
+
+def crc_ok(rows):
+    """ Check the CRC of every row of a (N, LL + 2) array of whole frames. """
+    table = np.array(CRC_TABLE, dtype=np.uint8)
+    width = rows.shape[1]
+    # one table lookup per column, for every frame at once; columns are
+    # much quicker to walk laid out one after the other
+    columns = np.ascontiguousarray(rows[:, 1:width - 2].T)
+    crc = np.full(len(rows), CRC_XOR_IN, dtype=np.uint8)
+    for column in columns:
+        np.bitwise_xor(crc, column, out=crc)
+        crc = table[crc]
+    return (crc ^ CRC_XOR_OUT) == rows[:, width - 2]
+
+
+def xor_decode(rows):
+    """ SundanceProtocol.xormsg() for every row: body pairs XOR'd with 1. """
+    body = rows[:, 5:rows.shape[1] - 2]
+    pairs = body.shape[1] // 2
+    return body[:, 0:2 * pairs:2] ^ body[:, 1:2 * pairs:2] ^ 1
+
+
+def temperatures(raw, celsius):
+    """ Raw temperature bytes to degrees; 255 (no reading) becomes nan. """
+    temp = raw.astype(np.float64)
+    temp[raw == 255] = np.nan
+    return np.where(celsius, temp / 2, temp)
+
+
+def windows(buf, width):
+    """ Every width bytes long slice of buf, as a view without copying. """
+    return np.lib.stride_tricks.sliding_window_view(buf, width)
+
+
+def overlaps(starts, ends):
+    """ Sort out good frames that overlap, first come first served.
+
+    Returns None when nothing overlaps, which is nearly always, or a keep
+    mask.  Only the frames caught up in an overlap go through Python.
+    """
+    reach = np.maximum.accumulate(ends)
+    clash = np.zeros(len(starts), dtype=bool)
+    clash[1:] = starts[1:] <= reach[:-1]
+    if not clash.any():
+        return None
+    keep = ~clash
+    which = np.flatnonzero(clash)
+    # the last frame before each clash that nothing overlapped, it stays
+    heads = np.maximum.accumulate(np.where(clash, 0, np.arange(len(starts))))
+    last = -1
+    for i, start, end, head_end in zip(which.tolist(),
+                                       starts[which].tolist(),
+                                       ends[which].tolist(),
+                                       ends[heads[which]].tolist()):
+        last = max(last, head_end)
+        if start > last:
+            keep[i] = True
+            last = end
+    return keep
+
+
+class FrameBatch:
+    """ Every good frame found in a buffer, grouped by type and length.
+
+    buf is anything numpy can view as bytes.  stamps, if given, is a pair
+    of arrays (offsets, ts_ns): the offset in buf where each read started
+    and when it arrived, so every frame gets the time it was completed.
+
+    A frame that overlaps an earlier good one is dropped, which is how a 7E
+    inside a body that happens to look like a frame start is dealt with.
+    Unlike FrameDecoder a frame with a bad CRC doesn't hide what is inside
+    it, so on a noisy line the two can disagree about the odd frame.
+    """
+
+    def __init__(self, buf, stamps=None):
+        require_numpy()
+        buf = np.frombuffer(buf, dtype=np.uint8)
+        starts, lengths = find_frames(buf)
+        ends = starts + lengths + 1
+        self.candidates = len(starts)
+
+        # CRC check every candidate of a length in one go, and keep the
+        # rows for grouping later
+        good = np.zeros(len(starts), dtype=bool)
+        by_length = []
+        for length in np.unique(lengths).tolist():
+            which = np.flatnonzero(lengths == length)
+            rows = windows(buf, length + 2)[starts[which]]
+            ok = crc_ok(rows)
+            good[which[ok]] = True
+            by_length.append((length, which[ok], rows[ok]))
+        self.crcerror = int(len(starts) - good.sum())
+
+        chosen = good
+        good = np.flatnonzero(good)
+        keep = overlaps(starts[good], ends[good])
+        if keep is not None:
+            chosen = np.zeros(len(starts), dtype=bool)
+            chosen[good[keep]] = True
+        self.frames = int(chosen.sum())
+
+        self.groups = {}
+        for length, which, rows in by_length:
+            if keep is not None:
+                sel = chosen[which]
+                which, rows = which[sel], rows[sel]
+            mtypes = ((rows[:, 2].astype(np.int64) << 16)
+                      | (rows[:, 3].astype(np.int64) << 8)
+                      | rows[:, 4])
+            for mtype in np.unique(mtypes).tolist():
+                sel = mtypes == mtype
+                ts = None
+                if stamps is not None:
+                    offsets, ts_ns = stamps
+                    ts = ts_ns[np.searchsorted(offsets, ends[which[sel]],
+                                               'right') - 1]
+                self.groups[mtype, length] = (rows[sel], ts)
+
+    def types(self):
+        """ (mtype, frame count) for every type seen. """
+        counts = {}
+        for (mtype, length), (rows, ts) in self.groups.items():
+            counts[mtype] = counts.get(mtype, 0) + len(rows)
+        return counts
+
+    def rows(self, mtype):
+        """ The (N, frame length) array for a packed or 3 byte mtype.
+
+        A spa sends one type at one length, if there are several the most
+        common one wins.  Returns (rows, ts) with ts None without stamps.
+        """
+        if not isinstance(mtype, int):
+            mtype = pack_mtype(mtype)
+        found = [group for key, group in self.groups.items()
+                 if key[0] == mtype]
+        if not found:
+            empty = np.zeros((0, 0), dtype=np.uint8)
+            return empty, None
+        return max(found, key=lambda group: len(group[0]))
+
+    def status(self):
+        """ Balboa status updates, see BalboaProtocol.parse_status_update().
+
+        Pumps, lights and aux are decoded for every position whether or not
+        the spa has them; the device configuration says which are real.
+        """
+        data, ts = self.rows(BALBOA_STATUS)
+        if not len(data):
+            return {'ts': ts}
+        celsius = (data[:, 14] & 0x01) != 0
+        pumps = np.empty((len(data), 6), dtype=np.uint8)
+        for i in range(4):
+            pumps[:, i] = (data[:, 16] >> (i * 2)) & 0x03
+        for i in range(2):
+            pumps[:, 4 + i] = (data[:, 17] >> (i * 2)) & 0x03
+        lights = np.empty((len(data), 2), dtype=np.uint8)
+        for i in range(2):
+            lights[:, i] = ((data[:, 19] >> (i * 2)) & 0x03) >> 1
+        return {
+            'ts': ts,
+            'tempscale': celsius.astype(np.uint8),
+            'time_hour': data[:, 8],
+            'time_minute': data[:, 9],
+            'timescale': ((data[:, 14] & 0x02) != 0).astype(np.uint8),
+            'curtemp': temperatures(data[:, 7], celsius),
+            'settemp': np.where(celsius, data[:, 25] / 2,
+                                data[:, 25].astype(np.float64)),
+            'heatmode': data[:, 10] & 0x03,
+            'filter_mode': (data[:, 14] & 0x0c) >> 2,
+            'heatstate': (data[:, 15] & 0x30) >> 4,
+            'temprange': (data[:, 15] & 0x04) >> 2,
+            'pump': pumps,
+            'circ_pump': (data[:, 18] == 0x02).astype(np.uint8),
+            'light': lights,
+            'mister': data[:, 20] & 0x01,
+            'blower': (data[:, 18] & 0x0c) >> 2,
+            'aux': np.stack((data[:, 20] & 0x08, data[:, 20] & 0x10), axis=1),
+        }
+
+    def sundance_status(self, celsius=False, mtype=SUNDANCE_STATUS):
+        """ Sundance C4 updates, see SundanceProtocol.parse_C4status_update().
+
+        The C4 frames don't say which scale they're in, like the object
+        model this assumes Fahrenheit unless told otherwise.  Pass
+        mtype=JACUZZI_STATUS for the Jacuzzi flavour.
+        """
+        frames, ts = self.rows(mtype)
+        if not len(frames):
+            return {'ts': ts}
+        data = xor_decode(frames)
+        circ = (data[:, 1] >> 6) & 1
+        temp2 = data[:, 14].astype(np.float64)
+        temp2[circ == 1] += 32
+        return {
+            'ts': ts,
+            'time_hour': data[:, 0] ^ 6,
+            'time_minute': data[:, 11],
+            'pump': np.stack(((data[:, 2] >> 4) & 1, (data[:, 1] >> 2) & 1,
+                              circ), axis=1),
+            'circ_pump': circ,
+            'autoCirc': circ,
+            'manualCirc': (data[:, 1] >> 7) & 1,
+            'settemp': data[:, 8] / (2 if celsius else 1),
+            'curtemp': temperatures(data[:, 5] ^ 2, celsius),
+            'heatstate': (data[:, 10] >> 6) & 1,
+            'displayText': data[:, 13],
+            'heatMode': data[:, 6],
+            'day': data[:, 7] >> 3,
+            'month': data[:, 7] & 7,
+            'temp2': temp2,
+            'unknownCirc': (data[:, 4] >> 6) & 1,
+            'UnknownField3': data[:, 3],
+            'UnknownField9': data[:, 9],
+        }
+
+    def sundance_lights(self, mtype=SUNDANCE_LIGHTS):
+        """ Sundance CA updates, see parse_CA_light_status_update(). """
+        frames, ts = self.rows(mtype)
+        if not len(frames):
+            return {'ts': ts}
+        data = xor_decode(frames)
+        return {
+            'ts': ts,
+            'lightBrightnes': data[:, 1],
+            'lightMode': data[:, 4],
+            'lightR': data[:, 8],
+            'lightG': data[:, 6],
+            'lightB': data[:, 2],
+            'lightCycleTime': data[:, 9],
+        }
+
+
+def load_capture(path):
+    """ Read a whole capture file into a FrameBatch, with timestamps.
+
+    The file is mapped rather than read.  One walk finds the record headers
+    without copying anything, then the timestamps and lengths are picked
+    out of the mapping and the headers masked off with numpy, so the bytes
+    FrameBatch decodes are the only copy of the capture made.
+    """
+    require_numpy()
+    with CaptureReader(path) as capture:
+        heads = np.frombuffer(capture.index(), dtype=np.int64)
+        raw = np.frombuffer(capture.map, dtype=np.uint8)
+        ts_ns = np.zeros(len(heads), dtype=np.uint64)
+        lengths = np.zeros(len(heads), dtype=np.int64)
+        keep = np.zeros(len(raw), dtype=bool)
+        if len(heads):
+            # anything after the last whole record was cut short
+            keep[len(MAGIC):heads[-1] + RECORD.size] = True
+        # <Q ts_ns> <H length>, a byte at a time for every record at once
+        for i in range(RECORD.size):
+            column = raw[heads + i]
+            if i < 8:
+                ts_ns |= column.astype(np.uint64) << np.uint64(8 * i)
+            else:
+                lengths |= column.astype(np.int64) << (8 * (i - 8))
+            keep[heads + i] = False
+        if len(heads):
+            keep[heads[-1] + RECORD.size:
+                 heads[-1] + RECORD.size + lengths[-1]] = True
+        data = raw[keep]
+        # the mapping can't close while numpy still has a view of it
+        del raw, column
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    return FrameBatch(data, (offsets, ts_ns))
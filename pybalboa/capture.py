@@ -0,0 +1,211 @@
+""" Record what the spa sends to a file, and play it back later.
+
+A capture file is MAGIC followed by one record per socket read:
+
+    <Q ts_ns> <H length> [length bytes as received]
+
+ts_ns is time.monotonic_ns() when the bytes arrived.  Reads are recorded
+as they came off the wire, before framing, so bad CRCs, split frames and
+line noise all replay exactly as the spa produced them.
+"""
+import array
+import asyncio
+import mmap
+import struct
+import time
+
+MAGIC = b'PBCAP\x00\x01\n'
+RECORD = struct.Struct('<QH')
+MAX_RECORD = 0xffff
+
+
+class CaptureWriter:
+    """ Append timestamped reads to a capture file. """
+
+    def __init__(self, path, clock=time.monotonic_ns):
+        self.path = path
+        self.clock = clock
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.records = 0
+
+    def record(self, data, ts_ns=None):
+        if ts_ns is None:
+            ts_ns = self.clock()
+        write = self.file.write
+        # a record holds at most 64k, split anything bigger
+        for i in range(0, len(data), MAX_RECORD):
+            chunk = data[i:i + MAX_RECORD]
+            write(RECORD.pack(ts_ns, len(chunk)))
+            write(chunk)
+            self.records += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """ Walk a capture file without reading it into memory.
+
+    Iterating yields (ts_ns, data) pairs where data is a memoryview into the
+    mapped file; use bytes(data) to keep it and release() it when done, the
+    file can't be closed while views into it are alive.  A record cut
+    short at the end of the file, e.g. by a crash while capturing, is
+    ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses empty files
+            self.file.close()
+            raise ValueError('{0} is not a capture file'.format(path))
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('{0} is not a capture file'.format(path))
+        self.view = memoryview(self.map)
+
+    def __iter__(self):
+        view = self.view
+        unpack_from = RECORD.unpack_from
+        pos = len(MAGIC)
+        end = len(view)
+        while pos + RECORD.size <= end:
+            ts_ns, length = unpack_from(view, pos)
+            pos += RECORD.size
+            if pos + length > end:
+                break
+            yield ts_ns, view[pos:pos + length]
+            pos += length
+
+    def index(self):
+        """ The file offset of every whole record's header, as an array.
+
+        Only the headers are looked at and nothing is copied, for going
+        through the records with numpy instead of one at a time.
+        """
+        positions = array.array('q')
+        append = positions.append
+        view = self.view
+        unpack_from = RECORD.unpack_from
+        size = RECORD.size
+        pos = len(MAGIC)
+        end = len(view)
+        while pos + size <= end:
+            length = unpack_from(view, pos)[1]
+            if pos + size + length > end:
+                break
+            append(pos)
+            pos += size + length
+        return positions
+
+    def close(self):
+        view = getattr(self, 'view', None)
+        if view is not None:
+            view.release()
+            self.view = None
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def replay_into(protocol, path):
+    """ Push a whole capture through a protocol core as fast as possible.
+
+    Returns the list of every event it produced.  Anything the protocol
+    wanted to send is thrown away.
+    """
+    events = []
+    with CaptureReader(path) as capture:
+        for ts_ns, data in capture:
+            events.extend(protocol.receive_data(data))
+            protocol.data_to_send()
+            data.release()
+    return events
+
+
+class ReplayWriter:
+    """ Swallows what the spa client sends back during a replay. """
+
+    def __init__(self):
+        self.written = 0
+        self.transport = None
+
+    def write(self, data):
+        self.written += len(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class ReplayTransport:
+    """ Stand in for the spa connection, reading from a capture.
+
+    speed is how many times faster than real time to go, so 1.0 replays with
+    the original timing and None replays as fast as the client reads.  Once
+    the capture runs out reads return b'', like a spa closing the
+    connection.
+
+        replay = ReplayTransport('pool.cap', speed=10)
+        replay.attach(spa)
+        await spa.listen()
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.capture = CaptureReader(path)
+        self.records = iter(self.capture)
+        self.writer = ReplayWriter()
+        self.start = None
+        self.first_ts = None
+
+    def attach(self, spa):
+        """ Point a BalboaSpaWifi or SundanceRS485 at this replay. """
+        spa.reader = self
+        spa.writer = self.writer
+        spa.decoder.reset()
+        spa.pending.clear()
+        spa.connected = True
+
+    async def read(self, n=-1):
+        for ts_ns, data in self.records:
+            if self.speed:
+                if self.start is None:
+                    self.start = time.monotonic()
+                    self.first_ts = ts_ns
+                due = self.start + (ts_ns - self.first_ts) / 1e9 / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            chunk = bytes(data)
+            data.release()
+            return chunk
+        return b''
+
+    def close(self):
+        self.capture.close()
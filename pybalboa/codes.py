@@ -0,0 +1,59 @@
+""" Frozen lookup tables for the codes a spa reports.
+
+    HEAT_MODES = CodeTable([(32, 'AUTO'), (34, 'ECO'), (36, 'DAY')])
+    HEAT_MODES.text(34)      # 'ECO'
+    HEAT_MODES.code('DAY')   # 36
+
+A table is built once from its (code, text) pairs, the way the model
+profiles have always written them, and indexed both ways so neither
+decoding nor the MQTT bridge has to scan it.  Iterating a table still
+gives the pairs in order.
+"""
+
+
+class CodeTable:
+    """ code <-> text in both directions, read only.
+
+    Several codes may share a text (the display says "Current Temp" for a
+    handful of them); code() gives the last one listed, which is what the
+    reverse scans used to find.
+    """
+    __slots__ = ('pairs', 'by_code', 'by_text', 'texts')
+
+    def __init__(self, pairs):
+        pairs = tuple((code, text) for code, text in pairs)
+        by_code = {}
+        for code, text in pairs:
+            by_code.setdefault(code, text)
+        set_ = object.__setattr__
+        set_(self, 'pairs', pairs)
+        set_(self, 'by_code', by_code)
+        set_(self, 'by_text', {text: code for code, text in pairs})
+        # every text once, in table order, for offering them as choices
+        set_(self, 'texts', tuple(dict.fromkeys(text for code, text in pairs)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CodeTable is read only')
+
+    def __delattr__(self, name):
+        raise AttributeError('CodeTable is read only')
+
+    def __iter__(self):
+        return iter(self.pairs)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __contains__(self, code):
+        return code in self.by_code
+
+    def __repr__(self):
+        return 'CodeTable({0!r})'.format(list(self.pairs))
+
+    def text(self, code, default='unknown'):
+        """ What code means, or default for one we haven't seen before. """
+        return self.by_code.get(code, default)
+
+    def code(self, text, default=-1):
+        """ The code for text, or default when there is none. """
+        return self.by_text.get(text, default)
@@ -0,0 +1,66 @@
+""" Message type -> handler lookup shared by the Balboa protocol engines. """
+
+
+def pack_mtype(mtype):
+    """ Pack a 3 byte message type, e.g. [0xFF, 0xAF, 0x13], into an int. """
+    return (mtype[0] << 16) | (mtype[1] << 8) | mtype[2]
+
+
+def frame_mtype(data):
+    """ The packed message type of a complete 7E ... 7E frame. """
+    return (data[2] << 16) | (data[3] << 8) | data[4]
+
+
+def method_handler(name):
+    """ A handler that calls spa.<name>(data), so subclasses can override. """
+    def handler(spa, data):
+        return getattr(spa, name)(data)
+    handler.__name__ = name
+    return handler
+
+
+class MessageRegistry:
+    """ Constant time dispatch from a frame's message type to a handler.
+
+    Handlers are called as handler(spa, data) where data is the complete
+    frame.  A handler can be registered for a full 3 byte type such as
+    [0x0A, 0xBF, 0x2E], or for just the last (type) byte when the first two
+    vary, as they do with the channel numbers on the RS485 bus.  Full types
+    win over type bytes.
+    """
+
+    def __init__(self, handlers=None):
+        self.exact = {}
+        self.by_type = {}
+        if handlers:
+            for mtype, handler in handlers.items():
+                self.register(mtype, handler)
+
+    def key(self, mtype):
+        if isinstance(mtype, int):
+            return self.by_type, mtype
+        return self.exact, pack_mtype(mtype)
+
+    def register(self, mtype, handler):
+        """ Call handler for frames of mtype, replacing any previous one. """
+        table, key = self.key(mtype)
+        table[key] = handler
+
+    def unregister(self, mtype):
+        """ Stop handling mtype. """
+        table, key = self.key(mtype)
+        table.pop(key, None)
+
+    def lookup(self, data):
+        """ Return the handler for a frame, or None. """
+        handler = self.exact.get(
+            (data[2] << 16) | (data[3] << 8) | data[4])
+        if handler is None:
+            handler = self.by_type.get(data[4])
+        return handler
+
+    def copy(self):
+        registry = MessageRegistry()
+        registry.exact = dict(self.exact)
+        registry.by_type = dict(self.by_type)
+        return registry
@@ -0,0 +1,418 @@
+""" A pretend Balboa wifi module, for testing BalboaSpaWifi without a tub.
+
+Run with:  python -m pybalboa.emulator [--port 4257] [--rate 3]
+
+It streams status updates, answers the module identification and panel
+requests, and applies button presses, set temp, set time and temperature
+scale changes to its own state.  Faults can be switched on to see how a
+client copes: corrupted checksums, the spa going quiet for a while, and
+dropped connections.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+
+try:
+    from .balboa import *
+except ImportError:
+    from balboa import *
+
+# Wire values for the status update
+HEATMODE_READY = 0
+HEATMODE_REST = 1
+HEATMODE_RNR = 2
+
+
+class EmulatedSpa:
+    """ The state of the pretend spa, and how it reacts to messages.
+
+    By default it looks like a two pump, one light tub with a circulation
+    pump.  Nothing here does I/O, handle() takes a frame from the client
+    and returns the frames to send back.
+    """
+
+    def __init__(self, pumps=(2, 2, 0, 0, 0, 0), lights=(1, 0), circ_pump=1,
+                 blower=0, mister=0, aux=(0, 0), curtemp=98, settemp=102,
+                 clock=time.time):
+        self.clock = clock
+        self.pump_array = list(pumps)
+        self.light_array = list(lights)
+        self.circ_pump = circ_pump
+        self.blower = blower
+        self.mister = mister
+        self.aux_array = list(aux)
+
+        self.curtemp = curtemp
+        self.settemp = settemp
+        self.tempscale = 0
+        self.timescale = 1
+        self.heatmode = HEATMODE_READY
+        self.temprange = 1
+        self.filter_mode = 1
+        self.pump_status = [0] * 6
+        self.circ_pump_status = circ_pump
+        self.light_status = [0, 0]
+        self.blower_status = 0
+        self.mister_status = 0
+        self.aux_status = [0, 0]
+        # minutes to add to the clock, changed by set time
+        self.time_offset = 0
+
+        self.macaddr = bytes.fromhex('001527aabbcc')
+        self.model_name = b'EMULATOR'
+        self.tmin = (50, 80)
+        self.tmax = (80, 104)
+
+        self.presses = 0
+        self.handlers = {
+            pack_mtype(mtypes[BMTS_CONFIG_REQ]): self.handle_config_req,
+            pack_mtype(mtypes[BMTS_PANEL_REQ]): self.handle_panel_req,
+            pack_mtype(mtypes[BMTS_CONTROL_REQ]): self.handle_control_req,
+            pack_mtype(mtypes[BMTS_SET_TEMP]): self.handle_set_temp,
+            pack_mtype(mtypes[BMTS_SET_TIME]): self.handle_set_time,
+            pack_mtype(mtypes[BMTS_SET_TSCALE]): self.handle_set_tscale,
+        }
+
+    def now(self):
+        """ (hour, minute) on the spa's clock. """
+        t = time.localtime(self.clock() + self.time_offset * 60)
+        return t.tm_hour, t.tm_min
+
+    def heating(self):
+        return (self.heatmode == HEATMODE_READY
+                and self.curtemp < self.settemp)
+
+    def tick(self, seconds, degrees_per_hour=6.0):
+        """ Let some time pass; the water warms up while heating. """
+        if self.heating():
+            self.curtemp = min(self.settemp,
+                               self.curtemp + seconds * degrees_per_hour / 3600)
+
+    def packed(self, mtype, layout, size, **values):
+        """ The first size bytes of an mtype frame, values packed in. """
+        data = layout.pack(size, **values)
+        data[2:5] = mtypes[mtype]
+        return data
+
+    def message(self, mtype, layout, size, **values):
+        return build_frame(*self.packed(mtype, layout, size, **values)[2:])
+
+    def status_frame(self):
+        hour, minute = self.now()
+        pumps = {'pump{0}'.format(i): self.pump_status[i] for i in range(6)}
+        return self.message(
+            BMTR_STATUS_UPDATE, STATUS_LAYOUT, 29,
+            curtemp=int(self.curtemp),
+            time_hour=hour,
+            time_minute=minute,
+            heatmode=self.heatmode,
+            tempscale=self.tempscale,
+            timescale=self.timescale,
+            filter_mode=self.filter_mode,
+            temprange=self.temprange,
+            heatstate=1 if self.heating() else 0,
+            circ_pump=0x02 if self.circ_pump and self.circ_pump_status else 0,
+            blower=self.blower_status,
+            light0=self.light_status[0],
+            light1=self.light_status[1],
+            mister=self.mister_status,
+            aux0=0x08 if self.aux_status[0] else 0,
+            aux1=0x10 if self.aux_status[1] else 0,
+            settemp=int(self.settemp),
+            **pumps)
+
+    def module_identification(self):
+        data = self.packed(
+            BMTR_MOD_IDENT_RESP, MOD_IDENT_LAYOUT, 30,
+            macaddr=self.macaddr,
+            idigi_device_id=(self.macaddr[:3] + b'\xff\xff'
+                             + self.macaddr[3:] + bytes(8)))
+        data[5:8] = b'\x02\x14\x80'
+        return build_frame(*data[2:])
+
+    def device_configuration(self):
+        pumps = {'pump{0}'.format(i): self.pump_array[i] for i in range(6)}
+        return self.message(
+            BMTR_DEVICE_CONFIG_RESP, DEVICE_CONFIG_LAYOUT, 11,
+            light0=self.light_array[0],
+            light1=self.light_array[1],
+            circ_pump=self.circ_pump,
+            blower=self.blower,
+            mister=self.mister,
+            aux0=self.aux_array[0],
+            aux1=self.aux_array[1],
+            **pumps)
+
+    def system_information(self):
+        return self.message(
+            BMTR_SYS_INFO_RESP, SYS_INFO_LAYOUT, 26,
+            ssid_major=0x64, ssid_minor=0xdc, sw_major=0x14, sw_minor=0x00,
+            model_name=self.model_name.ljust(8),
+            setup=0x04,
+            cfg_sig0=0x51, cfg_sig1=0x80, cfg_sig2=0x0c, cfg_sig3=0x6b,
+            voltage=0x01, heater_type=0x0a,
+            dip_switch0=0x02, dip_switch1=0x00)
+
+    def setup_parameters(self):
+        pumps = 0
+        for i in range(0, 6):
+            if self.pump_array[i]:
+                pumps |= 1 << i
+        data = self.packed(
+            BMTR_SETUP_PARAMS_RESP, SETUP_PARAMS_LAYOUT, 14,
+            low_min=self.tmin[0], low_max=self.tmax[0],
+            high_min=self.tmin[1], high_max=self.tmax[1],
+            pumps=pumps)
+        data[5:7] = b'\x04\x03'
+        data[11] = 0xe9
+        data[13] = 0x45
+        return build_frame(*data[2:])
+
+    def filter_cycle_info(self):
+        return self.message(
+            BMTR_FILTER_INFO_RESP, FILTER_LAYOUT, 13,
+            filter1_hour=0x13, filter1_duration_hours=0x02,
+            filter2_enabled=1, filter2_hour=0x08, filter2_duration_hours=0x01)
+
+    def handle(self, data):
+        """ React to one frame from the client, return the replies. """
+        handler = self.handlers.get(frame_mtype(data))
+        if handler is None:
+            return []
+        return handler(data)
+
+    def handle_config_req(self, data):
+        return [self.module_identification()]
+
+    def handle_panel_req(self, data):
+        request = (data[5], data[7])
+        if request == (0, 1):
+            return [self.device_configuration()]
+        if request == (2, 0):
+            return [self.system_information()]
+        if request == (4, 0):
+            return [self.setup_parameters()]
+        if request == (1, 0):
+            return [self.filter_cycle_info()]
+        return []
+
+    def handle_control_req(self, data):
+        self.press(data[5])
+        return []
+
+    def handle_set_temp(self, data):
+        self.settemp = data[5]
+        return []
+
+    def handle_set_time(self, data):
+        self.timescale = data[5] >> 7
+        hour, minute = self.now()
+        wanted = (data[5] & 0x7f) * 60 + data[6]
+        self.time_offset += wanted - (hour * 60 + minute)
+        return []
+
+    def handle_set_tscale(self, data):
+        if data[5] == 0x01:
+            self.tempscale = data[6] & 0x01
+        return []
+
+    def press(self, button):
+        """ What the topside panel would do for a button. """
+        self.presses += 1
+        if C_PUMP1 <= button <= C_PUMP6:
+            i = button - C_PUMP1
+            if self.pump_array[i]:
+                self.pump_status[i] = ((self.pump_status[i] + 1)
+                                       % (self.pump_array[i] + 1))
+        elif button in (C_LIGHT1, C_LIGHT2):
+            i = 0 if button == C_LIGHT1 else 1
+            if self.light_array[i]:
+                self.light_status[i] ^= 1
+        elif button in (C_AUX1, C_AUX2):
+            i = 0 if button == C_AUX1 else 1
+            if self.aux_array[i]:
+                self.aux_status[i] ^= 1
+        elif button == C_MISTER and self.mister:
+            self.mister_status ^= 1
+        elif button == C_BLOWER and self.blower:
+            self.blower_status = (self.blower_status + 1) % 4
+        elif button == C_TEMPRANGE:
+            self.temprange ^= 1
+        elif button == C_HEATMODE:
+            # ready in rest goes to rest, like the real thing
+            if self.heatmode == HEATMODE_READY:
+                self.heatmode = HEATMODE_REST
+            elif self.heatmode == HEATMODE_REST:
+                self.heatmode = HEATMODE_READY
+            else:
+                self.heatmode = HEATMODE_REST
+
+
+class Faults:
+    """ What can go wrong, and how often.
+
+    crc_error_rate - fraction of frames sent with a broken checksum
+    stall_rate - chance per status update that the spa goes quiet
+    stall_time - for this many seconds
+    drop_rate - chance per status update of hanging up on the client
+    """
+
+    def __init__(self, crc_error_rate=0.0, stall_rate=0.0, stall_time=5.0,
+                 drop_rate=0.0, seed=None):
+        self.crc_error_rate = crc_error_rate
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+
+    def corrupt(self, frame):
+        if (self.crc_error_rate
+                and self.random.random() < self.crc_error_rate):
+            frame = bytearray(frame)
+            frame[-2] ^= 0xff
+            return bytes(frame)
+        return frame
+
+    def stall(self):
+        return self.stall_rate and self.random.random() < self.stall_rate
+
+    def drop(self):
+        return self.drop_rate and self.random.random() < self.drop_rate
+
+
+class SpaEmulator:
+    """ asyncio TCP server speaking the wifi module protocol.
+
+        emulator = SpaEmulator(port=0, rate=10)
+        await emulator.start()
+        spa = BalboaSpaWifi('127.0.0.1', emulator.port)
+
+    Every connected client gets rate status updates a second.  connects
+    and commands record (time.monotonic(), ...) for each connection and
+    each message applied, so tests can work out reconnect times and
+    command latency.
+    """
+
+    def __init__(self, host='127.0.0.1', port=BALBOA_DEFAULT_PORT, rate=3.0,
+                 spa=None, faults=None):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.spa = spa or EmulatedSpa()
+        self.faults = faults or Faults()
+        self.log = logging.getLogger(__name__)
+        self.server = None
+        self.clients = set()
+        self.handlers = set()
+        self.stalled_until = 0.0
+        self.connects = []
+        self.commands = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.client, self.host,
+                                                 self.port)
+        # port 0 picks a free one
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.log.info('Emulated spa listening on {0}:{1}'.format(self.host,
+                                                                self.port))
+
+    async def stop(self):
+        self.drop_connections()
+        # let the handlers see their connections close
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        await self.server.serve_forever()
+
+    def stall(self, seconds):
+        """ Go quiet, as real spas sometimes do. """
+        self.stalled_until = time.monotonic() + seconds
+
+    def drop_connections(self):
+        for writer in list(self.clients):
+            writer.close()
+
+    async def client(self, reader, writer):
+        self.connects.append(time.monotonic())
+        self.clients.add(writer)
+        self.handlers.add(asyncio.current_task())
+        streamer = asyncio.ensure_future(self.stream_status(writer))
+        decoder = FrameDecoder(log=self.log)
+        try:
+            while True:
+                chunk = await reader.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                for frame in decoder.feed(chunk):
+                    self.commands.append((time.monotonic(), bytes(frame)))
+                    for reply in self.spa.handle(frame):
+                        writer.write(self.faults.corrupt(reply))
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            streamer.cancel()
+            self.clients.discard(writer)
+            self.handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def stream_status(self, writer):
+        interval = 1.0 / self.rate
+        last = time.monotonic()
+        try:
+            while not writer.is_closing():
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                self.spa.tick(now - last)
+                last = now
+                if now < self.stalled_until:
+                    continue
+                if self.faults.drop():
+                    self.log.info('Dropping the client')
+                    writer.close()
+                    return
+                if self.faults.stall():
+                    self.log.info('Stalling')
+                    self.stall(self.faults.stall_time)
+                    continue
+                writer.write(self.faults.corrupt(self.spa.status_frame()))
+                await writer.drain()
+        except (ConnectionError, OSError):
+            writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=BALBOA_DEFAULT_PORT)
+    parser.add_argument('--rate', type=float, default=3.0,
+                        help='status updates per second')
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--stall-rate', type=float, default=0.0)
+    parser.add_argument('--stall-time', type=float, default=5.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    emulator = SpaEmulator(args.host, args.port, args.rate, faults=Faults(
+        args.crc_error_rate, args.stall_rate, args.stall_time,
+        args.drop_rate, args.seed))
+    try:
+        asyncio.run(emulator.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
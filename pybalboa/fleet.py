@@ -0,0 +1,255 @@
+""" Run a whole fleet of spa connections on one event loop.
+
+    fleet = SpaFleet()
+    fleet.add('pool', BalboaSpaWifi('10.0.0.5'))
+    fleet.add('cabin', SundanceRS485('10.0.0.9'))
+    await fleet.start()
+    ...
+    print(fleet.health())
+
+Each spa gets one supervising task instead of its own listen() and
+check_connection_status() loops.  Connecting and the config handshake are
+the expensive part, so only max_connecting spas do that at once and new
+connects are started at least stagger seconds apart.  A spa that fails
+backs off exponentially, with jitter so a fleet that lost its network
+doesn't all come back in the same instant.
+"""
+import asyncio
+import logging
+import random
+import time
+
+try:
+    from .framing import FrameDecoder
+except ImportError:
+    from framing import FrameDecoder
+
+# A spa only ever leaves part of a frame behind between reads, a small
+# receive buffer is plenty and adds up over hundreds of connections.
+FLEET_RING_SIZE = 2048
+
+# Health states
+WAITING = 'waiting'
+CONNECTING = 'connecting'
+CONFIGURING = 'configuring'
+ONLINE = 'online'
+BACKOFF = 'backoff'
+STOPPED = 'stopped'
+
+
+class SpaHealth:
+    """ How one spa in the fleet is doing. """
+    __slots__ = ('state', 'connects', 'failures', 'frames', 'last_frame',
+                 'online_since', 'retry_at', 'last_error', 'spa')
+
+    def __init__(self, spa):
+        self.spa = spa
+        self.state = WAITING
+        self.connects = 0
+        self.failures = 0
+        self.frames = 0
+        self.last_frame = None
+        self.online_since = None
+        self.retry_at = None
+        self.last_error = None
+
+    def as_dict(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {
+            'state': self.state,
+            'connects': self.connects,
+            'failures': self.failures,
+            'frames': self.frames,
+            'crcerror': self.spa.crcerror,
+            'dropped': self.spa.dropped,
+            'idle': (None if self.last_frame is None
+                     else now - self.last_frame),
+            'uptime': (None if self.online_since is None
+                       else now - self.online_since),
+            'retry_in': (None if self.retry_at is None
+                         else max(0.0, self.retry_at - now)),
+            'last_error': self.last_error,
+        }
+
+
+class SpaFleet:
+    """ Supervise many BalboaSpaWifi / SundanceRS485 connections. """
+
+    def __init__(self, max_connecting=16, stagger=0.05, connect_timeout=10.0,
+                 config_timeout=30.0, stale_after=300.0, backoff=5.0,
+                 max_backoff=300.0, ring_size=FLEET_RING_SIZE, log=None):
+        self.max_connecting = max_connecting
+        self.stagger = stagger
+        self.connect_timeout = connect_timeout
+        self.config_timeout = config_timeout
+        self.stale_after = stale_after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ring_size = ring_size
+        self.log = log or logging.getLogger(__name__)
+        self.spas = {}
+        self.tasks = {}
+        self.connecting = None
+        self.next_connect = 0.0
+        self.random = random.Random()
+
+    def __len__(self):
+        return len(self.spas)
+
+    def add(self, name, spa):
+        """ Put a spa under the fleet's care; started by start(). """
+        if name in self.spas:
+            raise KeyError('Spa {0} is already in the fleet'.format(name))
+        if self.ring_size and len(spa.decoder.ring) > self.ring_size:
+            spa.decoder = FrameDecoder(spa.decoder.calc_cs, spa.log,
+                                       self.ring_size)
+        health = self.spas[name] = SpaHealth(spa)
+        if self.connecting is not None:
+            self.tasks[name] = asyncio.ensure_future(self.supervise(name))
+        return health
+
+    async def remove(self, name):
+        """ Disconnect a spa and forget about it. """
+        task = self.tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        health = self.spas.pop(name)
+        await self.close(health.spa)
+
+    async def start(self):
+        self.connecting = asyncio.Semaphore(self.max_connecting)
+        for name in self.spas:
+            if name not in self.tasks:
+                self.tasks[name] = asyncio.ensure_future(self.supervise(name))
+
+    async def stop(self):
+        tasks = list(self.tasks.values())
+        self.tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for health in self.spas.values():
+            health.state = STOPPED
+            await self.close(health.spa)
+        self.connecting = None
+
+    def health(self):
+        """ Per spa health, by name. """
+        now = time.monotonic()
+        return {name: health.as_dict(now)
+                for name, health in self.spas.items()}
+
+    def summary(self):
+        """ How many spas are in each state. """
+        counts = {}
+        for health in self.spas.values():
+            counts[health.state] = counts.get(health.state, 0) + 1
+        return counts
+
+    async def close(self, spa):
+        spa.connected = False
+        spa.outbound.clear()
+        writer = spa.writer
+        spa.writer = None
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    async def wait_turn(self):
+        """ Keep new connects at least stagger seconds apart. """
+        now = time.monotonic()
+        start = max(now, self.next_connect)
+        self.next_connect = start + self.stagger
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def supervise(self, name):
+        health = self.spas[name]
+        spa = health.spa
+        delay = self.backoff
+        while True:
+            health.state = WAITING
+            reader = None
+            async with self.connecting:
+                await self.wait_turn()
+                health.state = CONNECTING
+                health.connects += 1
+                try:
+                    ok = await asyncio.wait_for(spa.connect(),
+                                                self.connect_timeout)
+                except asyncio.TimeoutError:
+                    ok = False
+                if ok:
+                    health.state = CONFIGURING
+                    configured = asyncio.Event()
+                    reader = asyncio.ensure_future(self.pump(health,
+                                                             configured))
+                    try:
+                        if not spa.configured():
+                            await spa.send_config_requests()
+                            await asyncio.wait_for(configured.wait(),
+                                                   self.config_timeout)
+                    except asyncio.TimeoutError:
+                        ok = False
+                        health.last_error = 'config handshake timed out'
+                else:
+                    health.last_error = 'connect failed'
+
+            if ok and not reader.done():
+                health.state = ONLINE
+                health.online_since = time.monotonic()
+                delay = self.backoff
+                await asyncio.gather(reader, return_exceptions=True)
+                health.online_since = None
+            elif reader is not None:
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+
+            await self.close(spa)
+            await spa.int_new_data_cb()
+            health.failures += 1
+            health.state = BACKOFF
+            wait = delay * (0.5 + self.random.random() / 2)
+            health.retry_at = time.monotonic() + wait
+            self.log.info('Spa {0} offline ({1}), retrying in {2:.1f}s'.format(
+                name, health.last_error, wait))
+            await asyncio.sleep(wait)
+            health.retry_at = None
+            delay = min(delay * 2, self.max_backoff)
+
+    async def pump(self, health, configured):
+        """ Read and handle frames until the connection goes bad.
+
+        configured is set as soon as the spa has told us all about itself.
+        """
+        spa = health.spa
+        asked = False
+        while spa.connected:
+            try:
+                frames = await asyncio.wait_for(spa.read_messages(),
+                                                self.stale_after)
+            except asyncio.TimeoutError:
+                if asked:
+                    health.last_error = 'spa stopped responding'
+                    return
+                # the spa sometimes just stops, a panel request wakes it up
+                asked = True
+                await spa.send_panel_req(0, 1)
+                continue
+            if frames is None:
+                health.last_error = 'connection lost'
+                return
+            asked = False
+            health.frames += len(frames)
+            health.last_frame = time.monotonic()
+            for data in frames:
+                await spa.process_message(data)
+            if not configured.is_set() and spa.configured():
+                configured.set()
+            await asyncio.sleep(0)
+        health.last_error = 'disconnected'
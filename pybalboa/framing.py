@@ -0,0 +1,154 @@
+import logging
+
+try:
+    from .checksum import calc_cs as default_calc_cs
+except ImportError:
+    from checksum import calc_cs as default_calc_cs
+
+M_STARTEND = 0x7e
+
+# The longest frame we are willing to believe.  Anything claiming to be longer
+# is line noise and gets dropped.
+MAX_FRAME_LENGTH = 128
+
+# Default size of the receive buffer.  Only a partial frame is ever left over
+# between reads, so this just has to comfortably hold one socket read.
+RING_SIZE = 16384
+
+
+class FrameDecoder:
+    """ Split a raw byte stream into complete, checksummed Balboa frames.
+
+    Every frame on the wire looks like:
+
+        7E LL [LL-2 bytes of body] CB 7E
+
+    where LL counts itself, the body and the checksum byte CB, but not the two
+    M_STARTEND markers.  Feed whatever the socket hands you to feed(); it
+    returns every complete frame found so far, keeping any partial frame for
+    the next call.
+
+    Incoming bytes are copied once into a preallocated receive buffer and the
+    frames handed back are memoryviews into that buffer, so decoding reads
+    the fields in place.  The flip side is that a frame is only valid until
+    the next call to feed(), iter_frames() or buffer_updated(); use
+    bytes(frame) to keep one.
+    """
+
+    def __init__(self, calc_cs=default_calc_cs, log=None, size=RING_SIZE):
+        self.calc_cs = calc_cs
+        self.log = log or logging.getLogger(__name__)
+        self.ring = bytearray(size)
+        self.view = memoryview(self.ring)
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.crcerror = 0
+
+    def reset(self):
+        """ Forget any partially received frame, e.g. after a reconnect. """
+        self.head = 0
+        self.tail = 0
+
+    def compact(self):
+        """ Move the unconsumed bytes to the front of the buffer. """
+        live = self.tail - self.head
+        if live and self.head:
+            self.view[0:live] = bytes(self.view[self.head:self.tail])
+        self.head = 0
+        self.tail = live
+
+    def get_buffer(self, sizehint=-1):
+        """ Return writable free space, for asyncio.BufferedProtocol. """
+        if len(self.ring) - self.tail < max(sizehint, 1):
+            self.compact()
+        return self.view[self.tail:]
+
+    def buffer_updated(self, nbytes):
+        """ nbytes were written into get_buffer(), decode them. """
+        self.tail += nbytes
+        return list(self.decode())
+
+    def feed(self, data):
+        """ Add data to the buffer and return a list of complete frames. """
+        return list(self.iter_frames(data))
+
+    def iter_frames(self, data):
+        """ Add data to the buffer and yield complete frames one at a time.
+
+        Only the frame being looked at is alive at any moment, so decoding a
+        whole socket read allocates next to nothing per frame.
+        """
+        size = len(data)
+        if size > len(self.ring) - (self.tail - self.head):
+            # more than fits in the ring, e.g. a whole capture: decode out of
+            # a private copy and keep only the leftover partial frame
+            buf = bytes(self.view[self.head:self.tail]) + bytes(data)
+            self.head = self.tail = 0
+            for frame, pos in self.scan(buf, memoryview(buf), 0, len(buf)):
+                if frame is not None:
+                    yield frame
+            leftover = len(buf) - pos
+            self.view[0:leftover] = buf[pos:]
+            self.tail = leftover
+            return
+        if self.tail + size > len(self.ring):
+            self.compact()
+        self.view[self.tail:self.tail + size] = data
+        self.tail += size
+        yield from self.decode()
+
+    def decode(self):
+        """ Pull every complete frame out of the buffer. """
+        for frame, self.head in self.scan(self.ring, self.view, self.head,
+                                          self.tail):
+            if frame is not None:
+                yield frame
+        if self.head == self.tail:
+            self.head = self.tail = 0
+
+    def scan(self, buf, view, pos, end):
+        """ Walk buf[pos:end] yielding (frame, next position) pairs.
+
+        frame is None for the final position, once nothing else complete is
+        left in the buffer.
+        """
+        calc_cs = self.calc_cs
+        while True:
+            start = buf.find(M_STARTEND, pos, end)
+            if start < 0:
+                # nothing that looks like a frame, throw it all away
+                self.dropped += end - pos
+                pos = end
+                break
+            self.dropped += start - pos
+            # swallow runs of M_STARTEND, only the last one starts a frame
+            while start + 1 < end and buf[start + 1] == M_STARTEND:
+                self.dropped += 1
+                start += 1
+            if start + 1 >= end:
+                pos = start
+                break
+            rlen = buf[start + 1]
+            if rlen > MAX_FRAME_LENGTH or rlen < 2:
+                if rlen > MAX_FRAME_LENGTH:
+                    self.log.error('Length Too Long: {0}'.format(rlen))
+                else:
+                    self.log.error('Bad length: {0}'.format(rlen))
+                self.dropped += 2
+                pos = start + 2
+                continue
+            stop = start + rlen + 2
+            if stop > end:
+                pos = start
+                break
+            pos = stop
+            # don't count M_STARTENDs or CHKSUM (remember that rlen is 2 short)
+            if calc_cs(view[start + 1:stop - 2]) != buf[stop - 2]:
+                self.dropped += rlen + 2
+                self.crcerror += 1
+                self.log.error('Message had bad CRC, discarding: {0}'.format(
+                    view[start:stop].hex()))
+                continue
+            yield view[start:stop], pos
+        yield None, pos
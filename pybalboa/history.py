@@ -0,0 +1,251 @@
+""" Fixed size history of a spa's numeric fields.
+
+    spa.history = SpaHistory()
+    ...
+    for t, temp in spa.history.query('curtemp', time.time() - 600):
+        ...
+    for t, low, high, mean in spa.history.query('curtemp', tier='hour'):
+        ...
+
+Every time the protocol decodes new data the fields are sampled into
+preallocated arrays.  Each series keeps the most recent raw samples plus
+per minute and per hour min / max / mean, all in ring buffers, so a spa's
+history never grows past what it was created with.  List fields such as
+pump_status become one series per element, 'pump_status[0]' and so on.
+
+Queries hand back memoryviews into the rings rather than copies.  Like the
+frames from FrameDecoder they are only good until more samples arrive.
+"""
+import array
+import bisect
+import time
+
+# Samples kept per series at each resolution
+RAW_CAPACITY = 4096
+MINUTE_CAPACITY = 24 * 60
+HOUR_CAPACITY = 90 * 24
+
+TIERS = (('minute', 60), ('hour', 3600))
+
+DEFAULT_FIELDS = ('curtemp', 'settemp', 'heatstate', 'pump_status', 'temp2')
+
+
+class Ring:
+    """ width columns of doubles, the oldest row overwritten first.
+
+    Column 0 is the time and must never go backwards, which is what lets
+    query() bisect it.
+    """
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.columns = [array.array('d', bytes(8 * capacity))
+                        for _ in range(width)]
+        self.views = [memoryview(column) for column in self.columns]
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *row):
+        head = self.head
+        for column, value in zip(self.columns, row):
+            column[head] = value
+        head += 1
+        self.head = 0 if head == self.capacity else head
+        if self.count < self.capacity:
+            self.count += 1
+
+    def spans(self):
+        """ (lo, hi) index ranges holding rows, oldest first. """
+        if self.count < self.capacity or self.head == 0:
+            return [(0, self.count)]
+        return [(self.head, self.capacity), (0, self.head)]
+
+    def query(self, start=None, end=None):
+        """ Rows with start <= time < end, as per column memoryviews.
+
+        Returns up to two segments, the ring may wrap in the middle.
+        """
+        times = self.views[0]
+        segments = []
+        for lo, hi in self.spans():
+            if start is not None:
+                lo = bisect.bisect_left(times, start, lo, hi)
+            if end is not None:
+                hi = bisect.bisect_left(times, end, lo, hi)
+            if lo < hi:
+                segments.append(tuple(view[lo:hi] for view in self.views))
+        return segments
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self.columns)
+
+
+class Tier:
+    """ min / max / mean of a series over fixed width buckets. """
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.ring = Ring(capacity, 4)
+        self.bucket = None
+        self.low = self.high = self.total = 0.0
+        self.samples = 0
+
+    def add(self, t, value):
+        bucket = t - t % self.width
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+            self.low = self.high = self.total = value
+            self.samples = 1
+            return
+        if value < self.low:
+            self.low = value
+        elif value > self.high:
+            self.high = value
+        self.total += value
+        self.samples += 1
+
+    def flush(self):
+        if self.samples:
+            self.ring.append(self.bucket, self.low, self.high,
+                             self.total / self.samples)
+            self.samples = 0
+
+    def current(self):
+        """ (bucket, min, max, mean) for the bucket still filling, or None. """
+        if not self.samples:
+            return None
+        return (self.bucket, self.low, self.high, self.total / self.samples)
+
+
+class Series:
+    """ One field's raw samples and its downsampled tiers. """
+
+    def __init__(self, raw=RAW_CAPACITY, minutes=MINUTE_CAPACITY,
+                 hours=HOUR_CAPACITY):
+        self.raw = Ring(raw, 2)
+        self.tiers = {name: Tier(width, capacity)
+                      for (name, width), capacity in zip(TIERS,
+                                                         (minutes, hours))}
+        self.last = None
+
+    def add(self, t, value):
+        # the wall clock can step back, the rings must not
+        if self.last is not None and t < self.last:
+            t = self.last
+        self.last = t
+        self.raw.append(t, value)
+        for tier in self.tiers.values():
+            tier.add(t, value)
+
+    def ring(self, tier):
+        if tier == 'raw':
+            return self.raw
+        return self.tiers[tier].ring
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(tier.ring.nbytes()
+                                       for tier in self.tiers.values())
+
+
+class SeriesView:
+    """ The result of a query: rows straight out of the ring buffers.
+
+    Iterating yields (t, value) for raw data and (t, min, max, mean) for
+    the tiers.  segments holds the underlying per column memoryviews.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+
+    def __len__(self):
+        return sum(len(segment[0]) for segment in self.segments)
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from zip(*segment)
+
+    def release(self):
+        """ Let go of the views now rather than when garbage collected. """
+        for segment in self.segments:
+            for view in segment:
+                view.release()
+        self.segments = []
+
+
+class SpaHistory:
+    """ Ring buffer history for a spa's numeric fields.
+
+    fields are attribute names on a SpaState; fields a spa doesn't have,
+    and readings of None, are skipped.  Series are allocated the first time
+    a field is seen, each takes the same nbytes() so a fleet's memory is
+    known up front: spas x series x series_nbytes().
+    """
+
+    def __init__(self, fields=DEFAULT_FIELDS, raw=RAW_CAPACITY,
+                 minutes=MINUTE_CAPACITY, hours=HOUR_CAPACITY, clock=time.time):
+        self.fields = tuple(fields)
+        self.sizes = (raw, minutes, hours)
+        self.clock = clock
+        self.series = {}
+        # field -> series names of its elements, for list fields
+        self.elements = {}
+
+    def series_nbytes(self):
+        """ What one series costs, whatever is in it. """
+        raw, minutes, hours = self.sizes
+        return 8 * (2 * raw + 4 * minutes + 4 * hours)
+
+    def nbytes(self):
+        return sum(series.nbytes() for series in self.series.values())
+
+    def get_series(self, name):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = Series(*self.sizes)
+        return series
+
+    def element_names(self, field, count):
+        names = self.elements.get(field)
+        if names is None or len(names) < count:
+            names = self.elements[field] = ['{0}[{1}]'.format(field, i)
+                                            for i in range(count)]
+        return names
+
+    def record(self, state, t=None):
+        """ Sample every field of state, a SpaState or the spa itself. """
+        if t is None:
+            t = self.clock()
+        for field in self.fields:
+            value = getattr(state, field, None)
+            if value is None:
+                continue
+            if isinstance(value, (tuple, list)):
+                names = self.element_names(field, len(value))
+                for name, element in zip(names, value):
+                    self.get_series(name).add(t, element)
+            else:
+                self.get_series(field).add(t, value)
+
+    def query(self, name, start=None, end=None, tier='raw'):
+        """ Samples of a series with start <= t < end, oldest first.
+
+        tier is 'raw', 'minute' or 'hour'.  A tier only holds buckets that
+        are complete, see current() for the one still filling.
+        """
+        series = self.series.get(name)
+        if series is None:
+            return SeriesView([])
+        return SeriesView(series.ring(tier).query(start, end))
+
+    def current(self, name, tier):
+        series = self.series.get(name)
+        if series is None:
+            return None
+        return series.tiers[tier].current()
+
+    def names(self):
+        return list(self.series)
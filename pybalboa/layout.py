@@ -0,0 +1,193 @@
+""" Message layouts: which bits of a message mean what, as data.
+
+    STATUS = Layout('Status', [
+        Field('curtemp', 7),
+        Field('heatmode', 10, mask=0x03),
+        Field('heatstate', 15, shift=4, mask=0x03),
+        Field('blower', 18, mask=0x03, flag=True),
+        Field('model_name', 9, size=8),
+    ])
+    status = STATUS.decode(data)     # status.curtemp, status.heatmode ...
+    data = STATUS.pack(29, curtemp=98, heatmode=0, ...)
+
+A field is ((byte >> shift) & mask) ^ xor of the byte at offset, or for a
+flag, 1 if any of the mask bits are set.  A field with a size is that many
+raw bytes, passed through as they are.
+
+Each layout is compiled once.  One struct.unpack_from() pulls every byte
+any field uses out of the message, then a generated function turns those
+into the field values, with the shifts and masks written in as constants.
+The encoder for the emulators is generated the same way.
+"""
+import struct
+from collections import namedtuple
+
+
+class Field:
+    """ One value in a message.
+
+    offset is from the start of whatever the layout is given: the whole
+    frame for Balboa messages, the decoded body for Sundance ones.
+    """
+    __slots__ = ('name', 'offset', 'shift', 'mask', 'xor', 'flag', 'size')
+
+    def __init__(self, name, offset, shift=0, mask=0xff, xor=0, flag=False,
+                 size=None):
+        self.name = name
+        self.offset = offset
+        self.shift = shift
+        self.mask = mask
+        self.xor = xor
+        self.flag = flag
+        self.size = size
+
+    def __repr__(self):
+        return 'Field({0!r}, {1})'.format(self.name, self.offset)
+
+    @property
+    def fmt(self):
+        return 'B' if self.size is None else '{0}s'.format(self.size)
+
+    @property
+    def default(self):
+        return 0 if self.size is None else b''
+
+    def decoder(self, var):
+        """ Python expression for the field's value from its byte, var. """
+        if self.size is not None:
+            return var
+        if self.flag:
+            return '(1 if {0} & {1} else 0)'.format(var,
+                                                     self.mask << self.shift)
+        expr = var
+        if self.shift:
+            expr = '({0} >> {1})'.format(expr, self.shift)
+        if self.mask != 0xff >> self.shift:
+            expr = '({0} & {1})'.format(expr, self.mask)
+        if self.xor:
+            expr = '({0} ^ {1})'.format(expr, self.xor)
+        return expr
+
+    def encoder(self, var):
+        """ Python expression for the field's bits from its value, var. """
+        if self.size is not None:
+            return var
+        if self.flag:
+            # any bit of the mask would do, use the lowest
+            bit = (self.mask & -self.mask) << self.shift
+            return '({0} if {1} else 0)'.format(bit, var)
+        expr = var
+        if self.xor:
+            expr = '({0} ^ {1})'.format(expr, self.xor)
+        return '(({0} & {1}) << {2})'.format(expr, self.mask, self.shift)
+
+
+class Layout:
+    """ A message type's fields, compiled for decoding and encoding.
+
+    decode(data) gives a named tuple of every field, unpack(data) the same
+    as a plain tuple, getter(name) a function for just the one field.
+    pack(size, **values) builds a message of at least size bytes, fields
+    left out are zero.  Bit fields may share a byte with each other but not
+    with raw bytes.
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+        self.names = tuple(field.name for field in self.fields)
+        self.defaults = tuple(field.default for field in self.fields)
+        self.record = namedtuple(name, self.names)
+
+        # the struct format of every offset a field reads, in order
+        slots = {}
+        for field in self.fields:
+            if slots.setdefault(field.offset, field.fmt) != field.fmt:
+                raise ValueError('{0}: fields at offset {1} disagree on its '
+                                 'size'.format(name, field.offset))
+        self.slots = sorted(slots.items())
+
+        fmt = ['<']
+        pos = 0
+        for offset, slot_fmt in self.slots:
+            if offset < pos:
+                raise ValueError('{0}: offset {1} is inside the field before '
+                                 'it'.format(name, offset))
+            if offset > pos:
+                fmt.append('{0}x'.format(offset - pos))
+            fmt.append(slot_fmt)
+            pos = offset + struct.calcsize(slot_fmt)
+        self.struct = struct.Struct(''.join(fmt))
+        # the shortest message this can decode
+        self.size = self.struct.size
+
+        self.getters = {}
+        self.unpack = self.compile('unpack', self.unpack_source())
+        self.decode = self.compile('decode', self.unpack_source('decode'))
+        self.pack_into = self.compile('pack_into', self.pack_source())
+
+    def __repr__(self):
+        return 'Layout({0!r}, {1} fields)'.format(self.name, len(self.fields))
+
+    def compile(self, name, source):
+        namespace = {'_unpack_from': self.struct.unpack_from,
+                     '_pack_into': self.struct.pack_into,
+                     '_new': tuple.__new__, '_record': self.record}
+        exec(compile(source, '<layout {0}>'.format(self.name), 'exec'),
+             namespace)
+        return namespace[name]
+
+    def unpack_source(self, name='unpack'):
+        values = '({0},)'.format(', '.join(
+            field.decoder('s{0}'.format(field.offset))
+            for field in self.fields))
+        if name == 'decode':
+            # what namedtuple's _make() does, without the call overhead
+            values = '_new(_record, {0})'.format(values)
+        return ('def {0}(data, offset=0):\n'
+                '    {1}, = _unpack_from(data, offset)\n'
+                '    return {2}\n').format(
+                    name, ', '.join('s{0}'.format(offset)
+                                    for offset, fmt in self.slots), values)
+
+    def getter(self, name):
+        """ A function decoding just the one field, for lazy readers. """
+        get = self.getters.get(name)
+        if get is None:
+            field = self.fields[self.names.index(name)]
+            if field.size is None:
+                value = 'data[offset + {0}]'.format(field.offset)
+            else:
+                value = 'bytes(data[offset + {0}:offset + {1}])'.format(
+                    field.offset, field.offset + field.size)
+            get = self.getters[name] = self.compile('get', (
+                'def get(data, offset=0):\n'
+                '    s{0} = {1}\n'
+                '    return {2}\n').format(field.offset, value,
+                                            field.decoder('s{0}'.format(
+                                                field.offset))))
+        return get
+
+    def pack_source(self):
+        bits = {}
+        for i, field in enumerate(self.fields):
+            bits.setdefault(field.offset, []).append(
+                field.encoder('v{0}'.format(i)))
+        return ('def pack_into(buffer, offset, {0}):\n'
+                '    _pack_into(buffer, offset, {1})\n'
+                '    return buffer\n').format(
+                    ', '.join('v{0}'.format(i)
+                              for i in range(len(self.fields))),
+                    ', '.join(' | '.join(bits[offset])
+                              for offset, fmt in self.slots))
+
+    def pack(self, size=0, **values):
+        """ A new bytearray with values packed in at their offsets. """
+        for name in values:
+            if name not in self.record._fields:
+                raise TypeError('{0} has no field {1}'.format(self.name,
+                                                              name))
+        buffer = bytearray(max(size, self.size))
+        return self.pack_into(buffer, 0, *[
+            values.get(name, default)
+            for name, default in zip(self.names, self.defaults)])
@@ -0,0 +1,136 @@
+""" Paced, write-coalescing sender for frames going out to the spa. """
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """ Classic token bucket.
+
+    Tokens drip in at rate per second up to capacity.  A frame may go out
+    once there are enough tokens for it, or a full bucket for frames costing
+    more than the bucket holds, and then takes its cost out, possibly going
+    into debt.  With capacity 1 that is "one frame, then wait cost / rate".
+    """
+
+    def __init__(self, rate, capacity=1.0, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.stamp = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, cost):
+        """ Seconds until a frame of cost may go out, 0 if it may now. """
+        if cost <= 0:
+            return 0.0
+        self.refill()
+        need = min(cost, self.capacity)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= cost
+
+
+class OutboundScheduler:
+    """ Queue frames for the spa and write them out as few times as possible.
+
+    write is a coroutine function taking the bytes to put on the wire and
+    returning True if that worked.  Every frame has a cost in tokens of the
+    bucket; button presses and settings cost something, queries cost 0 and
+    are never held back.  Everything that may go out at the same moment is
+    joined into a single write.
+
+    send() returns a future that resolves to True once the frame has been
+    written, or False if the write failed or the queue was cleared.
+    """
+
+    def __init__(self, write, rate, capacity=1.0, log=None,
+                 clock=time.monotonic):
+        self.write = write
+        self.bucket = TokenBucket(rate, capacity, clock)
+        self.log = log or logging.getLogger(__name__)
+        self.queue = deque()
+        self.task = None
+        self.wakeup = None
+        self.writes = 0
+        self.frames = 0
+
+    def send(self, data, cost=1):
+        """ Queue data (one complete frame) and return a future for it. """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queue.append((data, cost, future))
+        if (self.task is None or self.task.done()
+                or self.task.get_loop() is not loop):
+            self.task = loop.create_task(self.run())
+        elif self.wakeup is not None:
+            self.wakeup.set()
+        return future
+
+    def clear(self):
+        """ Drop everything still queued, e.g. on disconnect. """
+        while self.queue:
+            data, cost, future = self.queue.popleft()
+            if not future.done():
+                future.set_result(False)
+
+    def ready(self):
+        """ Take every frame that may go out now off the queue, in order.
+
+        Free frames always go; paid ones go in order for as long as the
+        bucket allows.
+        """
+        batch = []
+        held = deque()
+        blocked = False
+        while self.queue:
+            item = self.queue.popleft()
+            cost = item[1]
+            if cost <= 0:
+                batch.append(item)
+            elif not blocked and self.bucket.delay(cost) == 0:
+                self.bucket.take(cost)
+                batch.append(item)
+            else:
+                blocked = True
+                held.append(item)
+        self.queue = held
+        return batch
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        try:
+            while self.queue:
+                batch = self.ready()
+                if not batch:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(
+                            self.wakeup.wait(),
+                            self.bucket.delay(self.queue[0][1]))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if len(batch) == 1:
+                    data = batch[0][0]
+                else:
+                    data = b''.join(item[0] for item in batch)
+                ok = await self.write(data)
+                self.writes += 1
+                self.frames += len(batch)
+                for item in batch:
+                    if not item[2].done():
+                        item[2].set_result(ok)
+        finally:
+            self.wakeup = None
+            self.clear()
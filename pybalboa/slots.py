@@ -0,0 +1,152 @@
+""" Frames waiting for one of our clear to send slots on the RS485 bus. """
+import heapq
+import itertools
+import time
+
+# Lower goes first
+PRIORITY_HIGH = 0     # pumps, temperature; things that matter if late
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2      # cosmetic, e.g. light colour
+
+# Seconds a queued press stays worth sending
+DEFAULT_TTL = 10.0
+
+
+class SlotEntry:
+    __slots__ = ('priority', 'seq', 'deadline', 'key', 'frame', 'waiters',
+                 'alive')
+
+    def __init__(self, priority, seq, deadline, key, frame):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.key = key
+        self.frame = frame
+        self.waiters = []
+        self.alive = True
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def resolve(self, sent):
+        for future in self.waiters:
+            if not future.done():
+                future.set_result(sent)
+        self.waiters = []
+
+
+class SlotScheduler:
+    """ Priority queue of frames, one of which goes out per slot.
+
+    Frames are keyed, normally by button; pushing a key that is already
+    waiting does not queue a second press, it just keeps the higher of the
+    two priorities and the later deadline.  Frames still waiting past their
+    deadline are dropped instead of sent.  Among equal priorities frames go
+    out in the order they were first pushed.
+
+    Anyone who wants to know when a frame went out can pass an asyncio
+    future to push(); it resolves to True when the frame is handed out in a
+    slot and False if it expired or was cleared.  Nothing here blocks or
+    needs an event loop.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.slots = 0
+        self.used = 0
+        self.pushed = 0
+        self.deduped = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """ Is a frame for key still waiting for its slot? """
+        return key in self.entries
+
+    def empty(self):
+        return not self.entries
+
+    def push(self, key, frame, priority=PRIORITY_NORMAL, ttl=None,
+             future=None):
+        """ Queue frame under key to go out in a later slot. """
+        deadline = self.clock() + (self.ttl if ttl is None else ttl)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.deduped += 1
+            entry.deadline = max(entry.deadline, deadline)
+            entry.frame = frame
+            if priority < entry.priority:
+                # re-file it, keeping its place among its new peers
+                entry.alive = False
+                new = SlotEntry(priority, entry.seq, entry.deadline, key,
+                                frame)
+                new.waiters = entry.waiters
+                entry.waiters = []
+                entry = self.entries[key] = new
+                heapq.heappush(self.heap, entry)
+        else:
+            self.pushed += 1
+            entry = SlotEntry(priority, next(self.counter), deadline, key,
+                              frame)
+            self.entries[key] = entry
+            heapq.heappush(self.heap, entry)
+        if future is not None:
+            entry.waiters.append(future)
+        return entry
+
+    def pop(self):
+        """ One of our slots came up: return the frame to send, or None. """
+        self.slots += 1
+        now = self.clock()
+        heap = self.heap
+        while heap:
+            entry = heapq.heappop(heap)
+            if not entry.alive:
+                continue
+            del self.entries[entry.key]
+            entry.alive = False
+            if entry.deadline < now:
+                self.expired += 1
+                entry.resolve(False)
+                continue
+            self.used += 1
+            entry.resolve(True)
+            return entry.frame
+        return None
+
+    def discard(self, key):
+        """ Forget a queued frame, e.g. once its change already happened. """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry.alive = False
+            entry.resolve(False)
+
+    def clear(self):
+        for entry in self.entries.values():
+            entry.alive = False
+            entry.resolve(False)
+        self.entries.clear()
+        self.heap = []
+
+    def utilisation(self):
+        """ Fraction of our slots that carried a frame. """
+        if not self.slots:
+            return 0.0
+        return self.used / self.slots
+
+    def stats(self):
+        return {
+            'queued': len(self.entries),
+            'slots': self.slots,
+            'used': self.used,
+            'utilisation': self.utilisation(),
+            'pushed': self.pushed,
+            'deduped': self.deduped,
+            'expired': self.expired,
+        }
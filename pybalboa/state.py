@@ -0,0 +1,217 @@
+""" Spa state as immutable, versioned snapshots.
+
+The protocol cores decode into plain attributes (curtemp, pump_status...)
+as they always have, but an attribute by attribute read from another
+thread, paho's network thread say, can land halfway through a parse.
+Every decoded update that changes something also publishes a new SpaState
+to spa.state.  Publishing is a single attribute assignment and a SpaState
+never changes once built, so
+
+    state = spa.state
+    if state.version != seen:
+        ...
+
+always sees one consistent update, without any locking.
+"""
+import operator
+
+# The attributes each message type decodes into, for change tracking
+STATUS_FIELDS = (
+    'tempscale', 'time_hour', 'time_minute', 'timescale', 'curtemp',
+    'settemp', 'heatmode', 'filter_mode', 'heatstate', 'temprange',
+    'pump_status', 'circ_pump_status', 'light_status', 'mister_status',
+    'blower_status', 'aux_status',
+)
+CONFIG_FIELDS = (
+    'pump_array', 'light_array', 'circ_pump', 'blower', 'mister',
+    'aux_array',
+)
+FILTER_FIELDS = (
+    'filter1_hour', 'filter1_minute', 'filter1_duration_hours',
+    'filter1_duration_minutes', 'filter2_enabled', 'filter2_hour',
+    'filter2_minute', 'filter2_duration_hours', 'filter2_duration_minutes',
+)
+
+
+class ChangeTracker:
+    """ Spots which of a fixed set of attributes a message changed.
+
+    snapshot() before decoding, changes() after.  List attributes such as
+    pump_status are copied into tuples so updating them in place doesn't
+    change the snapshot too.
+
+    Snapshotting every attribute twice per message is most of the cost of
+    a busy status stream, so a tracker can be given the message's layout
+    instead.  feeds maps a layout field to the attributes it ends up in,
+    fields not mentioned feed the attribute of the same name, if tracked.
+    touched() then compares the message's decoded tuple to the one before
+    and compare() looks at just those attributes, against the SpaState
+    last published.
+    """
+
+    def __init__(self, fields, layout=None, feeds=None):
+        self.fields = tuple(fields)
+        self.get = operator.attrgetter(*self.fields)
+        # positions of the list attributes, found on the first snapshot
+        self.lists = None
+        if layout is not None:
+            self.touched = self.compile_touched(layout, feeds or {})
+
+    def snapshot(self, obj):
+        values = list(self.get(obj))
+        if self.lists is None:
+            self.lists = [i for i, value in enumerate(values)
+                          if isinstance(value, list)]
+        for i in self.lists:
+            values[i] = tuple(values[i])
+        return values
+
+    def changes(self, obj, before):
+        """ field -> (old, new) for everything that differs from before. """
+        after = self.snapshot(obj)
+        if after == before:
+            return {}
+        return {name: (old, new)
+                for name, old, new in zip(self.fields, before, after)
+                if old != new}
+
+    def touched(self, old, new):
+        """ The attributes going from decoded tuple old to new can change.
+
+        Everything when there is no old one to go by.  Only trackers given
+        a layout have this, compiled for it.
+        """
+        raise TypeError('tracker has no layout')
+
+    def compile_touched(self, layout, feeds):
+        # each field sets the bits of the attributes it feeds, a cache
+        # turns the bits into names in field order
+        for name in feeds:
+            if name not in layout.names:
+                raise ValueError('{0} has no field {1} to feed from'.format(
+                    layout.name, name))
+        bit = {name: 1 << i for i, name in enumerate(self.fields)}
+        tests = []
+        for i, name in enumerate(layout.names):
+            fed = feeds[name] if name in feeds else (name,)
+            mask = sum(bit[attr] for attr in fed if attr in bit)
+            if mask:
+                tests.append('    if old[{0}] != new[{0}]:\n'
+                             '        moved |= {1}\n'.format(i, mask))
+        source = ('def touched(old, new):\n'
+                  '    if old is None:\n'
+                  '        return _fields\n'
+                  '    moved = 0\n'
+                  '{0}'
+                  '    names = _cache.get(moved)\n'
+                  '    if names is None:\n'
+                  '        names = _cache[moved] = _names(moved)\n'
+                  '    return names\n').format(''.join(tests))
+        fields = self.fields
+
+        def names(moved):
+            return tuple(name for i, name in enumerate(fields)
+                         if moved >> i & 1)
+
+        namespace = {'_fields': fields, '_cache': {}, '_names': names}
+        exec(compile(source, '<tracker {0}>'.format(layout.name), 'exec'),
+             namespace)
+        return namespace['touched']
+
+    def compare(self, obj, state, names):
+        """ field -> (old, new) for names whose value on obj isn't state's. """
+        changes = {}
+        index = state.INDEX
+        values = state.values
+        for name in names:
+            new = getattr(obj, name)
+            if new.__class__ is list:
+                new = tuple(new)
+            old = values[index[name]]
+            if old != new:
+                changes[name] = (old, new)
+        return changes
+
+
+CONFIG_TRACKER = ChangeTracker(CONFIG_FIELDS)
+FILTER_TRACKER = ChangeTracker(FILTER_FIELDS)
+
+
+def field_property(i):
+    return property(lambda state: state.values[i])
+
+
+def index_fields(cls):
+    """ Give a SpaState class an attribute and lookups for its FIELDS. """
+    cls.INDEX = {name: i for i, name in enumerate(cls.FIELDS)}
+    cls.tracker = ChangeTracker(cls.FIELDS)
+    for name, i in cls.INDEX.items():
+        setattr(cls, name, field_property(i))
+
+
+class SpaState:
+    """ One consistent, immutable view of the spa.
+
+    Every field in FIELDS reads as an attribute, out of the one values
+    tuple; lists such as pump_status are tuples here.  version goes up by
+    one with every update, per spa.  Two states are equal when their
+    fields are, whatever their versions, and hashing is cached, so both
+    are cheap enough to do on every update.
+    """
+    FIELDS = STATUS_FIELDS + CONFIG_FIELDS + FILTER_FIELDS
+    __slots__ = ('version', 'values', 'hash')
+
+    def __init__(self, values, version=0):
+        setattr_ = object.__setattr__
+        setattr_(self, 'version', version)
+        setattr_(self, 'values', values)
+        setattr_(self, 'hash', None)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        index_fields(cls)
+
+    @classmethod
+    def capture(cls, spa, version=0):
+        """ A state holding spa's current attribute values. """
+        return cls(tuple(cls.tracker.snapshot(spa)), version)
+
+    def evolve(self, changes):
+        """ The next version, with a change set applied. """
+        values = list(self.values)
+        index = self.INDEX
+        for name, (old, new) in changes.items():
+            values[index[name]] = new
+        return self.__class__(tuple(values), self.version + 1)
+
+    def as_dict(self):
+        state = dict(zip(self.FIELDS, self.values))
+        state['version'] = self.version
+        return state
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{0} is immutable'.format(
+            self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{0} is immutable'.format(
+            self.__class__.__name__))
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.values == other.values
+
+    def __hash__(self):
+        if self.hash is None:
+            object.__setattr__(self, 'hash', hash(self.values))
+        return self.hash
+
+    def __repr__(self):
+        return '{0}(version={1})'.format(self.__class__.__name__,
+                                         self.version)
+
+
+index_fields(SpaState)
@@ -3,14 +3,23 @@ import errno
 import logging
 import time
 import warnings
-import queue
 import socket
 from socket import error as SocketError
 from datetime import datetime 
 try:
     from balboa import *
+    from slots import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, SlotScheduler
+    from xorcodec import decode_button, xor_decode, xor_encode
+    from codes import CodeTable
+    from layout import Field, Layout
+    from actuators import Actuator, ActuatorEngine, SetpointActuator, FAILED
 except:
     from .balboa import *
+    from .slots import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, SlotScheduler
+    from .xorcodec import decode_button, xor_decode, xor_encode
+    from .codes import CodeTable
+    from .layout import Field, Layout
+    from .actuators import Actuator, ActuatorEngine, SetpointActuator, FAILED
 
 #Common to all known Balboa Products
 CLIENT_CLEAR_TO_SEND = 0x00
@@ -43,27 +52,165 @@ BTN_LIGHT_ON = 241
 BTN_LIGHT_COLOR = 242
 BTN_NA = 224
 
+#Which presses go first when several are waiting for our slot
+BUTTON_PRIORITY = {
+    BTN_P1: PRIORITY_HIGH,
+    BTN_P2: PRIORITY_HIGH,
+    BTN_CLEAR_RAY: PRIORITY_HIGH,
+    BTN_TEMP_DOWN: PRIORITY_HIGH,
+    BTN_TEMP_UP: PRIORITY_HIGH,
+    BTN_LIGHT_ON: PRIORITY_LOW,
+    BTN_LIGHT_COLOR: PRIORITY_LOW,
+}
+
 #Used to find our old channel, or an open channel
 DETECT_CHANNEL_STATE_START = 0
 DETECT_CHANNEL_STATE_CHANNEL_NOT_FOUND = 5 #Wait this man CTS cycles before deciding that a channel is available to use
 NO_CHANGE_REQUESTED = -1 #Used to return control to other devices
 CHECKS_BEFORE_RETRY = 2 #How many status messages we should receive before retrying our command
-
-
-
-class SundanceRS485(BalboaSpaWifi):
-     
-
-
-
-    def __init__(self, hostname, port=8899):
-        super().__init__(hostname, port)
-               
-        #debug
-        logging.basicConfig()
+COMMAND_RETRIES = 8 #Presses in a row that change nothing before we give up on a command
+
+#pump_status index -> the actuator for it
+PUMP_ACTUATORS = ('pump0', 'pump1', 'circ')
+
+#data is (actuator name, the target it gave up on)
+EVENT_COMMAND_FAILED = 'command_failed'
+
+#What the C4 and CA updates decode into, for change tracking
+SUNDANCE_STATUS_FIELDS = (
+    'time_hour', 'time_minute', 'pump_status', 'circ_pump_status', 'settemp',
+    'curtemp', 'heatstate', 'displayText', 'heatMode', 'month', 'day',
+    'autoCirc', 'manualCirc', 'temp2', 'unknownCirc', 'UnknownField3',
+    'UnknownField9',
+)
+LIGHT_FIELDS = (
+    'lightBrightnes', 'lightMode', 'lightR', 'lightG', 'lightB',
+    'lightCycleTime',
+)
+
+#Where things are in the decoded C4 / CA bodies
+SUNDANCE_STATUS_LAYOUT = Layout('SundanceStatus', [
+    Field('time_hour', 0, xor=6), #XOR 6 to get 24hour time
+    Field('pump1', 1, shift=2, mask=1), #b100 When pump running
+    Field('circ_pump_status', 1, shift=6, mask=1), #b1000000 when pump running
+    Field('autoCirc', 1, shift=6, mask=1), #b1100000 Includeding Pump Running
+    Field('manualCirc', 1, shift=7, mask=1), #b11000000 Includeding Pump Running
+    Field('pump0', 2, shift=4, mask=1), #Rest of field 2 is a mystery, date maybe
+    Field('UnknownField3', 3), #Always 145? MIght might be days untill water refresh, UV, or filter change
+    Field('unknownCirc', 4, shift=6, mask=1), #5 When Everything Off. 69 when clear ray / circ on?
+    Field('curtemp', 5, xor=2), #Devide by 2 if in C, otherwise F. Xor 2 for some reason
+    Field('heatMode', 6),
+    Field('day', 7, shift=3),
+    Field('month', 7, mask=7),
+    Field('settemp', 8), #Devide by 2 if in C, otherwise F
+    Field('UnknownField9', 9), #Always 107? might be days untill water refresh, UV, or filter change
+    Field('heatstate', 10, shift=6, mask=1), #= 64 when Heat on
+    Field('time_minute', 11),
+    Field('UnknownField12', 12), #Always 107? might be days untill water refresh, UV, or filter change
+    Field('displayText', 13),
+    Field('temp2', 14), #Appears to be 2nd temp sensor C  or F directly. Changes when pump is on!
+    #YEAR Dont have a guess yet
+])
+
+#Which attributes each C4 field goes into, for change tracking
+SUNDANCE_STATUS_TRACKER = ChangeTracker(SUNDANCE_STATUS_FIELDS, SUNDANCE_STATUS_LAYOUT, {
+    'pump0': ('pump_status',),
+    'pump1': ('pump_status',),
+    'circ_pump_status': ('circ_pump_status', 'pump_status', 'temp2'),
+})
+
+PUMP0 = SUNDANCE_STATUS_LAYOUT.getter('pump0')
+PUMP1 = SUNDANCE_STATUS_LAYOUT.getter('pump1')
+CIRC_STATUS = SUNDANCE_STATUS_LAYOUT.getter('circ_pump_status')
+
+SUNDANCE_LIGHTS_LAYOUT = Layout('SundanceLights', [
+    Field('lightUnknown1', 0),
+    Field('lightBrightnes', 1),
+    Field('lightB', 2),
+    Field('lightUnknown3', 3),
+    Field('lightMode', 4),
+    Field('lightUnknown4', 5),
+    Field('lightG', 6),
+    Field('lightUnknown7', 7),
+    Field('lightR', 8),
+    Field('lightCycleTime', 9),
+    Field('lightUnknown9', 9),
+])
+LIGHT_TRACKER = ChangeTracker(LIGHT_FIELDS, SUNDANCE_LIGHTS_LAYOUT)
+
+#What the codes in the updates mean on a Sundance 780
+SUNDANCE_HEAT_MODES = CodeTable([
+    [32,"AUTO"],
+    [34,"ECO"],
+    [36,"DAY"],
+])
+
+SUNDANCE_DISPLAY = CodeTable([
+    [22,"Set Temp"], #Observed when changing themperature, then went back to 23
+    [23,"Current Temp"], #Previously Observed
+    [36,"Current Temp"], #Previously Observed
+    [32,"Current Temp"], 
+    [31,"Current Temp"], #Observed while idle 
+    [30,"Set Temp"],
+    [35,"PF Set Primary Filtration"],
+    [47,"SF Set Secondary Filtration"],
+    [42,"HEAT Set Heat Mode"],
+    [53,"FC Set Filter Change Interval"],
+    [48,"UV Set Change Interval"],
+    [51,"H2O Set Water Change Interval"],
+    [62,"TIME Set Time"],
+    [59,"DATE Set Date"],
+    [0,"TEMP Set Temperature Units"],
+    [3,"LANG Set Language"],
+    [14,"LOCK Set Panel Lock"],
+])
+
+SUNDANCE_LIGHT_MODES = CodeTable([
+    [128,"Fast Blend"], #with 2 second constant
+    [127,"Slow Blend"], #wiht 4 secodn constant
+    [255,"Frozen Blend"],
+    [2,"BLue"],
+    [7,"Violet"],
+    [6,"Red"],
+    [8,"Amber"],
+    [3,"Green"],
+    [9,"Aqua"],
+    [1,"White"],
+    [0,"Off"],
+    [-1,"No Change"],
+])
+
+
+class SundanceState(SpaState):
+    """ SpaState plus what only the Sundance / Jacuzzi updates carry. """
+    EXTRA_FIELDS = tuple(name for name in SUNDANCE_STATUS_FIELDS + LIGHT_FIELDS
+                         if name not in SpaState.FIELDS)
+    FIELDS = SpaState.FIELDS + EXTRA_FIELDS
+    __slots__ = ()
+
+
+
+class SundanceProtocol(BalboaProtocol):
+    """ The Sundance / Jacuzzi RS485 protocol without any I/O.
+
+    Unlike the Wi-Fi module, the RS485 bus makes us ask for a channel and
+    only lets us talk when the spa sends a clear to send for it.  All of that
+    is handled here; SundanceRS485 just moves the bytes.
+    """
+    state_class = SundanceState
+
+    #Model profile, a subclass for another model can swap these
+    HEAT_MODE_MAP = SUNDANCE_HEAT_MODES
+    DISPLAY_MAP = SUNDANCE_DISPLAY
+    LIGHT_MODE_MAP = SUNDANCE_LIGHT_MODES
+    #Send all the presses of a temperature change in one go, see SetpointActuator
+    PLAN_SETPOINT = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.log = logging.getLogger(__name__)
-        self.log.setLevel(logging.DEBUG)
-        
+        self.decoder.log = self.log
+
         #Hard code some values that the base class needs and we dont know how to auto detect yet
         self.config_loaded = True
         self.pump_array = [1, 1, 1, 0, 0, 0]
@@ -102,21 +249,13 @@ class SundanceRS485(BalboaSpaWifi):
         self.lightCycleTime = -1
      
         #setup some sepcific items that we need that the base class doenst
-        self.queue = queue.Queue() #Messages must e sent on CTS for our channel, not any time
+        self.slots = SlotScheduler() #Messages must e sent on CTS for our channel, not any time
         self.channel = None     #The channel we are assigned to
         self.discoveredChannels = [] #all the channels the tub is prodcign CTS's for
         self.activeChannels = [] #Channels we know are in use by other RS485 devices
         self.detectChannelState = DETECT_CHANNEL_STATE_START #STate machine used to find an open channel, or to get us a new one
-        self.target_pump_status  = [NO_CHANGE_REQUESTED, NO_CHANGE_REQUESTED, NO_CHANGE_REQUESTED, NO_CHANGE_REQUESTED, NO_CHANGE_REQUESTED, NO_CHANGE_REQUESTED] #Not all messages seem to get accepted, so we have to check if our change compelted and retry if needed
-        self.targetTemp = NO_CHANGE_REQUESTED
-        
-        self.targetlightMode = NO_CHANGE_REQUESTED
-        self.targetlightBrightnes = NO_CHANGE_REQUESTED
+        self.actuators = ActuatorEngine(self.make_actuators()) #Not all presses seem to get accepted, so each setting retries until it reads right
         
-        self.attemptsToCommand = 0
-        
-        self.checkCounter = 0
-        self.checkCounterL = 0
         self.CAprior_status = None
         self.lastRGBMode = "White"
         self.lastBrightness = 100
@@ -124,152 +263,60 @@ class SundanceRS485(BalboaSpaWifi):
         self.displayTextS = "unknown"    
         self.heatModeText ="unknown"  
 
-        self.HEAT_MODE_MAP = [
-            [32,"AUTO"],
-            [34,"ECO"],
-            [36,"DAY"],
-        ]
-
-        self.DISPLAY_MAP = [
-            [22,"Set Temp"], #Observed when changing themperature, then went back to 23
-            [23,"Current Temp"], #Previously Observed
-            [36,"Current Temp"], #Previously Observed
-            [32,"Current Temp"], 
-            [31,"Current Temp"], #Observed while idle 
-            [30,"Set Temp"],
-            [35,"PF Set Primary Filtration"],
-            [47,"SF Set Secondary Filtration"],
-            [42,"HEAT Set Heat Mode"],
-            [53,"FC Set Filter Change Interval"],
-            [48,"UV Set Change Interval"],
-            [51,"H2O Set Water Change Interval"],
-            [62,"TIME Set Time"],
-            [59,"DATE Set Date"],
-            [0,"TEMP Set Temperature Units"],
-            [3,"LANG Set Language"],
-            [14,"LOCK Set Panel Lock"],
-        ]
-
-        self.LIGHT_MODE_MAP = [
-            [128,"Fast Blend"], #with 2 second constant
-            [127,"Slow Blend"], #wiht 4 secodn constant
-            [255,"Frozen Blend"],
-            [2,"BLue"],
-            [7,"Violet"],
-            [6,"Red"],
-            [8,"Amber"],
-            [3,"Green"],
-            [9,"Aqua"],
-            [1,"White"],
-            [0,"Off"],
-            [-1,"No Change"],
-        ]
-       
-
- 
-    async def connect(self):
-        """ Connect to the spa."""
-        try:
-            self.reader, self.writer = await asyncio.open_connection(
-                self.host, self.port
-            )
-        except (asyncio.TimeoutError, ConnectionRefusedError):
-            self.log.error(
-                "Cannot connect to spa at {0}:{1}".format(self.host, self.port)
-            )
-            return False
-        except Exception as e:
-            self.log.error(f"Error connecting to spa at {self.host}:{self.port}: {e}")
-            return False
-        self.connected = True
-        sock = self.writer.transport.get_extra_info('socket')
-        self.log.info(str(sock))
-        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        return True
-
-    async def send_temp_change(self, newtemp):
-        """ Change the set temp to newtemp. """
-        # Check if the new temperature is valid for the current heat mode
-        if (
-            newtemp < self.tmin[self.temprange][self.tempscale]
-            or newtemp > self.tmax[self.temprange][self.tempscale]
-        ):
-            self.log.error("Attempt to set temperature outside of heat mode boundary")
-            return
-        self.attemptsToCommand = 0
-        self.targetTemp = newtemp
+        #Our model specific defaults from above
+        self.state = self.state_class.capture(self)
 
-    async def change_light(self, light, newstate):
-        self.log.info("Not supported with New Format messaging")
-        return 
+    def queue_CCmessage(self, val, future=None, key=None, priority=None):
+        """ Queue a button press to go out on one of our clear to sends.
 
-    async def change_pump(self, pump, newstate):
-        """ Change pump #pump to newstate. """
-        # sanity check
-        if (
-            pump > MAX_PUMPS
-            or newstate > self.pump_array[pump]
-            or self.pump_status[pump] == newstate
-        ):
-            return
-        self.attemptsToCommand = 0
-        self.target_pump_status[pump] = newstate
-        
-    async def send_CCmessage(self, val):
-        """ Sends a message to the spa with variable length bytes. """    
-        # if not connected, we can't send a message
-        if not self.connected:
-            self.log.info("Tried to send CC message while not connected")
-            return
+        Pressing a button that is still waiting does not queue it twice,
+        unless each press has its own key.  future, if given, resolves to
+        True once the press went out.
+        """
 
         # if we dont have a channel number yet, we cant form a message
         if self.channel is None:
             self.log.info("Tried to send CC message without having been assigned a channel")
+            if future is not None and not future.done():
+                future.set_result(False)
             return
             
-        if self.attemptsToCommand > 64:
-            self.log.info("Tried {} times to change state {} giving up.".format( self.attemptsToCommand, val))
-            
         # Exampl: 7E 07 10 BF CC 65 85 A6 7E 
-        message_length = 7
-        data = bytearray(9)
-        data[0] = M_STARTEND
-        data[1] = message_length
-        data[2] = self.channel
-        data[3] = 0xBF
-        data[4] = CC_REQ
-        data[5] = val
-        data[6] = 0
-        data[7] = self.balboa_calc_cs(data[1:message_length], message_length - 1)
-        data[8] = M_STARTEND
+        data = encode_frame(self.channel, 0xBF, CC_REQ, val, 0)
 
         self.log.debug(f"queueing message: {data.hex()}")
-        self.queue.put(data)
-        
-        self.attemptsToCommand += 1
+        if priority is None:
+            priority = BUTTON_PRIORITY.get(val, PRIORITY_NORMAL)
+        self.slots.push(val if key is None else key, data, priority, future=future)
 
-    async def send_message(self, *bytes):
-        """ Sends a message to the spa with variable length bytes. """
-        self.log.info("Not supported with New Format messaging")
-        return 
-        
-    def xormsg(self, data):
-        lst = []
-        for i in range(0,len(data)-1,2):
-                c = data[i]^data[i+1]^1
-                lst.append(c)
-        return lst
-
-    async def parse_C4status_update(self, data):
+    def xormsg(self, data, out=None):
+        """ "Decrypt" a message, each real byte is a pair XOR'd together.
+
+        If out is given it is filled in place and returned instead of
+        building a new list.  The parsers use xor_decode() directly, which
+        returns bytes.
+        """
+        decoded = xor_decode(data)
+        if out is None:
+            return list(decoded)
+        out[:len(decoded)] = decoded
+        return out
+
+    def parse_C4status_update(self, data):
         """Parse a status update from the spa.
         01 02 03 04 05 06 07 08 09 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24 25 26 27 28 29
         7E 26 FF AF C4 AE A7 AA AB A4 A1 C9 5D A5 A1 C2 A1 9C BD CE BB E2 B9 BB AD B4 B5 A7 B7 DF B1 B2 9B D3 8D 8E 8F 88 F9 7E
         """
         self.lastC4MessageReceived = time.time()
+
+        #Mostly the spa repeats itself, skip straight to checking on our commands
+        if self.repeated(data):
+            self.check_status_commands()
+            return
         
         #print ("".join(map("{:02X} ".format, bytes(data))))        
         #"Decrypt" / Decode the message
-        data = self.xormsg(data[5:len(data)-2])
+        data = xor_decode(data[5:len(data)-2])
 
 
 
@@ -280,118 +327,28 @@ class SundanceRS485(BalboaSpaWifi):
         [9, 0, 5, 148, 5, 99, 32, 124, 96, 23, 0, 33, 110, 39, 96, 0]
         """
  
-        HOUR_FIELD = 0 #XOR 6 to get 24hour time
-        PUMP_FIELD_1 = 1 #Most bit data
-        DATE_FIELD_1 = 2 #Dont know how to use this yet...
-        UNKOWN_FIELD_3 = 3 #Always 145? MIght might be days untill water refresh, UV, or filter change
-        TBD_FIELD_4 = 4 #5 When Everything Off. 69 when clear ray / circ on?
-        TEMP_FIELD_1 = 5 #Devide by 2 if in C, otherwise F
-        HEAT_MODE_FIELD = 6 #
-        DATE_FIELD_2 = 7
-        SET_TEMP_FIELD = 8 #Devide by 2 if in C, otherwise F          
-        UNKOWN_FIELD_9 = 9 #Always 107? might be days untill water refresh, UV, or filter change  
-        HEATER_FIELD_1 = 10 #= 64 when Heat on        
-        MINUTE_FIELD = 11 #Ok as is      
-        UNKOWN_FIELD_12 = 12 #  Always 107? might be days untill water refresh, UV, or filter change           
-        DISPLAY_FIELD = 13        
-        TEMP_FEILD_2 = 14 #Appears to be 2nd temp sensor C  or F directly. Changes when pump is on!        
-
-        PUMP_2_BIT_SHIFT = 2 #b100 When pump running
-        PUMP_CIRC_BIT_SHIFT = 6 #b1000000 when pump running
-        MANUAL_CIRC = 7 #b11000000 Includeding Pump Running
-        AUTO_CIRC = 6 #b1100000 Includeding Pump Running
-        TBD_4_CIRC_SHIFT = 6 #Field 4 goes up by 64 when circ is running it seems
-        TEMP_FIELD_1_xor = 2 #need to Xor this field by 2 to get actual temperature for some reason
-        HEATER_SHIFT_1 = 6 #b1000000 when Heat on
-        DAY_SHIFT =  3 #Shift date field 2 by this amount to get day of month
-        MONTH_AND = 7  #Shift date field 2 by this to get Month of year
-        #YEAR Dont have a guess yet
-        HOUR_XOR = 6 #Need to xor the hour field with 6 to get actual hour
-        
+        values = SUNDANCE_STATUS_LAYOUT.unpack(data)
+        (time_hour, pump1, circ_pump_status, autoCirc, manualCirc, pump0,
+         UnknownField3, unknownCirc, temp, heatMode, day, month, settemp,
+         UnknownField9, heatstate, time_minute, UnknownField12, displayText,
+         temp2) = values
 
         #High Confidance
-        time_hour = data[HOUR_FIELD]^HOUR_XOR
-        time_minute = data[MINUTE_FIELD]    
-        pump0 = (data[DATE_FIELD_1] >> 4) & 1           
-        pump1 = (data[PUMP_FIELD_1] >> PUMP_2_BIT_SHIFT) & 1     
-        circ_pump_status = (data[PUMP_FIELD_1]>> PUMP_CIRC_BIT_SHIFT) & 1
-        autoCirc = (data[PUMP_FIELD_1] >> AUTO_CIRC) & 1  
-        manualCirc = (data[PUMP_FIELD_1] >> MANUAL_CIRC) & 1       
-        settemp = float(data[SET_TEMP_FIELD])
-        settemp = settemp / (2 if self.tempscale == self.TSCALE_C else 1)               
-        temp = data[TEMP_FIELD_1]^TEMP_FIELD_1_xor
+        settemp = settemp / (2 if self.tempscale == self.TSCALE_C else 1)
         curtemp = (
             temp / (2 if self.tempscale == self.TSCALE_C else 1)
             if temp != 255
             else None
         )
-        
-        heatstate = (data[HEATER_FIELD_1] >> HEATER_SHIFT_1) & 1
-        displayText = data[DISPLAY_FIELD]        
-        heatMode = data[HEAT_MODE_FIELD]
-        day = (data[DATE_FIELD_2] >> DAY_SHIFT) 
-        month = (data[DATE_FIELD_2] & MONTH_AND) 
-      
- 
-        displayTextS = "unknown"
-        for x,y in self.DISPLAY_MAP:
-            if x == displayText:
-               displayTextS = y 
-               break
-        
-        heatModeText = "unknown"
-        for x,y in self.HEAT_MODE_MAP:
-            if x == heatMode:
-               heatModeText = y 
-               break
-        
 
- 
+        displayTextS = self.DISPLAY_MAP.text(displayText)
+        heatModeText = self.HEAT_MODE_MAP.text(heatMode)
+
         #Medium Confidance
-        unknownCirc = (data[TBD_FIELD_4] >> TBD_4_CIRC_SHIFT) & 1
-        temp2 = float(data[TEMP_FEILD_2])
-        if(self.circ_pump_status == 1): #Unclear why this is ncessary
+        temp2 = float(temp2)
+        if(circ_pump_status == 1): #Unclear why this is ncessary
             temp2 = temp2 + 32   
-        temp2 = temp2 #Hide the data here for now   
-            
-        #Low Confidance
-        UnknownField3 = data[UNKOWN_FIELD_3]
-        UnknownField9 = data[UNKOWN_FIELD_9]       
-        UnknownField12 = data[UNKOWN_FIELD_12]     
-
-
-   
-   
-        #FIND OUT IF OUR LAST COMMAND WORKED...
-        if self.checkCounter > 0:
-            self.checkCounter -= 1
-            
-        if (self.checkCounter == 0):
-            if(self.settemp  != self.targetTemp and self.targetTemp != NO_CHANGE_REQUESTED):
-                if self.targetTemp < self.settemp:
-                    await self.send_CCmessage(226) #Temp Down Key
-                else:
-                    await self.send_CCmessage(225) #Temp Up Key
-                self.checkCounter = CHECKS_BEFORE_RETRY
-            elif self.settemp  == self.targetTemp:
-                self.targetTemp = NO_CHANGE_REQUESTED
-                
-        if (self.checkCounter == 0):
-            for i in range(0,len(self.target_pump_status)):
-                if self.pump_status[i] != self.target_pump_status[i] and self.target_pump_status[i] != NO_CHANGE_REQUESTED:
-                    if i == 0:
-                        await self.send_CCmessage(228) #Pump 1 Button
-                    elif i == 1: 
-                        await self.send_CCmessage(229) #Pump 2 Button
-                    else:
-                        await self.send_CCmessage(239) #Clear Ray / Circulating Pump
-                    self.checkCounter = CHECKS_BEFORE_RETRY
-                elif self.pump_status[i] == self.target_pump_status[i]:
-                    self.target_pump_status[i] = NO_CHANGE_REQUESTED
-
-
 
-        
         displayNewData = False
         unknownChange = True
         if self.time_hour != time_hour:
@@ -464,23 +421,17 @@ class SundanceRS485(BalboaSpaWifi):
             
         #Low Confidance
         self.UnknownField3 = UnknownField3
-        self.UnknownField9 = UnknownField3           
+        self.UnknownField9 = UnknownField9
         self.UnknownField12  =  UnknownField12
 
+        #Now see whether our commands took, on what the spa just said
+        self.check_status_commands()
 
-        # Check if any bytes changed
-        have_new_data = False
-        if self.prior_status is not None:
-            for i in range(0, len(data)):
-                if data[i] != self.prior_status[i]:
-                    have_new_data = True
-                    break
-        else:
-            have_new_data = True
-            self.prior_status = bytearray(len(data))
-              
-        if not have_new_data:
-             return
+
+        # The same values can come encoded differently, so compare the
+        # decoded ones as well, just the once
+        if self.prior_status is not None and self.prior_status == data:
+            return
              
         self.lastupd = time.time()
 
@@ -489,45 +440,33 @@ class SundanceRS485(BalboaSpaWifi):
             unknownChange = False
         if unknownChange or displayNewData:
             self.log.info("Time: {}".format(datetime.fromtimestamp(self.lastupd).strftime("%Y-%m-%d %H:%M:%S") ))
-            self.log.info("Unknown Change: {}        Full Message: C4: {}".format(unknownChange, data))
-            for i in range(0, len(data)):
-                if(self.prior_status[i] != data[i]):
-                    self.log.info("Changed Field: {} Old: {} New: {}".format(i, self.prior_status[i], data[i]))
+            self.log.info("Unknown Change: {}        Full Message: C4: {}".format(unknownChange, list(data)))
+            if self.prior_status is not None:
+                for i in range(0, len(data)):
+                    if(self.prior_status[i] != data[i]):
+                        self.log.info("Changed Field: {} Old: {} New: {}".format(i, self.prior_status[i], data[i]))
             self.log.info("{}-{} {}:{} P0:{} P1:{} Circ:{}  settemp:{}  curtemp:{}  heatstate:{}  displayText:{} {}  heatMode:{} {}  ".format(month,day, time_hour,time_minute,pump0,pump1,circ_pump_status,settemp,curtemp,heatstate,displayText, self.displayTextS, heatMode, self.heatModeText))
             self.log.info("unknownCirc:{} temp2:{} UnknownField3:{}  UnknownField9:{} UnknownField12:{} ".format(unknownCirc, temp2,UnknownField3,UnknownField9, UnknownField12))
  
-        # Check if any bytes changed
-        have_new_data = False
-        if self.prior_status is not None:
-            for i in range(0, len(data)):
-                if data[i] != self.prior_status[i]:
-                    have_new_data = True
-                    break
-        else:
-            have_new_data = True
-            self.prior_status = bytearray(len(data))
-              
-        if not have_new_data:
-             return
-             
-        self.lastupd = time.time()
- 
-         # populate prior_status
-        for i in range(0, len(data)):
-            self.prior_status[i] = data[i]
+        self.prior_status = data
 
-        await self.int_new_data_cb()
+        self.report_decoded(STATUS_UPDATE, SUNDANCE_STATUS_TRACKER, values)
+        self.emit(EVENT_NEW_DATA, STATUS_UPDATE)
                      
 
         
 
-    async def parse_CA_light_status_update(self, data):
+    def parse_CA_light_status_update(self, data):
         """Parse a status update from the spa.
         01 02 03 04 05 06 07 08 09 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24 25 26 27 28 29
         7E 22 FF AF CA 8A 36 CA CB C4 C5 C6 FB C0 C1 C2 3C DC DD DE DF D8 D9 DA DB D4 D5 D6 D7 D0 D1 D2 D3 EC E5 7E 
         """
+        if self.repeated(data):
+            self.check_light_commands()
+            return
+
         #"Decrypt" the message
-        data = self.xormsg(data[5:len(data)-2])
+        data = xor_decode(data[5:len(data)-2])
         
         """Parse a status update from the spa.
         01 02 03 04 05 06 07 08 09 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24 25 26 27 28 29
@@ -535,210 +474,190 @@ class SundanceRS485(BalboaSpaWifi):
         """      
         #TODO: The rest...
         
-        LIGHT_MODE_FIELD = 0 #TBD
-     
-        self.lightBrightnes = data[1]
-        self.lightMode = data[4]
-        self.lightB = data[2]
-        self.lightG = data[6]
-        self.lightR = data[8]    
-        self.lightCycleTime= data[9] 
-        self.lightUnknown1 = data[0]
-        self.lightUnknown3 = data[3]
-        self.lightUnknown4 = data[5]
-        self.lightUnknown7 = data[7]
-        self.lightUnknown9 = data[9]
+        values = SUNDANCE_LIGHTS_LAYOUT.unpack(data)
+        (self.lightUnknown1, self.lightBrightnes, self.lightB,
+         self.lightUnknown3, self.lightMode, self.lightUnknown4, self.lightG,
+         self.lightUnknown7, self.lightR, self.lightCycleTime,
+         self.lightUnknown9) = values
         
-        self.lightModeText = "unknown"
-        for x,y in self.LIGHT_MODE_MAP:
-            if x == self.lightMode:
-               self.lightModeText = y 
-               break   
+        self.lightModeText = self.LIGHT_MODE_MAP.text(self.lightMode)
                
-        if self.checkCounterL > 0:
-            self.checkCounterL -= 1
-            
-        if (self.checkCounterL == 0):
-            if(self.targetlightMode  != self.lightMode and self.targetlightMode != NO_CHANGE_REQUESTED):
-                await self.send_CCmessage(BTN_LIGHT_COLOR) 
-                self.checkCounterL = CHECKS_BEFORE_RETRY
-            elif self.targetlightMode  == self.lightMode:
-                self.targetlightMode = NO_CHANGE_REQUESTED
-
-        if (self.checkCounterL == 0):
-            if(self.targetlightBrightnes  != self.lightBrightnes and self.targetlightBrightnes != NO_CHANGE_REQUESTED):
-                await self.send_CCmessage(BTN_LIGHT_ON) 
-                self.checkCounterL = CHECKS_BEFORE_RETRY
-            elif self.targetlightBrightnes  == self.lightBrightnes:
-                self.targetlightBrightnes = NO_CHANGE_REQUESTED                
-
-
-        have_new_data = False
-        if self.CAprior_status is not None:
-            for i in range(0, len(data)):
-                if data[i] != self.CAprior_status[i]:
-                    have_new_data = True
-                    break
-        else:
-            have_new_data = True
-            self.CAprior_status = bytearray(len(data))
+        self.check_light_commands()
 
-        
-        if not have_new_data:
-             return
+
+        if self.CAprior_status is not None and self.CAprior_status == data:
+            return
              
-        self.log.info("CA{}".format(data))
+        self.log.info("CA{}".format(list(data)))
         self.lastupd = time.time()
-        for i in range(0, len(data)):
-            self.CAprior_status[i] = data[i]
+        self.CAprior_status = data
+        self.report_decoded(LIGHTS_UPDATE, LIGHT_TRACKER, values)
         
         
-    async def setMyChan(self, chan):
+    def make_actuators(self):
+        """ The settings we can change and the buttons that change them.
+
+        Each converges on its own, a subclass for another model can change
+        the buttons or budgets here.
+        """
+        def temp_button(current, target):
+            return BTN_TEMP_DOWN if target < current else BTN_TEMP_UP
+        def temp_increment(spa):
+            return 0.5 if spa.tempscale == spa.TSCALE_C else 1
+        def showing_settemp(spa):
+            #The first press only brings up the set temp, unless it's up already
+            return spa.DISPLAY_MAP.text(spa.displayText) == "Set Temp"
+        return [
+            SetpointActuator('settemp', 'status', lambda spa: spa.settemp, temp_button,
+                             increment=temp_increment, ready=showing_settemp, plan=self.PLAN_SETPOINT,
+                             budget=COMMAND_RETRIES, settle=CHECKS_BEFORE_RETRY),
+            Actuator('pump0', 'status', lambda spa: spa.pump_status[0], BTN_P1,
+                     budget=COMMAND_RETRIES, settle=CHECKS_BEFORE_RETRY),
+            Actuator('pump1', 'status', lambda spa: spa.pump_status[1], BTN_P2,
+                     budget=COMMAND_RETRIES, settle=CHECKS_BEFORE_RETRY),
+            Actuator('circ', 'status', lambda spa: spa.pump_status[2], BTN_CLEAR_RAY,
+                     budget=COMMAND_RETRIES, settle=CHECKS_BEFORE_RETRY),
+            Actuator('lightMode', 'lights', lambda spa: spa.lightMode, BTN_LIGHT_COLOR,
+                     budget=COMMAND_RETRIES, settle=CHECKS_BEFORE_RETRY),
+            Actuator('lightBrightnes', 'lights', lambda spa: spa.lightBrightnes, BTN_LIGHT_ON,
+                     budget=COMMAND_RETRIES, settle=CHECKS_BEFORE_RETRY),
+        ]
+
+    def run_actuators(self, source):
+        """ Press whatever the settings shown by source still need. """
+        #Without a channel there is nowhere to send presses, keep the targets for later
+        if self.channel is None or not self.actuators.active(source):
+            return
+        presses, finished = self.actuators.update(self, source, self.slots)
+        for press in presses:
+            #The rest of a burst lets other settings' presses go first
+            self.queue_CCmessage(press.button, key=press.key, priority=PRIORITY_NORMAL if press.follow else None)
+        for actuator in finished:
+            #A press still waiting would overshoot
+            for key in actuator.pressed:
+                self.slots.discard(key)
+            actuator.pressed = ()
+            if actuator.state == FAILED:
+                self.log.warning("Tried {} times to change {}, giving up.".format(actuator.budget, actuator.name))
+                self.emit(EVENT_COMMAND_FAILED, data=(actuator.name, actuator.target))
+
+    def check_status_commands(self):
+        """ Retry a temperature or pump change that hasn't happened yet. """
+        self.run_actuators('status')
+
+    def check_light_commands(self):
+        """ Retry a light change that hasn't happened yet. """
+        self.run_actuators('lights')
+
+    def target(self, name):
+        target = self.actuators.target(name)
+        return NO_CHANGE_REQUESTED if target is None else target
+
+    def set_target(self, name, target):
+        """ Have actuator name converge on target, NO_CHANGE_REQUESTED stops it. """
+        self.actuators.set_target(name, None if target == NO_CHANGE_REQUESTED else target)
+
+    @property
+    def targetTemp(self):
+        return self.target('settemp')
+
+    @targetTemp.setter
+    def targetTemp(self, target):
+        self.set_target('settemp', target)
+
+    @property
+    def target_pump_status(self):
+        return tuple(self.target(name) for name in PUMP_ACTUATORS) + (NO_CHANGE_REQUESTED,) * (MAX_PUMPS - len(PUMP_ACTUATORS))
+
+    @property
+    def targetlightMode(self):
+        return self.target('lightMode')
+
+    @targetlightMode.setter
+    def targetlightMode(self, target):
+        self.set_target('lightMode', target)
+
+    @property
+    def targetlightBrightnes(self):
+        return self.target('lightBrightnes')
+
+    @targetlightBrightnes.setter
+    def targetlightBrightnes(self, target):
+        self.set_target('lightBrightnes', target)
+
+    def setMyChan(self, chan):
         self.channel = chan
+        #The tub only starts a CTS for a channel it just handed out after that, the first one isn't a conflict
+        if chan not in self.discoveredChannels:
+            self.discoveredChannels.append(chan)
         self.log.info("Got assigned channel = {}".format(self.channel))
-        message_length = 7
-        self.NTS = bytearray(9)
-        self.NTS[0] = M_STARTEND
-        self.NTS[1] = message_length
-        self.NTS[2] = self.channel
-        self.NTS[3] = 0xBF
-        self.NTS[4] = CC_REQ
-        self.NTS[5] = 0 #Dummy
-        self.NTS[6] = 0
-        self.NTS[7] = self.balboa_calc_cs(self.NTS[1:message_length], message_length - 1)
-        self.NTS[8] = M_STARTEND
-
-    async def listen(self):
-        """ Listen to the spa babble forever. """
-        
-        #teststring = "7E25FFAF161012270B16420026FA260A140181000042011C00098000000A000000FF0000002F7E"
-        #data = bytes.fromhex(teststring)
-        #await self.parse_C4status_update(data)
-        
-        #return
-        
-        while True:
-            if not self.connected:
-                # sleep and hope the checker fixes us
-                await asyncio.sleep(5)
-                continue
-
-            data = await self.read_one_message()
-            if data is None:
-                #await asyncio.sleep(0.0001)
-                continue
-
-            channel = data[2]
-            mid = data[3]
-            mtype = data[4]
-
-            #print("a")
-
-
-            if mtype == STATUS_UPDATE:
-                await self.parse_C4status_update(data)
-            elif mtype == LIGHTS_UPDATE:
-                await self.parse_CA_light_status_update(data)
-            elif mtype == STATUS_UPDATE_ALT_16:
-                await self.parse_C4status_update(data)
-            elif mtype == LIGHTS_UPDATE_ALT_23:
-                await self.parse_CA_light_status_update(data)
-            elif mtype == CLIENT_CLEAR_TO_SEND:
-                if self.channel is None and self.detectChannelState == DETECT_CHANNEL_STATE_CHANNEL_NOT_FOUND:
-                    message_length = 8
-                    data = bytearray(10)
-                    data[0] = M_STARTEND
-                    data[1] = message_length
-                    data[2] = 0xFE
-                    data[3] = 0xBF
-                    data[4] = CHANNEL_ASSIGNMENT_REQ #type
-                    data[5] = 0x02
-                    data[6] = 0xF1 #random Magic
-                    data[7] = 0x73
-                    data[8] = self.balboa_calc_cs(data[1:message_length], message_length - 1)
-                    data[9] = M_STARTEND
-                    self.writer.write(data)
-                    await self.writer.drain()                        
-            elif mtype == CHANNEL_ASSIGNMENT_RESPONCE:
-                #TODO check for magic numbers to be repeated back
-                await self.setMyChan(data[5])
-                message_length = 5
-                data = bytearray(7)
-                data[0] = M_STARTEND
-                data[1] = message_length
-                data[2] = self.channel
-                data[3] = 0xBF
-                data[4] = CHANNEL_ASSIGNMENT_ACK #type
-                data[5] = self.balboa_calc_cs(data[1:message_length], message_length - 1)
-                data[6] = M_STARTEND
-                self.writer.write(data) 
-                await self.writer.drain()                   
-            elif mtype == EXISTING_CLIENT_REQ:                      
-                message_length = 8
-                data = bytearray(9)
-                data[0] = M_STARTEND
-                data[1] = message_length
-                data[2] = self.channel
-                data[3] = 0xBF
-                data[4] = EXISTING_CLIENT_RESPONCE #type
-                data[5] = 0x04 #Dont know!
-                data[6] = 0x08 #Dont know!
-                data[7] = 0x00 #Dont know!
-                data[8] = self.balboa_calc_cs(data[1:message_length], message_length - 1)
-                data[9] = M_STARTEND
-                self.writer.write(data)
-                await self.writer.drain()
-            elif mtype == CLEAR_TO_SEND:               
-                if not channel in  self.discoveredChannels:
-                    self.discoveredChannels.append(data[2])
-                    #print("Discovered Channels:" + str(self.discoveredChannels))
-                    #detec conflict
-                    if data[2] == self.channel:
-                        self.log.warn("Found a channel conflict, getting a new channel")
-                        self.channel = None
-                        self.detectChannelState = DETECT_CHANNEL_STATE_START
-                elif channel == self.channel:
-                    if self.queue.empty():
-                        #self.writer.write(self.NTS)
-                        await self.writer.drain()
-                    else:
-                        msg = self.queue.get()
-                        self.writer.write(msg)
-                        await self.writer.drain()
-                        self.log.debug("sent")
-            else:
-                if (mtype == CC_REQ) or  (mtype == CC_REQ_ALT_17):
-                    if not channel in  self.activeChannels:
-                        self.activeChannels.append(data[2])
-                        self.log.info("Active Channels:" + str(self.activeChannels))
-                    elif  self.detectChannelState < DETECT_CHANNEL_STATE_CHANNEL_NOT_FOUND:
-                        self.detectChannelState += 1
-                        if self.detectChannelState == DETECT_CHANNEL_STATE_CHANNEL_NOT_FOUND:
-                            self.discoveredChannels.sort()
-                            for chan in self.discoveredChannels:
-                                if not chan in self.activeChannels:
-                                    await self.setMyChan( chan)
-                                    break
-                    if (mtype == CC_REQ_ALT_17):
-                        if (data[5]) != 0:
-                            self.log.info("Got Button Press x".format(channel, mid, mtype) + "".join(map("{:02X} ".format, bytes(data))))
-                    if (mtype == CC_REQ):
-                        buttondata = data[5]^data[6]
-                        if buttondata != 224:
-                            self.log.info("Got Button Press {} {} : ".format(data[5]^data[6]^1, buttondata) + "".join(map("{:02X} ".format, bytes(data))))
-                elif (mtype > NOTHING_TO_SEND) :
-                    self.log.warn("Unknown Message {:02X} {:02X} {:02X} x".format(channel, mid, mtype) + "".join(map("{:02X} ".format, bytes(data))))
-              
-    async def spa_configured(self):
-            return True
-        
-    async def listen_until_configured(self, maxiter=20):
-        """ Listen to the spa babble until we are configured."""
-        return True
-      
-   
-   
-   
+        self.NTS = encode_frame(self.channel, 0xBF, CC_REQ, 0, 0) #Dummy
+
+    def handle_client_cts(self, data):
+        """ Any new client may speak up, ask for a channel if we need one. """
+        if self.channel is None and self.detectChannelState == DETECT_CHANNEL_STATE_CHANNEL_NOT_FOUND:
+            #0xF1 0x73 are random Magic
+            data = encode_frame(0xFE, 0xBF, CHANNEL_ASSIGNMENT_REQ, 0x02, 0xF1, 0x73)
+            self.outgoing += data
+
+    def handle_channel_assignment(self, data):
+        #TODO check for magic numbers to be repeated back
+        self.setMyChan(data[5])
+        data = encode_frame(self.channel, 0xBF, CHANNEL_ASSIGNMENT_ACK)
+        self.outgoing += data
+
+    def handle_existing_client_req(self, data):
+        #0x04 0x08 0x00 Dont know!
+        data = encode_frame(self.channel, 0xBF, EXISTING_CLIENT_RESPONCE, 0x04, 0x08, 0x00)
+        self.outgoing += data
+
+    def handle_cts(self, data):
+        """ Clear to send for a channel, ours or somebody else's. """
+        channel = data[2]
+        if not channel in  self.discoveredChannels:
+            self.discoveredChannels.append(data[2])
+            #print("Discovered Channels:" + str(self.discoveredChannels))
+            #detec conflict
+            if data[2] == self.channel:
+                self.log.warning("Found a channel conflict, getting a new channel")
+                self.channel = None
+                self.detectChannelState = DETECT_CHANNEL_STATE_START
+        elif channel == self.channel:
+            msg = self.slots.pop()
+            if msg is not None:
+                self.outgoing += msg
+                self.log.debug("sent")
+
+    def handle_cc_req(self, data):
+        """ Another panel talking, which tells us its channel is taken. """
+        channel = data[2]
+        mtype = data[4]
+        if not channel in  self.activeChannels:
+            self.activeChannels.append(data[2])
+            self.log.info("Active Channels:" + str(self.activeChannels))
+        elif  self.detectChannelState < DETECT_CHANNEL_STATE_CHANNEL_NOT_FOUND:
+            self.detectChannelState += 1
+            if self.detectChannelState == DETECT_CHANNEL_STATE_CHANNEL_NOT_FOUND:
+                self.discoveredChannels.sort()
+                for chan in self.discoveredChannels:
+                    if not chan in self.activeChannels:
+                        self.setMyChan( chan)
+                        break
+        if (mtype == CC_REQ_ALT_17):
+            if (data[5]) != 0:
+                self.log.info("Got Button Press x" + "".join(map("{:02X} ".format, bytes(data))))
+        if (mtype == CC_REQ):
+            buttondata = decode_button(data)
+            if buttondata != 224:
+                self.log.info("Got Button Press {} {} : ".format(buttondata^1, buttondata) + "".join(map("{:02X} ".format, bytes(data))))
+
+    def unhandled_message(self, data):
+        channel = data[2]
+        mid = data[3]
+        mtype = data[4]
+        if (mtype > NOTHING_TO_SEND) :
+            self.log.warning("Unknown Message {:02X} {:02X} {:02X} x".format(channel, mid, mtype) + "".join(map("{:02X} ".format, bytes(data))))
+
     def get_day(self):
         return self.day
         
@@ -791,8 +710,241 @@ class SundanceRS485(BalboaSpaWifi):
         return self.lightG
         
     def get_lightB(self):  
-        return self.lightB 
-         
+        return self.lightB
+
+    def get_slot_stats(self):
+        return self.slots.stats()
+
+    def get_actuator_stats(self):
+        return self.actuators.stats()
+
+
+SundanceProtocol.registry = MessageRegistry({
+    STATUS_UPDATE: method_handler('parse_C4status_update'),
+    LIGHTS_UPDATE: method_handler('parse_CA_light_status_update'),
+    STATUS_UPDATE_ALT_16: method_handler('parse_C4status_update'),
+    LIGHTS_UPDATE_ALT_23: method_handler('parse_CA_light_status_update'),
+    CLIENT_CLEAR_TO_SEND: method_handler('handle_client_cts'),
+    CHANNEL_ASSIGNMENT_RESPONCE: method_handler('handle_channel_assignment'),
+    EXISTING_CLIENT_REQ: method_handler('handle_existing_client_req'),
+    CLEAR_TO_SEND: method_handler('handle_cts'),
+    CC_REQ: method_handler('handle_cc_req'),
+    CC_REQ_ALT_17: method_handler('handle_cc_req'),
+})
+
+
+class LazyField:
+    """ A status attribute decoded from the last C4 body when it's read.
+
+    decode(spa, body) works it out, the answer is kept until the next
+    different body comes in.  Setting the attribute just stores the value.
+    """
+    __slots__ = ('name', 'decode')
+
+    def __init__(self, decode):
+        self.decode = decode
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, spa, owner=None):
+        if spa is None:
+            return self
+        cache = spa.lazy_cache
+        try:
+            return cache[self.name]
+        except KeyError:
+            pass
+        if spa.status_body is None:
+            raise AttributeError(self.name)
+        value = cache[self.name] = self.decode(spa, spa.status_body)
+        return value
+
+    def __set__(self, spa, value):
+        spa.lazy_cache[self.name] = value
+
+
+def body_field(name, convert=None):
+    """ A LazyField for a field of SUNDANCE_STATUS_LAYOUT.
+
+    convert(spa, value), if given, turns the raw field into the attribute.
+    """
+    get = SUNDANCE_STATUS_LAYOUT.getter(name)
+    if convert is None:
+        return LazyField(lambda spa, body: get(body))
+    return LazyField(lambda spa, body: convert(spa, get(body)))
+
+
+class LazySundanceProtocol(SundanceProtocol):
+    """ SundanceProtocol that only decodes the status fields you read.
+
+    A C4 update that differs from the last one just stores its decoded
+    body; curtemp, pump_status and the rest are worked out the first time
+    they are read and kept until the next different update.  Reading
+    spa.state decodes everything, into a new version if anything came in
+    since it was last read.
+
+    The price is that C4 updates raise no EVENT_CHANGED and log nothing
+    about what changed, there is nothing to compare until someone looks.
+    EVENT_NEW_DATA still goes out for every update that differs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # the LazyFields live in here, including what __init__ sets them to
+        self.lazy_cache = {}
+        self.status_body = None
+        self.prior_state = None
+        super().__init__(*args, **kwargs)
+
+    def parse_C4status_update(self, data):
+        self.lastC4MessageReceived = time.time()
+        if self.repeated(data):
+            self.check_status_commands()
+            return
+        body = xor_decode(data[5:len(data)-2])
+        # the same values can come encoded differently
+        if body == self.status_body:
+            self.check_status_commands()
+            return
+
+        state = self.lazy_cache.get('state')
+        if state is not None:
+            self.prior_state = state
+        self.status_body = self.prior_status = body
+        self.lazy_cache = {}
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("C4: {}".format(list(body)))
+
+        self.check_status_commands()
+        self.lastupd = time.time()
+        self.emit(EVENT_NEW_DATA, STATUS_UPDATE)
+
+    def scale_temperature(self, temp):
+        return temp / (2 if self.tempscale == self.TSCALE_C else 1)
+
+    def decode_curtemp(self, temp):
+        return None if temp == 255 else self.scale_temperature(temp)
+
+    def decode_temp2(self, temp2):
+        temp2 = float(temp2)
+        #Like the eager parser, goes by the circulation pump in this update
+        if self.circ_pump_status == 1:
+            temp2 = temp2 + 32
+        return temp2
+
+    def decode_pump_status(self, body):
+        return [PUMP0(body), PUMP1(body), CIRC_STATUS(body), 0, 0, 0]
+
+    def decode_state(self, body):
+        prior = self.prior_state
+        return self.state_class.capture(
+            self, 0 if prior is None else prior.version + 1)
+
+    time_hour = body_field('time_hour')
+    time_minute = body_field('time_minute')
+    circ_pump_status = body_field('circ_pump_status')
+    autoCirc = body_field('autoCirc')
+    manualCirc = body_field('manualCirc')
+    unknownCirc = body_field('unknownCirc')
+    heatstate = body_field('heatstate')
+    heatMode = body_field('heatMode')
+    displayText = body_field('displayText')
+    day = body_field('day')
+    month = body_field('month')
+    UnknownField3 = body_field('UnknownField3')
+    UnknownField9 = body_field('UnknownField9')
+    UnknownField12 = body_field('UnknownField12')
+    curtemp = body_field('curtemp', decode_curtemp)
+    settemp = body_field('settemp', scale_temperature)
+    temp2 = body_field('temp2', decode_temp2)
+    displayTextS = body_field(
+        'displayText', lambda spa, code: spa.DISPLAY_MAP.text(code))
+    heatModeText = body_field(
+        'heatMode', lambda spa, code: spa.HEAT_MODE_MAP.text(code))
+    pump_status = LazyField(decode_pump_status)
+    state = LazyField(decode_state)
+
+
+class SundanceRS485(SundanceProtocol, BalboaSpaWifi):
+    def __init__(self, hostname, port=8899):
+        super().__init__(hostname, port)
+
+    async def connect(self):
+        """ Connect to the spa."""
+        try:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        except (asyncio.TimeoutError, ConnectionRefusedError):
+            self.log.error(
+                "Cannot connect to spa at {0}:{1}".format(self.host, self.port)
+            )
+            return False
+        except Exception as e:
+            self.log.error(f"Error connecting to spa at {self.host}:{self.port}: {e}")
+            return False
+        self.decoder.reset()
+        self.connected = True
+        sock = self.writer.transport.get_extra_info('socket')
+        self.log.info(str(sock))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return True
+
+    async def send_temp_change(self, newtemp):
+        """ Change the set temp to newtemp. """
+        # Check if the new temperature is valid for the current heat mode
+        if (
+            newtemp < self.tmin[self.temprange][self.tempscale]
+            or newtemp > self.tmax[self.temprange][self.tempscale]
+        ):
+            self.log.error("Attempt to set temperature outside of heat mode boundary")
+            return
+        self.set_target('settemp', newtemp)
+
+    async def change_light(self, light, newstate):
+        self.log.info("Not supported with New Format messaging")
+        return 
+
+    async def change_pump(self, pump, newstate):
+        """ Change pump #pump to newstate. """
+        # sanity check
+        if (
+            pump >= len(PUMP_ACTUATORS)
+            or newstate > self.pump_array[pump]
+            or self.pump_status[pump] == newstate
+        ):
+            return
+        self.set_target(PUMP_ACTUATORS[pump], newstate)
+        
+    async def send_CCmessage(self, val):
+        """ Press a button, returns True once the press went out. """    
+        # if not connected, we can't send a message
+        if not self.connected:
+            self.log.info("Tried to send CC message while not connected")
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self.queue_CCmessage(val, future)
+        return await future
+
+    async def send_message(self, *bytes):
+        """ Sends a message to the spa with variable length bytes. """
+        self.log.info("Not supported with New Format messaging")
+        return 
+        
+    async def spa_configured(self):
+            return True
+
+    def configured(self):
+        return True
+        
+    async def listen_until_configured(self, maxiter=20):
+        """ Listen to the spa babble until we are configured."""
+        return True
+      
+   
+   
+   
     async def change_rgbbrightness(self, light, newstate):
         if newstate  < 16.5:
             newstate = 0
@@ -802,16 +954,16 @@ class SundanceRS485(BalboaSpaWifi):
             newstate = 66
         else:
             newstate = 100
-        self.attemptsToCommand = 0          
-        self.targetlightBrightnes = newstate
+        self.set_target('lightBrightnes', newstate)
    
     async def change_rgbmode(self, light, newstate):
         #cant change mode when off
         if self.lightBrightnes == 0:
             return            
-        self.attemptsToCommand = 0     
-        newmode = -1
-        for x,y in self.LIGHT_MODE_MAP:
-            if y == newstate:
-                newmode = x 
-        self.targetlightMode = newmode
+        self.set_target('lightMode', self.LIGHT_MODE_MAP.code(newstate))
+
+
+class LazySundanceRS485(LazySundanceProtocol, SundanceRS485):
+    """ SundanceRS485 decoding status fields on demand, see
+    LazySundanceProtocol.
+    """
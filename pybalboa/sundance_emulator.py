@@ -0,0 +1,369 @@
+""" A pretend Sundance / Jacuzzi RS485 bus behind a TCP bridge.
+
+Run with:  python -m pybalboa.sundance_emulator [--port 8899] [--panels 1]
+
+It plays the spa's side of the bus the way SundanceRS485 sees it through
+an RS485 to TCP bridge: clear to sends for every assigned channel, other
+panels answering theirs, channel assignment for newcomers, existing
+client requests, and XOR encoded status and light updates.  Button
+presses from any channel are applied to the simulated tub.
+
+variant picks the message types: 'sundance' (C4 / CA / CC) or 'jacuzzi'
+(16 / 23 / 17).
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+
+try:
+    from .sundanceRS485 import *
+    from .emulator import Faults
+except ImportError:
+    from sundanceRS485 import *
+    from emulator import Faults
+
+FIRST_CHANNEL = 0x10
+BROADCAST_CHANNEL = 0xFE
+
+HEAT_MODES = (32, 34, 36)
+LIGHT_MODES = (1, 2, 7, 6, 8, 3, 9, 128, 127, 255)
+BRIGHTNESS_STEPS = (0, 33, 66, 100)
+
+# What the display shows while the set temperature is up
+DISPLAY_SET_TEMP = 22
+# Trips round the bus the set temperature stays up after the last press
+SET_MODE_CYCLES = 30
+
+VARIANTS = {
+    'sundance': (STATUS_UPDATE, LIGHTS_UPDATE, CC_REQ),
+    'jacuzzi': (STATUS_UPDATE_ALT_16, LIGHTS_UPDATE_ALT_23, CC_REQ_ALT_17),
+}
+
+
+class EmulatedTub:
+    """ The tub behind the bus: what the C4 and CA updates report and what
+    the panel buttons do to it.
+
+    With wake set the temperature buttons behave like a real topside: the
+    first press only brings the set temperature up on the display, presses
+    change it while it is up, and it goes away SET_MODE_CYCLES after the
+    last one.
+    """
+
+    def __init__(self, curtemp=98, settemp=100, clock=time.time, wake=False):
+        self.clock = clock
+        self.wake = wake
+        self.set_mode = 0
+        self.curtemp = curtemp
+        self.settemp = settemp
+        self.pumps = [0, 0]
+        self.circ = 0
+        self.heat_mode = HEAT_MODES[0]
+        self.display = 23
+        self.brightness = 0
+        self.light_mode = LIGHT_MODES[0]
+        self.presses = 0
+
+    def heating(self):
+        return self.curtemp < self.settemp
+
+    def status_values(self):
+        t = time.localtime(self.clock())
+        values = SUNDANCE_STATUS_LAYOUT.pack(
+            16,
+            time_hour=t.tm_hour,
+            pump0=self.pumps[0],
+            pump1=self.pumps[1],
+            circ_pump_status=self.circ,
+            autoCirc=self.circ,
+            UnknownField3=145,
+            unknownCirc=self.circ,
+            curtemp=int(self.curtemp),
+            heatMode=self.heat_mode,
+            day=t.tm_mday,
+            month=t.tm_mon,
+            settemp=self.settemp,
+            UnknownField9=107,
+            heatstate=1 if self.heating() else 0,
+            time_minute=t.tm_min,
+            UnknownField12=107,
+            displayText=DISPLAY_SET_TEMP if self.set_mode else self.display,
+            temp2=int(self.curtemp))
+        # the rest of field 4 is always there
+        values[4] |= 5
+        return values
+
+    def light_values(self):
+        return SUNDANCE_LIGHTS_LAYOUT.pack(
+            14,
+            lightBrightnes=self.brightness,
+            lightMode=self.light_mode if self.brightness else 0,
+            lightCycleTime=2)
+
+    def press(self, button):
+        """ What the topside panel does for a button code. """
+        self.presses += 1
+        if button == BTN_P1:
+            self.pumps[0] ^= 1
+        elif button == BTN_P2:
+            self.pumps[1] ^= 1
+        elif button == BTN_CLEAR_RAY:
+            self.circ ^= 1
+        elif button in (BTN_TEMP_UP, BTN_TEMP_DOWN):
+            if self.set_mode or not self.wake:
+                if button == BTN_TEMP_UP:
+                    self.settemp = min(104, self.settemp + 1)
+                else:
+                    self.settemp = max(80, self.settemp - 1)
+            if self.wake:
+                self.set_mode = SET_MODE_CYCLES
+        elif button == BTN_LIGHT_ON:
+            i = BRIGHTNESS_STEPS.index(self.brightness)
+            self.brightness = BRIGHTNESS_STEPS[(i + 1) % len(BRIGHTNESS_STEPS)]
+        elif button == BTN_LIGHT_COLOR and self.brightness:
+            i = LIGHT_MODES.index(self.light_mode)
+            self.light_mode = LIGHT_MODES[(i + 1) % len(LIGHT_MODES)]
+
+    def tick(self):
+        """ One trip round the bus went by. """
+        if self.set_mode:
+            self.set_mode -= 1
+
+
+class SundanceBus:
+    """ The bus itself, without any I/O.
+
+    panels other clients already hold channels from FIRST_CHANNEL up and
+    answer every clear to send; busy is the fraction of those answers that
+    carry a button press rather than nothing.
+    stale channels are polled too but nobody answers them, like a panel
+    that has been unplugged; a newcomer may take one of those over.
+
+    cycle() returns the frames for one trip round the bus; handle() takes
+    a frame written by the client and returns the replies.
+    """
+
+    def __init__(self, panels=1, stale=0, variant='sundance', busy=0.0,
+                 tub=None, seed=None):
+        self.status_type, self.lights_type, self.cc_type = VARIANTS[variant]
+        self.tub = tub or EmulatedTub()
+        self.random = random.Random(seed)
+        self.busy = busy
+        self.panels = [FIRST_CHANNEL + i for i in range(panels)]
+        self.channels = self.panels + [FIRST_CHANNEL + panels + i
+                                       for i in range(stale)]
+        self.cycles = 0
+        self.assigned = []
+        self.presses = []
+
+    def frame(self, *message):
+        return encode_frame(*message)
+
+    def status_frame(self):
+        values = self.tub.status_values()
+        body = xor_encode(values, 33, self.cycles)
+        return self.frame(0xFF, 0xAF, self.status_type, *body)
+
+    def lights_frame(self):
+        values = self.tub.light_values()
+        body = xor_encode(values, 29, self.cycles)
+        return self.frame(0xFF, 0xAF, self.lights_type, *body)
+
+    def panel_reply(self, channel):
+        """ What another panel says when its turn comes. """
+        button = BTN_NA
+        if self.busy and self.random.random() < self.busy:
+            button = self.random.choice((BTN_MENU, BTN_NA))
+        if self.cc_type == CC_REQ:
+            return self.frame(channel, 0xBF, CC_REQ, button, 0)
+        return self.frame(channel, 0xBF, CC_REQ_ALT_17,
+                          0 if button == BTN_NA else button, 0)
+
+    def cycle(self):
+        self.cycles += 1
+        self.tub.tick()
+        frames = [self.status_frame(), self.lights_frame()]
+        for channel in self.channels:
+            frames.append(self.frame(channel, 0xBF, CLEAR_TO_SEND))
+            if channel in self.panels:
+                frames.append(self.panel_reply(channel))
+        # anybody new may ask for a channel now
+        frames.append(self.frame(BROADCAST_CHANNEL, 0xBF, CLIENT_CLEAR_TO_SEND))
+        if self.cycles % 16 == 0:
+            frames.append(self.frame(BROADCAST_CHANNEL, 0xBF,
+                                     EXISTING_CLIENT_REQ))
+        return frames
+
+    def free_channel(self):
+        channel = FIRST_CHANNEL
+        while channel in self.channels:
+            channel += 1
+        return channel
+
+    def handle(self, data):
+        channel = data[2]
+        mtype = data[4]
+        if mtype == CHANNEL_ASSIGNMENT_REQ:
+            new = self.free_channel()
+            self.channels.append(new)
+            # repeat the client's magic back
+            return [self.frame(BROADCAST_CHANNEL, 0xBF,
+                               CHANNEL_ASSIGNMENT_RESPONCE, new, data[6],
+                               data[7])]
+        if mtype == CHANNEL_ASSIGNMENT_ACK:
+            self.assigned.append((time.monotonic(), channel))
+        elif mtype == CC_REQ:
+            self.button(channel, decode_button(data))
+        elif mtype == CC_REQ_ALT_17:
+            self.button(channel, data[5])
+        return []
+
+    def button(self, channel, button):
+        if button in (0, BTN_NA):
+            return
+        self.presses.append((time.monotonic(), channel, button))
+        self.tub.press(button)
+
+    def drive(self, spa, until, limit=1000):
+        """ Run spa, a SundanceProtocol, on the bus without any sockets.
+
+        Every frame of a trip is fed to spa, and whatever spa says back is
+        handled before the next one, as if the bridge took no time.  Stops
+        after the first trip that leaves until(spa) true and returns how
+        many trips that was, or None if limit of them went by first.
+        """
+        decoder = FrameDecoder()
+        for trip in range(1, limit + 1):
+            for frame in self.cycle():
+                spa.receive_data(frame)
+                sent = spa.data_to_send()
+                if not sent:
+                    continue
+                for data in decoder.iter_frames(sent):
+                    for reply in self.handle(data):
+                        spa.receive_data(reply)
+            if until(spa):
+                return trip
+        return None
+
+
+class SundanceBusEmulator:
+    """ asyncio TCP server standing in for the RS485 bridge.
+
+    Each connected client sees the same bus.  One trip round the bus takes
+    cycle_time seconds, spread evenly over its frames.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8899, cycle_time=0.1,
+                 bus=None, faults=None):
+        self.host = host
+        self.port = port
+        self.cycle_time = cycle_time
+        self.bus = bus or SundanceBus()
+        self.faults = faults or Faults()
+        self.log = logging.getLogger(__name__)
+        self.server = None
+        self.clients = set()
+        self.handlers = set()
+        self.task = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.client, self.host,
+                                                 self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.task = asyncio.ensure_future(self.run())
+        self.log.info('Emulated bus listening on {0}:{1}'.format(self.host,
+                                                                self.port))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for writer in list(self.clients):
+            writer.close()
+        # let the handlers see their connections close
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        await self.server.serve_forever()
+
+    def broadcast(self, frame):
+        frame = self.faults.corrupt(frame)
+        for writer in list(self.clients):
+            if writer.is_closing():
+                self.clients.discard(writer)
+                continue
+            writer.write(frame)
+
+    async def run(self):
+        while True:
+            frames = self.bus.cycle()
+            gap = self.cycle_time / len(frames)
+            for frame in frames:
+                self.broadcast(frame)
+                await asyncio.sleep(gap)
+
+    async def client(self, reader, writer):
+        self.clients.add(writer)
+        self.handlers.add(asyncio.current_task())
+        decoder = FrameDecoder(log=self.log)
+        try:
+            while True:
+                chunk = await reader.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                for frame in decoder.feed(chunk):
+                    for reply in self.bus.handle(frame):
+                        self.broadcast(reply)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            self.handlers.discard(asyncio.current_task())
+            writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--panels', type=int, default=1,
+                        help='other clients already on the bus')
+    parser.add_argument('--stale', type=int, default=0,
+                        help='channels polled that nobody answers')
+    parser.add_argument('--variant', choices=sorted(VARIANTS),
+                        default='sundance')
+    parser.add_argument('--busy', type=float, default=0.0,
+                        help='chance another panel presses a button')
+    parser.add_argument('--wake', action='store_true',
+                        help='the first temperature press only shows the '
+                             'set temperature, like a real topside')
+    parser.add_argument('--cycle-time', type=float, default=0.1,
+                        help='seconds per trip round the bus')
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    bus = SundanceBus(args.panels, args.stale, args.variant, args.busy,
+                      EmulatedTub(wake=args.wake), seed=args.seed)
+    emulator = SundanceBusEmulator(args.host, args.port, args.cycle_time, bus,
+                                   Faults(args.crc_error_rate, seed=args.seed))
+    try:
+        asyncio.run(emulator.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+""" The Sundance / Jacuzzi "encryption" of C4 / CA style message bodies.
+
+Every real byte goes over the wire as a pair a, b with a ^ b ^ 1 == value;
+the spa picks a however it likes.  Rather than walking the pairs in
+Python, xor_decode() splits the body into its even and odd bytes with two
+slices and XORs them as two big integers, which happens in C.  What comes
+back is plain bytes, ready for indexing or struct.unpack_from().
+"""
+
+# 0, 1, 2 ... 255 twice over, for picking the first byte of each pair
+RAMP = bytes(range(256)) * 2
+
+# b'\x01' * n as an integer, by n
+_ones = {}
+
+
+def ones(n):
+    value = _ones.get(n)
+    if value is None:
+        value = _ones[n] = int.from_bytes(b'\x01' * n, 'big')
+    return value
+
+
+def xor_decode(body):
+    """ Decode a whole pair encoded body into bytes, one per pair.
+
+    A trailing odd byte is ignored, as SundanceProtocol.xormsg() does.
+    """
+    n = len(body) // 2
+    first = int.from_bytes(body[0:2 * n:2], 'big')
+    second = int.from_bytes(body[1:2 * n:2], 'big')
+    return (first ^ second ^ ones(n)).to_bytes(n, 'big')
+
+
+def xor_encode(values, size=None, seed=0):
+    """ The inverse of xor_decode(): pair encode values.
+
+    The first byte of each pair counts up from seed, the way a spa picks
+    them doesn't matter to the decoder.  The body is zero padded out to
+    size bytes.
+    """
+    values = bytes(values)
+    n = len(values)
+    start = seed & 0xff
+    if n <= 256:
+        first = RAMP[start:start + n]
+    else:
+        first = bytes((start + i) & 0xff for i in range(n))
+    second = (int.from_bytes(first, 'big') ^ int.from_bytes(values, 'big')
+              ^ ones(n)).to_bytes(n, 'big')
+    body = bytearray(max(size or 0, 2 * n))
+    body[0:2 * n:2] = first
+    body[1:2 * n:2] = second
+    return body
+
+
+def decode_button(data):
+    """ The button in a CC frame, whose one pair is XOR'd without the 1. """
+    return data[5] ^ data[6]
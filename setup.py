@@ -24,5 +24,9 @@ setup(name='pybalboa',
       packages=['pybalboa'],
       install_requires=[
       ],
+      extras_require={
+          # offline bulk decoding of captures, see pybalboa/bulk.py
+          'bulk': ['numpy'],
+      },
       include_package_data=True,
       zip_safe=False)
@@ -0,0 +1,152 @@
+""" Settings converging by button presses, on their own and on the bus. """
+from pybalboa import SundanceProtocol
+from pybalboa.actuators import (ACTIVE, DONE, FAILED, Actuator,
+                                ActuatorEngine, SetpointActuator)
+from pybalboa.benchmark import setpoint_trips
+from pybalboa.sundanceRS485 import (BTN_P1, BTN_TEMP_DOWN,
+                                    EVENT_COMMAND_FAILED)
+from pybalboa.sundance_emulator import EmulatedTub, SundanceBus
+
+
+class Reading:
+    """ Just enough of a spa for an actuator to read. """
+
+    def __init__(self, value):
+        self.value = value
+
+
+def test_gives_up_after_its_budget_of_presses_that_change_nothing():
+    spa = Reading(0)
+    engine = ActuatorEngine([Actuator('pump0', 'status',
+                                      lambda spa: spa.value, BTN_P1,
+                                      budget=3, settle=1)])
+    engine.set_target('pump0', 1)
+    pressed = []
+    for update in range(3):
+        presses, finished = engine.update(spa, 'status', ())
+        pressed.extend(presses)
+        # updates from elsewhere don't step it
+        assert engine.update(spa, 'lights', ()) == ([], [])
+    assert [press.button for press in pressed] == [BTN_P1] * 3
+    presses, finished = engine.update(spa, 'status', ())
+    assert presses == [] and finished == [engine['pump0']]
+    assert engine['pump0'].state == FAILED
+    assert engine.target('pump0') is None
+    assert not engine.active()
+
+
+def test_a_press_that_moves_the_reading_starts_the_count_again():
+    spa = Reading(0)
+    actuator = Actuator('settemp', 'status', lambda spa: spa.value, BTN_P1,
+                        budget=2, settle=1)
+    actuator.set(5)
+    for value in range(5):
+        spa.value = value
+        assert actuator.step(spa, ())
+    assert actuator.presses == 5 and actuator.state == ACTIVE
+    # nothing waits while the last press is still queued
+    assert actuator.step(spa, {BTN_P1}) == ()
+    spa.value = 5
+    assert actuator.step(spa, ()) == ()
+    assert actuator.state == DONE
+
+
+class RecordingProtocol(SundanceProtocol):
+    """ Keeps the events SundanceBus.drive() doesn't hand back. """
+
+    def __init__(self):
+        super().__init__()
+        self.emitted = []
+
+    def emit(self, kind, mtype=None, data=None):
+        self.emitted.append((kind, data))
+        super().emit(kind, mtype, data)
+
+
+def joined(tub):
+    bus = SundanceBus(tub=tub, seed=1)
+    spa = RecordingProtocol()
+    assert bus.drive(spa, lambda spa: spa.channel in spa.discoveredChannels)
+    return bus, spa
+
+
+def settled(bus, spa, trips=20):
+    """ Drive until nothing is converging, then check nothing more is
+    pressed for a while.
+    """
+    assert bus.drive(spa, lambda spa: not spa.actuators.active())
+    presses = len(bus.presses)
+    bus.drive(spa, lambda spa: False, limit=trips)
+    assert len(bus.presses) == presses
+
+
+def test_pumps_converge_and_stay_there():
+    bus, spa = joined(EmulatedTub())
+    spa.set_target('pump0', 1)
+    spa.set_target('pump1', 1)
+    spa.set_target('circ', 1)
+    settled(bus, spa)
+    assert (bus.tub.pumps, bus.tub.circ) == ([1, 1], 1)
+    assert spa.pump_status[:3] == [1, 1, 1]
+    for name in ('pump0', 'pump1', 'circ'):
+        assert spa.actuators[name].state == DONE
+        assert spa.actuators[name].presses == 1
+    assert len(bus.presses) == 3
+
+
+def test_settemp_converges_and_stays_there():
+    bus, spa = joined(EmulatedTub(settemp=100, wake=True))
+    spa.set_target('settemp', 95)
+    settled(bus, spa)
+    assert bus.tub.settemp == spa.settemp == 95
+    assert spa.actuators['settemp'].state == DONE
+    assert spa.get_actuator_stats()['settemp']['target'] == 95
+
+
+def test_a_target_out_of_reach_is_given_up_on():
+    bus, spa = joined(EmulatedTub(settemp=100))
+    spa.set_target('settemp', 110)
+    settled(bus, spa)
+    # the tub stops at 104
+    assert bus.tub.settemp == spa.settemp == 104
+    assert spa.actuators['settemp'].state == FAILED
+    assert (EVENT_COMMAND_FAILED, ('settemp', 110)) in spa.emitted
+
+
+def setpoint(ready, plan=True):
+    actuator = SetpointActuator('settemp', 'status', lambda spa: spa.value,
+                                lambda current, target: BTN_TEMP_DOWN,
+                                ready=lambda spa: ready, plan=plan)
+    actuator.set(90)
+    return actuator
+
+
+def test_a_setpoint_change_is_planned_as_one_burst():
+    spa = Reading(100)
+    actuator = setpoint(ready=False)
+    presses = actuator.step(spa, ())
+    # ten steps and one to bring the set temperature up
+    assert [press.key for press in presses] == [BTN_TEMP_DOWN] + [
+        (BTN_TEMP_DOWN, i) for i in range(1, 11)]
+    assert [press.follow for press in presses] == [False] + [True] * 10
+    assert actuator.pressed == tuple(press.key for press in presses)
+    # it doesn't look again until the whole burst went out
+    assert actuator.step(spa, {(BTN_TEMP_DOWN, 10)}) == ()
+
+    assert len(setpoint(ready=True).step(spa, ())) == 10
+    assert len(setpoint(ready=True, plan=False).step(spa, ())) == 1
+
+
+def test_a_planned_setpoint_change_takes_one_press_per_step():
+    bus, spa = joined(EmulatedTub(settemp=100, wake=True))
+    assert bus.drive(spa, lambda spa: spa.settemp == 100)
+    spa.set_target('settemp', 90)
+    settled(bus, spa)
+    assert bus.tub.settemp == 90
+    assert [button for stamp, channel, button in bus.presses] == \
+        [BTN_TEMP_DOWN] * 11
+    assert spa.actuators['settemp'].presses == 11
+
+
+def test_planning_saves_trips():
+    assert setpoint_trips(True) < setpoint_trips(False)
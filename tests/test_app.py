@@ -0,0 +1,64 @@
+""" The MQTT bridge's state topics, with a recording client in place of paho's. """
+import asyncio
+import os
+import sys
+
+import pytest
+
+from pybalboa.sundance_emulator import EmulatedTub, SundanceBus
+
+pytest.importorskip('paho.mqtt.client')
+# app.py is run as a script from inside the package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pybalboa'))
+import app  # noqa: E402
+
+
+class Recorder:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, retain=False):
+        self.published.append((topic, payload))
+
+
+def bridge(frames):
+    """ What a fresh spa publishes while it is handed frames. """
+    client = app.mqtt_client = Recorder()
+    spa = app.spa = app.sundanceRS485.SundanceRS485('127.0.0.1', 0)
+    app.subscribe_spa_data(spa)
+
+    async def main():
+        for frame in frames:
+            await spa.dispatch_events(spa.receive_data(frame))
+            await app.read_spa_data(spa, 0)
+
+    asyncio.run(main())
+    return [(topic, payload) for topic, payload in client.published
+            if topic != app.availability_topic]
+
+
+def test_everything_is_published_after_the_first_update():
+    bus = SundanceBus(tub=EmulatedTub(curtemp=96, settemp=90))
+    # the pumps are off, which is where a fresh spa starts too
+    published = bridge([bus.status_frame()])
+    assert (app.pump1_state_topic, 0) in published
+    assert (app.pump2_state_topic, 0) in published
+    assert (app.current_temperature_topic, 96.0) in published
+    assert (app.temperature_state_topic, 90.0) in published
+    assert app.brightness_state_topic not in dict(published)
+    published = bridge([bus.status_frame(), bus.lights_frame()])
+    assert dict(published)[app.effect_state_topic] == 'Off'
+    assert dict(published)[app.light_state_topic] == 0
+    # and each topic once, changed or not
+    assert len(published) == len(set(topic for topic, payload in published))
+
+
+def test_then_only_what_changed():
+    bus = SundanceBus(tub=EmulatedTub(curtemp=96, settemp=90))
+    frames = [bus.status_frame(), bus.lights_frame()]
+    published = bridge(frames)
+    # a repeat changes nothing
+    assert bridge(frames * 2) == published
+    bus.tub.pumps[0] = 1
+    assert bridge(frames + [bus.status_frame()]) == published + [
+        (app.pump1_state_topic, 1), (app.pump2_state_topic, 0)]
@@ -0,0 +1,207 @@
+""" BalboaProtocol against captured frames and the emulated wifi module.
+
+The expected values are what the parsers decoded these frames to before
+they moved into the sans-IO core.
+"""
+import time
+
+from pybalboa import BalboaProtocol
+from pybalboa.balboa import BMTS_CONTROL_REQ, BMTS_PANEL_REQ, C_PUMP1, mtypes
+from pybalboa.dispatch import frame_mtype
+from pybalboa.emulator import HEATMODE_REST, EmulatedSpa
+from pybalboa.framing import FrameDecoder
+
+# Frames captured off a BP2000G1 and a Bullfrog Stil7 (BWGWIFI1)
+CAPTURED = {name: bytes.fromhex(frame) for name, frame in [
+    ('ident', '7E1E0ABF9402148000152737EFED0000000000000000001527FFFF37EF'
+              'ED427E'),
+    ('config', '7E0B0ABF2E0A0001500000BF7E'),
+    ('sysinfo', '7E1A0ABF2464DC140042503230303047310451800C6B010A0200F97E'),
+    ('setup', '7E0E0ABF25040332635068E901454F7E'),
+    ('filter', '7E0D0ABF2313000200880001009F7E'),
+    ('status', '7E1DFFAF130001FF090A0126010002000000000000000002005B000012'
+               '7E7E'),
+    ('status2', '7E1DFFAF13000064082D0000010000040000000000000000006400000'
+                '0067E'),
+    ('config_bullfrog', '7E0B0ABF2E020005D00000A37E'),
+    ('sysinfo_bullfrog', '7E1A0ABF2464DC24004246425032305320035CD4CCD7010A'
+                         '0000DE7E'),
+]}
+
+BP2000G1 = {
+    'macaddr': '00:15:27:37:ef:ed',
+    'idigi_device_id': '00000000-00000000-001527FF-FF37EFED',
+    'pump_array': [2, 2, 0, 0, 0, 0],
+    'light_array': [1, 0],
+    'circ_pump': 0,
+    'blower': 0,
+    'mister': 0,
+    'aux_array': [0, 0],
+    'sw_vers': '20.0',
+    'ssid': 'M100_220 V20.0',
+    'model_name': 'BP2000G1',
+    'setup': 4,
+    'cfg_sig': '5180c6b',
+    'voltage': 240,
+    'heater_type': 'Standard',
+    'dip_switch': '0000001000000000',
+    'tmin': [[50, 10.0], [80, 26.5]],
+    'tmax': [[99, 37.0], [104, 40.0]],
+    'nr_of_pumps': 1,
+    'filter1_hour': 19,
+    'filter1_minute': 0,
+    'filter1_duration_hours': 2,
+    'filter1_duration_minutes': 0,
+    'filter2_enabled': 1,
+    'filter2_hour': 8,
+    'filter2_minute': 0,
+    'filter2_duration_hours': 1,
+    'filter2_duration_minutes': 0,
+}
+
+BP2000G1_STATUS = [
+    ('status', {
+        'tempscale': 0, 'time_hour': 9, 'time_minute': 10, 'timescale': 1,
+        'curtemp': None, 'settemp': 91.0, 'heatmode': 1, 'filter_mode': 0,
+        'heatstate': 0, 'temprange': 0, 'pump_status': [0, 0, 0, 0, 0, 0],
+        'circ_pump_status': 0, 'light_status': [0, 0], 'mister_status': 0,
+        'blower_status': 0, 'aux_status': [0, 0],
+    }),
+    ('status2', {
+        'tempscale': 0, 'time_hour': 8, 'time_minute': 45, 'timescale': 0,
+        'curtemp': 100.0, 'settemp': 100.0, 'heatmode': 0, 'filter_mode': 0,
+        'heatstate': 0, 'temprange': 1, 'pump_status': [0, 0, 0, 0, 0, 0],
+        'circ_pump_status': 0, 'light_status': [0, 0], 'mister_status': 0,
+        'blower_status': 0, 'aux_status': [0, 0],
+    }),
+]
+
+BULLFROG = {
+    'pump_array': [2, 0, 0, 0, 0, 0],
+    'light_array': [1, 1],
+    'circ_pump': 1,
+    'blower': 0,
+    'mister': 0,
+    'aux_array': [0, 0],
+    'sw_vers': '36.0',
+    'ssid': 'M100_220 V36.0',
+    'model_name': 'BFBP20S',
+    'setup': 3,
+    'cfg_sig': '5cd4ccd7',
+    'voltage': 240,
+    'heater_type': 'Standard',
+    'dip_switch': '0000000000000000',
+}
+
+# Status updates from an EmulatedSpa with one of everything, see
+# emulated_frames(); the clock fields are checked against its clock
+EMULATED_STATUS = [
+    {'tempscale': 0, 'timescale': 1, 'curtemp': 98.0, 'settemp': 102.0,
+     'heatmode': 0, 'filter_mode': 1, 'heatstate': 1, 'temprange': 1,
+     'pump_status': [0, 0, 0, 0, 0, 0], 'circ_pump_status': 1,
+     'light_status': [0, 0], 'mister_status': 0, 'blower_status': 0,
+     'aux_status': [0, 0]},
+    {'tempscale': 0, 'timescale': 1, 'curtemp': 98.0, 'settemp': 102.0,
+     'heatmode': 1, 'filter_mode': 1, 'heatstate': 0, 'temprange': 1,
+     'pump_status': [1, 2, 1, 0, 1, 1], 'circ_pump_status': 0,
+     'light_status': [1, 0], 'mister_status': 1, 'blower_status': 2,
+     'aux_status': [8, 0]},
+    {'tempscale': 1, 'timescale': 1, 'curtemp': 37.5, 'settemp': 40.0,
+     'heatmode': 1, 'filter_mode': 1, 'heatstate': 0, 'temprange': 0,
+     'pump_status': [1, 2, 1, 0, 1, 1], 'circ_pump_status': 0,
+     'light_status': [1, 0], 'mister_status': 1, 'blower_status': 2,
+     'aux_status': [0, 16]},
+]
+
+
+def decoded(spa, expected):
+    return {name: getattr(spa, name) for name in expected}
+
+
+def test_captured_frames_decode_like_the_original_parsers():
+    spa = BalboaProtocol()
+    spa.receive_data(b''.join(CAPTURED[name] for name in (
+        'ident', 'config', 'sysinfo', 'setup', 'filter')))
+    assert spa.config_loaded
+    assert decoded(spa, BP2000G1) == BP2000G1
+    for name, expected in BP2000G1_STATUS:
+        spa.receive_data(CAPTURED[name])
+        assert decoded(spa, expected) == expected
+
+    spa = BalboaProtocol()
+    spa.receive_data(CAPTURED['config_bullfrog']
+                     + CAPTURED['sysinfo_bullfrog'])
+    assert decoded(spa, BULLFROG) == BULLFROG
+
+
+def test_status_before_config_asks_for_it():
+    spa = BalboaProtocol()
+    spa.receive_data(CAPTURED['status'])
+    assert spa.settemp != 91.0
+    # a panel request for the device configuration
+    assert spa.data_to_send() == spa.encode_message(*mtypes[BMTS_PANEL_REQ],
+                                                    0, 0, 1)
+
+
+def test_repeats_are_compared_against_a_copy():
+    spa = BalboaProtocol()
+    spa.receive_data(CAPTURED['config'] + CAPTURED['sysinfo'])
+    # a receive buffer the size of one status update, so every frame is
+    # decoded out of the same few bytes
+    spa.decoder = FrameDecoder(log=spa.log, size=len(CAPTURED['status']))
+    assert spa.receive_data(CAPTURED['status'])
+    assert isinstance(spa.last_frames[frame_mtype(CAPTURED['status'])],
+                      bytes)
+    spa.receive_data(CAPTURED['filter'])
+    assert spa.decoder.ring.startswith(CAPTURED['filter'])
+    assert spa.receive_data(CAPTURED['status']) == []
+    assert spa.receive_data(CAPTURED['status2'])
+
+
+def emulated_frames():
+    emulated = EmulatedSpa(pumps=(2, 2, 1, 1, 1, 1), lights=(1, 1),
+                           circ_pump=1, blower=1, mister=1, aux=(1, 1),
+                           clock=lambda: 0)
+    frames = [emulated.device_configuration(), emulated.status_frame()]
+    emulated.pump_status[:] = [1, 2, 1, 0, 1, 1]
+    emulated.light_status[:] = [1, 0]
+    emulated.blower_status = 2
+    emulated.mister_status = 1
+    emulated.aux_status[:] = [1, 0]
+    emulated.heatmode = HEATMODE_REST
+    frames.append(emulated.status_frame())
+    emulated.tempscale = 1
+    emulated.curtemp, emulated.settemp = 75, 80
+    emulated.aux_status[:] = [0, 1]
+    emulated.circ_pump_status = 0
+    emulated.temprange = 0
+    frames.append(emulated.status_frame())
+    return emulated, frames
+
+
+def test_emulated_frames_decode_like_the_original_parsers():
+    emulated, frames = emulated_frames()
+    spa = BalboaProtocol()
+    spa.receive_data(frames[0])
+    assert (spa.pump_array, spa.light_array, spa.circ_pump, spa.blower,
+            spa.mister, spa.aux_array) == (
+        [2, 2, 1, 1, 1, 1], [1, 1], 1, 1, 1, [1, 1])
+    clock = time.localtime(0)
+    for frame, expected in zip(frames[1:], EMULATED_STATUS):
+        spa.receive_data(frame)
+        assert decoded(spa, expected) == expected
+        assert (spa.time_hour, spa.time_minute) == (clock.tm_hour,
+                                                    clock.tm_min)
+
+
+def test_presses_reach_the_emulated_spa():
+    emulated = EmulatedSpa()
+    spa = BalboaProtocol()
+    spa.receive_data(emulated.device_configuration()
+                     + emulated.status_frame())
+    spa.queue_message(*mtypes[BMTS_CONTROL_REQ], C_PUMP1, 0)
+    for frame in FrameDecoder().iter_frames(spa.data_to_send()):
+        emulated.handle(frame)
+    assert emulated.pump_status[0] == 1
+    spa.receive_data(emulated.status_frame())
+    assert spa.pump_status[0] == 1
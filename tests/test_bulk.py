@@ -0,0 +1,64 @@
+""" Bulk decoding of captures against the object model. """
+import pytest
+
+from pybalboa import SundanceProtocol
+from pybalboa.balboa import EVENT_NEW_DATA
+from pybalboa.capture import CaptureReader, CaptureWriter
+from pybalboa.sundance_emulator import EmulatedTub, SundanceBus
+
+np = pytest.importorskip('numpy')
+from pybalboa import bulk  # noqa: E402
+
+
+def record_bus(path, updates=40):
+    """ A capture of Sundance status updates, cut into uneven reads. """
+    tub = EmulatedTub(curtemp=40)
+    bus = SundanceBus(tub=tub)
+    stream = b''
+    for i in range(updates):
+        tub.circ = (i // 3) % 2
+        tub.settemp = 90 + i % 7
+        bus.cycles += 1
+        stream += bus.status_frame()
+    with CaptureWriter(path) as capture:
+        for n, pos in enumerate(range(0, len(stream), 37)):
+            capture.record(stream[pos:pos + 37], 1000 * n)
+    return stream
+
+
+def test_load_capture_matches_record_by_record(tmp_path):
+    path = tmp_path / 'bus.cap'
+    stream = record_bus(path)
+    # a record cut short at the end, as after a crash while capturing
+    with open(path, 'ab') as f:
+        f.write(b'\x01' * 10 + b'\x7e')
+
+    with CaptureReader(path) as capture:
+        records = [(ts, bytes(data)) for ts, data in capture]
+    assert b''.join(data for ts, data in records) == stream
+
+    batch = bulk.load_capture(path)
+    status = batch.sundance_status()
+    spa = SundanceProtocol()
+    settemps, temps2 = [], []
+    for ts, data in records:
+        for event in spa.receive_data(data):
+            if event.kind == EVENT_NEW_DATA:
+                settemps.append(spa.settemp)
+                temps2.append(spa.temp2)
+    assert batch.frames == 40
+    assert status['settemp'].tolist() == settemps
+    assert status['temp2'].tolist() == temps2
+    # every frame is stamped with the read its last byte came in
+    size = len(stream) // 40
+    assert status['ts'].tolist() == [1000 * (((k + 1) * size - 1) // 37)
+                                     for k in range(40)]
+
+
+def test_load_capture_empty(tmp_path):
+    path = tmp_path / 'empty.cap'
+    with CaptureWriter(path):
+        pass
+    batch = bulk.load_capture(path)
+    assert batch.frames == 0
+    assert batch.types() == {}
@@ -0,0 +1,141 @@
+""" Capture files, replayed through the protocol core and the clients. """
+import asyncio
+import time
+
+import pytest
+
+from pybalboa import BalboaProtocol, BalboaSpaWifi
+from pybalboa.capture import (MAGIC, MAX_RECORD, CaptureReader,
+                              CaptureWriter, ReplayTransport, replay_into)
+from pybalboa.emulator import EmulatedSpa
+
+
+def emulated_reads():
+    """ What an emulated spa says, cut into uneven socket reads. """
+    spa = EmulatedSpa(clock=lambda: 0)
+    stream = spa.device_configuration() + spa.status_frame()
+    spa.pump_status[0] = 1
+    stream += spa.status_frame() * 2
+    spa.settemp = 90
+    stream += spa.status_frame()
+    return [stream[pos:pos + 23] for pos in range(0, len(stream), 23)]
+
+
+def write(path, reads, step_ns=1000):
+    with CaptureWriter(path) as capture:
+        for n, data in enumerate(reads):
+            capture.record(data, n * step_ns)
+        return capture.records
+
+
+def test_records_come_back_as_written(tmp_path):
+    path = tmp_path / 'spa.cap'
+    big = bytes(range(256)) * 300
+    reads = [b'\x7e\x05', big, b'\x01' * 10]
+    # anything over 64k goes in as more than one record
+    assert write(path, reads) == 4
+    with CaptureReader(path) as capture:
+        records = [(ts, bytes(data)) for ts, data in capture]
+        assert len(capture.index()) == 4
+    assert records == [(0, b'\x7e\x05'), (1000, big[:MAX_RECORD]),
+                       (1000, big[MAX_RECORD:]), (2000, b'\x01' * 10)]
+
+
+def test_a_record_cut_short_is_ignored(tmp_path):
+    path = tmp_path / 'spa.cap'
+    write(path, [b'one', b'two'])
+    whole = path.read_bytes()
+    for cut in (1, 5, 12):
+        path.write_bytes(whole[:-cut])
+        with CaptureReader(path) as capture:
+            assert [bytes(data) for ts, data in capture] == [b'one']
+            assert len(capture.index()) == 1
+
+
+def test_other_files_are_refused(tmp_path):
+    empty = tmp_path / 'empty'
+    empty.write_bytes(b'')
+    other = tmp_path / 'other'
+    other.write_bytes(b'not a capture file')
+    for path in (empty, other):
+        with pytest.raises(ValueError):
+            CaptureReader(path)
+    header_only = tmp_path / 'header.cap'
+    header_only.write_bytes(MAGIC)
+    with CaptureReader(header_only) as capture:
+        assert list(capture) == []
+
+
+def test_replay_into_matches_feeding_the_reads(tmp_path):
+    path = tmp_path / 'spa.cap'
+    reads = emulated_reads()
+    write(path, reads)
+    fed = BalboaProtocol()
+    expected = [event for data in reads for event in fed.receive_data(data)]
+    spa = BalboaProtocol()
+    events = replay_into(spa, path)
+    assert [(e.kind, e.mtype, e.data) for e in events] == [
+        (e.kind, e.mtype, e.data) for e in expected]
+    assert (spa.pump_status, spa.settemp) == (fed.pump_status, 90.0)
+
+
+def replay_time(path, speed):
+    """ How long reading the whole of path through a ReplayTransport takes,
+    and what was read.
+    """
+    async def main():
+        replay = ReplayTransport(path, speed=speed)
+        start = time.monotonic()
+        reads = []
+        while True:
+            data = await replay.read()
+            if not data:
+                break
+            reads.append(data)
+        # and it stays at the end
+        assert await replay.read() == b''
+        replay.close()
+        return time.monotonic() - start, reads
+
+    return asyncio.run(main())
+
+
+def test_replay_keeps_the_original_timing(tmp_path):
+    path = tmp_path / 'spa.cap'
+    reads = [b'a', b'b', b'c']
+    # 100 ms between reads
+    write(path, reads, step_ns=100000000)
+    elapsed, replayed = replay_time(path, 1.0)
+    assert replayed == reads
+    assert elapsed >= 0.18
+    elapsed, replayed = replay_time(path, 4.0)
+    assert replayed == reads
+    assert 0.04 <= elapsed < 0.18
+    elapsed, replayed = replay_time(path, None)
+    assert replayed == reads
+    assert elapsed < 0.04
+
+
+def test_a_client_listens_to_a_replay(tmp_path):
+    path = tmp_path / 'spa.cap'
+    write(path, emulated_reads())
+
+    async def main():
+        spa = BalboaSpaWifi('replay')
+        replay = ReplayTransport(path, speed=None)
+        replay.attach(spa)
+        try:
+            while True:
+                data = await spa.read_one_message()
+                if data is None:
+                    break
+                await spa.process_message(data)
+        finally:
+            replay.close()
+        return spa
+
+    spa = asyncio.run(main())
+    # the replay ran out like a spa hanging up
+    assert not spa.connected
+    assert spa.config_loaded
+    assert (spa.pump_status[0], spa.settemp) == (1, 90.0)
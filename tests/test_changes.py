@@ -0,0 +1,187 @@
+""" Change sets, field subscriptions and the compiled change trackers. """
+import asyncio
+import random
+
+import pytest
+
+from pybalboa import BalboaProtocol, BalboaSpaWifi, SundanceProtocol
+from pybalboa.balboa import (BMTR_STATUS_UPDATE, STATUS_LAYOUT,
+                             STATUS_TRACKER)
+from pybalboa.emulator import HEATMODE_REST, EmulatedSpa
+from pybalboa.layout import Field, Layout
+from pybalboa.state import STATUS_FIELDS, ChangeTracker
+from pybalboa.sundanceRS485 import (LIGHT_FIELDS, SUNDANCE_STATUS_FIELDS,
+                                    SUNDANCE_STATUS_LAYOUT,
+                                    SUNDANCE_STATUS_TRACKER, LIGHTS_UPDATE,
+                                    STATUS_UPDATE)
+from pybalboa.sundance_emulator import (HEAT_MODES, LIGHT_MODES,
+                                        EmulatedTub, SundanceBus)
+
+OFF = (0, 0, 0, 0, 0, 0)
+
+
+def changed(events):
+    """ The change sets in events, by message type. """
+    return {event.mtype: event.data for event in events
+            if event.kind == 'changed'}
+
+
+def test_feeds_must_name_layout_fields():
+    layout = Layout('Test', [Field('temp1', 0), Field('temp2', 1)])
+    ChangeTracker(('curtemp',), layout, {'temp1': ('curtemp',)})
+    with pytest.raises(ValueError):
+        ChangeTracker(('curtemp',), layout, {'temp': ('curtemp',)})
+
+
+def test_balboa_status_changes():
+    emulated = EmulatedSpa(clock=lambda: 0)
+    spa = BalboaProtocol()
+    spa.receive_data(emulated.device_configuration()
+                     + emulated.status_frame())
+    emulated.pump_status[0] = 1
+    emulated.settemp = 90
+    assert changed(spa.receive_data(emulated.status_frame())) == {
+        BMTR_STATUS_UPDATE: {
+            'pump_status': (OFF, (1, 0, 0, 0, 0, 0)),
+            'settemp': (102.0, 90.0),
+            'heatstate': (1, 0),
+        }}
+    assert spa.state.pump_status == (1, 0, 0, 0, 0, 0)
+    # a repeated frame reports nothing at all
+    assert spa.receive_data(emulated.status_frame()) == []
+
+
+def test_sundance_status_and_light_changes():
+    bus = SundanceBus(tub=EmulatedTub(clock=lambda: 0))
+    spa = SundanceProtocol()
+    spa.receive_data(bus.status_frame() + bus.lights_frame())
+    bus.tub.pumps[0] = 1
+    bus.tub.settemp = 95
+    bus.tub.brightness = 50
+    frames = bus.status_frame() + bus.lights_frame()
+    assert changed(spa.receive_data(frames)) == {
+        STATUS_UPDATE: {
+            'pump_status': (OFF, (1, 0, 0, 0, 0, 0)),
+            'settemp': (100.0, 95.0),
+            'heatstate': (1, 0),
+        },
+        LIGHTS_UPDATE: {
+            'lightBrightnes': (0, 50),
+            'lightMode': (0, 1),
+        }}
+    assert spa.receive_data(frames) == []
+
+
+def test_touched_follows_the_feeds():
+    frame = EmulatedSpa(clock=lambda: 0).status_frame()
+    old = STATUS_LAYOUT.unpack(frame)
+    touched = STATUS_TRACKER.touched
+    assert touched(None, old) == STATUS_FIELDS
+    assert touched(old, old) == ()
+
+    def moved(**values):
+        new = list(old)
+        for name, value in values.items():
+            new[STATUS_LAYOUT.names.index(name)] = value
+        return tuple(new)
+
+    assert touched(old, moved(pump3=2)) == ('pump_status',)
+    assert touched(old, moved(tempscale=1)) == (
+        'tempscale', 'curtemp', 'settemp')
+    assert touched(old, moved(light1=1, settemp=99)) == (
+        'settemp', 'light_status')
+    # the same set of moved fields is looked up, not built again
+    assert touched(old, moved(pump3=1)) is touched(old, moved(pump3=2))
+
+    old = SUNDANCE_STATUS_LAYOUT.unpack(bytes(32))
+    new = list(old)
+    new[SUNDANCE_STATUS_LAYOUT.names.index('circ_pump_status')] = 1
+    assert SUNDANCE_STATUS_TRACKER.touched(old, tuple(new)) == (
+        'pump_status', 'circ_pump_status', 'temp2')
+
+
+def test_compiled_trackers_agree_with_snapshots():
+    # whatever the spa is doing, diffing the decoded tuples finds the same
+    # changes as snapshotting every attribute around the decode
+    rng = random.Random(7)
+    emulated = EmulatedSpa(pumps=(2, 2, 1, 1, 1, 1), lights=(1, 1),
+                           circ_pump=1, blower=1, mister=1, aux=(1, 1),
+                           clock=lambda: 0)
+    spa = BalboaProtocol()
+    spa.receive_data(emulated.device_configuration())
+    snapshots = ChangeTracker(STATUS_FIELDS)
+    for i in range(200):
+        emulated.pump_status[rng.randrange(6)] = rng.randrange(3)
+        emulated.light_status[rng.randrange(2)] = rng.randrange(2)
+        emulated.aux_status[rng.randrange(2)] = rng.randrange(2)
+        emulated.blower_status = rng.randrange(3)
+        emulated.mister_status = rng.randrange(2)
+        emulated.circ_pump_status = rng.randrange(2)
+        emulated.tempscale = rng.randrange(2)
+        emulated.settemp = rng.choice((80, 90, 102))
+        emulated.heatmode = rng.choice((0, HEATMODE_REST))
+        before = snapshots.snapshot(spa)
+        events = spa.receive_data(emulated.status_frame())
+        assert changed(events).get(BMTR_STATUS_UPDATE, {}) == \
+            snapshots.changes(spa, before)
+
+    bus = SundanceBus(tub=EmulatedTub(clock=lambda: 0))
+    spa = SundanceProtocol()
+    snapshots = ChangeTracker(SUNDANCE_STATUS_FIELDS + LIGHT_FIELDS)
+    for i in range(200):
+        tub = bus.tub
+        tub.pumps[rng.randrange(2)] = rng.randrange(2)
+        tub.circ = rng.randrange(2)
+        tub.settemp = rng.randrange(80, 104)
+        tub.curtemp = rng.randrange(80, 104)
+        tub.heat_mode = rng.choice(HEAT_MODES)
+        tub.brightness = rng.choice((0, 50, 100))
+        tub.light_mode = rng.choice(LIGHT_MODES)
+        before = snapshots.snapshot(spa)
+        events = spa.receive_data(bus.status_frame() + bus.lights_frame())
+        reported = changed(events)
+        assert dict(reported.get(STATUS_UPDATE, {}),
+                    **reported.get(LIGHTS_UPDATE, {})) == \
+            snapshots.changes(spa, before)
+
+
+def test_subscriptions():
+    emulated = EmulatedSpa(clock=lambda: 0)
+    spa = BalboaSpaWifi('emulated')
+    settemps, pumps, everything = [], [], []
+
+    async def on_settemp(*change):
+        settemps.append(change)
+
+    async def on_pumps(*change):
+        pumps.append(change)
+
+    async def on_anything(*change):
+        everything.append(change)
+
+    async def feed(frame):
+        await spa.dispatch_events(spa.receive_data(frame))
+
+    async def main():
+        spa.subscribe('settemp', on_settemp)
+        spa.subscribe('pump_status', on_pumps)
+        spa.subscribe(None, on_anything)
+        await feed(emulated.device_configuration() + emulated.status_frame())
+        emulated.pump_status[1] = 2
+        await feed(emulated.status_frame())
+        await feed(emulated.status_frame())
+        spa.unsubscribe('pump_status', on_pumps)
+        emulated.pump_status[1] = 0
+        emulated.settemp = 100
+        await feed(emulated.status_frame())
+
+    asyncio.run(main())
+    assert settemps == [('settemp', 0.0, 102.0), ('settemp', 102.0, 100.0)]
+    assert pumps == [('pump_status', OFF, (0, 2, 0, 0, 0, 0))]
+    assert ('pump_status', (0, 2, 0, 0, 0, 0), OFF) in everything
+    assert ('pump_array', OFF, (2, 2, 0, 0, 0, 0)) in everything
+    assert everything.count(('pump_status', OFF, (0, 2, 0, 0, 0, 0))) == 1
+    # nothing is left subscribed to pump_status
+    assert 'pump_status' not in spa.subscribers
+    # and unsubscribing again is harmless
+    spa.unsubscribe('pump_status', on_pumps)
@@ -0,0 +1,74 @@
+""" The code tables, both ways round. """
+import pytest
+
+from pybalboa.codes import CodeTable
+from pybalboa.sundanceRS485 import (SUNDANCE_DISPLAY, SUNDANCE_HEAT_MODES,
+                                    SUNDANCE_LIGHT_MODES, SundanceProtocol)
+
+TABLES = [SUNDANCE_HEAT_MODES, SUNDANCE_DISPLAY, SUNDANCE_LIGHT_MODES]
+
+
+def scan_text(table, code):
+    """ How the profiles used to look a code up. """
+    for x, y in table:
+        if x == code:
+            return y
+    return 'unknown'
+
+
+def scan_code(table, text):
+    res = -1
+    for x, y in table:
+        if y == text:
+            res = x
+    return res
+
+
+def test_lookups_match_scanning_the_pairs():
+    for table in TABLES:
+        for code in list(range(-1, 256)) + [1000]:
+            assert table.text(code) == scan_text(table, code), code
+            assert (code in table) == (scan_text(table, code) != 'unknown')
+        for code, text in table:
+            assert table.code(text) == scan_code(table, text), text
+    assert SUNDANCE_HEAT_MODES.text(34) == 'ECO'
+    assert SUNDANCE_HEAT_MODES.code('DAY') == 36
+    # several codes share a text, the last one listed wins going back
+    assert SUNDANCE_DISPLAY.text(36) == 'Current Temp'
+    assert SUNDANCE_DISPLAY.code('Current Temp') == 31
+
+
+def test_unknown_codes_and_texts():
+    assert SUNDANCE_HEAT_MODES.text(33) == 'unknown'
+    assert SUNDANCE_HEAT_MODES.text(33, None) is None
+    assert SUNDANCE_HEAT_MODES.code('SLOW') == -1
+    assert SUNDANCE_HEAT_MODES.code('SLOW', None) is None
+    spa = SundanceProtocol()
+    spa.lightMode = 200
+    assert spa.LIGHT_MODE_MAP.text(spa.lightMode) == 'unknown'
+
+
+def test_texts_in_table_order():
+    # the effect list offered to Home Assistant
+    assert SUNDANCE_LIGHT_MODES.texts == (
+        'Fast Blend', 'Slow Blend', 'Frozen Blend', 'BLue', 'Violet', 'Red',
+        'Amber', 'Green', 'Aqua', 'White', 'Off', 'No Change')
+    # each text once, where it first appears
+    assert SUNDANCE_DISPLAY.texts[:3] == ('Set Temp', 'Current Temp',
+                                          'PF Set Primary Filtration')
+    assert len(SUNDANCE_DISPLAY.texts) == len(SUNDANCE_DISPLAY) - 4
+    assert list(SUNDANCE_HEAT_MODES) == [(32, 'AUTO'), (34, 'ECO'),
+                                         (36, 'DAY')]
+
+
+def test_tables_are_read_only():
+    table = CodeTable([[1, 'one'], [2, 'two']])
+    for name in ('pairs', 'by_code', 'texts', 'other'):
+        with pytest.raises(AttributeError):
+            setattr(table, name, None)
+        with pytest.raises(AttributeError):
+            delattr(table, name)
+    assert not hasattr(table, '__dict__')
+    assert isinstance(table.pairs, tuple) and isinstance(table.texts, tuple)
+    assert table.pairs == ((1, 'one'), (2, 'two'))
+    assert repr(table) == "CodeTable([(1, 'one'), (2, 'two')])"
@@ -0,0 +1,85 @@
+""" Message type dispatch, for both protocol cores. """
+from pybalboa import BalboaProtocol, SundanceProtocol
+from pybalboa.balboa import (BMTR_STATUS_UPDATE, EVENT_UNKNOWN_MESSAGE,
+                             NROF_BMT, mtypes)
+from pybalboa.dispatch import MessageRegistry
+from pybalboa.sundanceRS485 import STATUS_UPDATE
+
+# A C4 status update captured off a Sundance 780
+C4_FRAME = bytes.fromhex(
+    '7E26FFAFC4AEA7AAABA4A1C95DA5A1C2A19CBDCEBBE2B9BBADB4B5A7B7DFB1B29BD38D'
+    '8E8F88F97E')
+
+
+def build_frame(*message):
+    return bytes(BalboaProtocol().encode_message(*message))
+
+
+def scan_mtype(data):
+    """ find_balboa_mtype() as it was, a scan of every known type. """
+    for i in range(0, NROF_BMT):
+        if (data[2] == mtypes[i][0]
+                and data[3] == mtypes[i][1]
+                and data[4] == mtypes[i][2]):
+            return i
+    return None
+
+
+def test_mtype_lookup_matches_a_scan():
+    spa = BalboaProtocol()
+    frames = [build_frame(*mtype, 0) for mtype in mtypes]
+    frames.append(build_frame(0x0A, 0xBF, 0x99, 0))
+    for frame in frames:
+        assert spa.find_balboa_mtype(frame) == scan_mtype(frame)
+    assert spa.find_balboa_mtype(b'\x7e\x05') is None
+
+
+def test_unknown_message_is_reported():
+    spa = BalboaProtocol()
+    frame = build_frame(0x0A, 0xBF, 0x99, 0)
+    events = spa.receive_data(frame)
+    assert [(event.kind, event.data) for event in events] == [
+        (EVENT_UNKNOWN_MESSAGE, frame)]
+
+
+def test_handlers_registered_on_one_spa_stay_there():
+    seen = []
+    spa, other = BalboaProtocol(), BalboaProtocol()
+    spa.register_handler([0x0A, 0xBF, 0x99],
+                         lambda spa, data: seen.append(bytes(data)))
+    frame = build_frame(0x0A, 0xBF, 0x99, 0)
+    assert spa.receive_data(frame) == []
+    assert seen == [frame]
+    assert other.receive_data(frame)[0].kind == EVENT_UNKNOWN_MESSAGE
+
+    # replacing a built in parser, then handing it back
+    status = build_frame(*mtypes[BMTR_STATUS_UPDATE], *bytes(24))
+    spa.register_handler(mtypes[BMTR_STATUS_UPDATE],
+                         lambda spa, data: seen.append('status'))
+    spa.receive_data(status)
+    assert seen[-1] == 'status'
+    spa.unregister_handler(mtypes[BMTR_STATUS_UPDATE])
+    # a type we know of but don't handle is only logged
+    assert spa.receive_data(status) == []
+    assert seen[-1] == 'status' and len(seen) == 2
+    assert BalboaProtocol.registry.lookup(status) is not None
+
+
+def test_full_types_win_over_type_bytes():
+    registry = MessageRegistry({
+        0x13: 'any channel',
+        (0xFF, 0xAF, 0x13): 'broadcast',
+    })
+    assert registry.lookup(build_frame(0xFF, 0xAF, 0x13)) == 'broadcast'
+    assert registry.lookup(build_frame(0x10, 0xBF, 0x13)) == 'any channel'
+    assert registry.lookup(build_frame(0x10, 0xBF, 0x14)) is None
+
+
+def test_sundance_dispatches_on_the_type_byte_alone():
+    lookup = SundanceProtocol.registry.lookup
+    frame = C4_FRAME
+    assert frame[4] == STATUS_UPDATE
+    # whatever the channel bytes say
+    elsewhere = frame[:2] + b'\x10\xbf' + frame[4:]
+    assert lookup(frame) is not None
+    assert lookup(elsewhere) is lookup(frame)
@@ -0,0 +1,138 @@
+""" SpaFleet supervising clients of emulated wifi modules. """
+import asyncio
+import socket
+import time
+
+import pytest
+
+from pybalboa import BalboaSpaWifi
+from pybalboa.emulator import SpaEmulator
+from pybalboa.fleet import (BACKOFF, CONFIGURING, CONNECTING, ONLINE,
+                            STOPPED, WAITING, SpaFleet)
+
+
+def refused_port():
+    """ A local port nobody is listening on. """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def watch_connects(fleet, name):
+    """ Record when the fleet connects spa name, and how many spas were
+    connecting or configuring at that moment, itself included.
+    """
+    spa = fleet.spas[name].spa
+    connect = spa.connect
+    connects = []
+
+    async def watched():
+        busy = sum(health.state in (CONNECTING, CONFIGURING)
+                   for health in fleet.spas.values())
+        connects.append((time.monotonic(), busy))
+        return await connect()
+
+    spa.connect = watched
+    return connects
+
+
+async def until(check, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, 'timed out'
+        await asyncio.sleep(0.01)
+
+
+def test_every_spa_comes_online():
+    async def main():
+        emulator = SpaEmulator(port=0, rate=20.0)
+        await emulator.start()
+        fleet = SpaFleet(max_connecting=2, stagger=0.02)
+        connects = []
+        for n in range(6):
+            fleet.add('spa{0}'.format(n),
+                      BalboaSpaWifi('127.0.0.1', emulator.port))
+            connects.append(watch_connects(fleet, 'spa{0}'.format(n)))
+        with pytest.raises(KeyError):
+            fleet.add('spa0', BalboaSpaWifi('127.0.0.1', emulator.port))
+        assert fleet.summary() == {WAITING: 6}
+        try:
+            await fleet.start()
+            await until(lambda: fleet.summary() == {ONLINE: 6})
+            health = fleet.health()
+        finally:
+            await fleet.stop()
+            await emulator.stop()
+        return fleet, connects, health
+
+    fleet, connects, health = asyncio.run(main())
+    assert all(len(spa) == 1 for spa in connects)
+    # never more than max_connecting handshakes at once
+    assert max(busy for spa in connects for stamp, busy in spa) <= 2
+    # and the connects were started at least stagger apart
+    stamps = sorted(stamp for spa in connects for stamp, busy in spa)
+    assert min(b - a for a, b in zip(stamps, stamps[1:])) >= 0.015
+    for spa in health.values():
+        assert spa['state'] == ONLINE
+        assert (spa['connects'], spa['failures']) == (1, 0)
+        assert spa['frames'] > 0 and spa['last_error'] is None
+    assert fleet.summary() == {STOPPED: 6}
+    for health in fleet.spas.values():
+        assert not health.spa.connected and health.spa.writer is None
+    assert fleet.tasks == {}
+
+
+def test_a_refused_port_backs_off_and_retries():
+    class Top:
+        """ No jitter, every wait is the full delay. """
+        def random(self):
+            return 1.0
+
+    async def main():
+        fleet = SpaFleet(stagger=0.0, backoff=0.02, max_backoff=0.08)
+        fleet.random = Top()
+        fleet.add('gone', BalboaSpaWifi('127.0.0.1', refused_port()))
+        connects = watch_connects(fleet, 'gone')
+        await fleet.start()
+        try:
+            await until(lambda: len(connects) >= 6)
+            await until(lambda: fleet.summary() == {BACKOFF: 1})
+            health = fleet.health()['gone']
+        finally:
+            await fleet.stop()
+        return fleet, connects, health
+
+    fleet, connects, health = asyncio.run(main())
+    assert health['last_error'] == 'connect failed'
+    assert health['failures'] >= 5 and health['connects'] >= 6
+    assert health['uptime'] is None and health['retry_in'] is not None
+    # the wait doubles every time up to max_backoff
+    stamps = [stamp for stamp, busy in connects]
+    gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+    for gap, delay in zip(gaps, (0.02, 0.04, 0.08, 0.08, 0.08)):
+        assert delay * 0.9 <= gap < delay + 0.05
+    assert fleet.summary() == {STOPPED: 1}
+
+
+def test_a_dropped_spa_is_reconnected():
+    async def main():
+        emulator = SpaEmulator(port=0, rate=20.0)
+        await emulator.start()
+        fleet = SpaFleet(stagger=0.0, backoff=0.02)
+        fleet.add('spa', BalboaSpaWifi('127.0.0.1', emulator.port))
+        try:
+            await fleet.start()
+            await until(lambda: fleet.summary() == {ONLINE: 1})
+            emulator.drop_connections()
+            await until(lambda: fleet.spas['spa'].failures == 1)
+            await until(lambda: fleet.summary() == {ONLINE: 1})
+            health = fleet.health()['spa']
+        finally:
+            await fleet.stop()
+            await emulator.stop()
+        return health
+
+    health = asyncio.run(main())
+    assert (health['connects'], health['failures']) == (2, 1)
+    assert health['last_error'] == 'connection lost'
+    assert health['uptime'] is not None
@@ -0,0 +1,109 @@
+""" Splitting a byte stream into frames. """
+import logging
+
+from pybalboa.balboa import (BMTR_STATUS_UPDATE, BMTS_CONTROL_REQ,
+                             BMTS_SET_TEMP, C_PUMP1, build_frame, mtypes)
+from pybalboa.framing import FrameDecoder
+
+FRAMES = [
+    build_frame(*mtypes[BMTR_STATUS_UPDATE], *range(24)),
+    build_frame(*mtypes[BMTS_CONTROL_REQ], C_PUMP1, 0),
+    build_frame(*mtypes[BMTS_SET_TEMP], 100),
+]
+STREAM = b''.join(FRAMES)
+
+
+def decode(decoder, *reads):
+    """ Feed reads one at a time, keeping copies of every frame. """
+    return [bytes(frame) for data in reads for frame in decoder.feed(data)]
+
+
+def test_a_frame_split_anywhere():
+    for i in range(len(STREAM) + 1):
+        decoder = FrameDecoder()
+        assert decode(decoder, STREAM[:i], STREAM[i:]) == FRAMES, i
+        assert (decoder.dropped, decoder.crcerror) == (0, 0)
+
+
+def test_one_byte_at_a_time():
+    decoder = FrameDecoder()
+    reads = [STREAM[i:i + 1] for i in range(len(STREAM))]
+    assert decode(decoder, *reads) == FRAMES
+
+
+def test_noise_between_frames_is_dropped():
+    decoder = FrameDecoder()
+    stream = b'\x01\x02' + FRAMES[0] + b'\xff\x00\x10' + FRAMES[1]
+    assert decode(decoder, stream) == FRAMES[:2]
+    assert decoder.dropped == 5
+
+
+def test_bad_checksum(caplog):
+    decoder = FrameDecoder()
+    bad = bytearray(FRAMES[0])
+    bad[-2] ^= 0xFF
+    with caplog.at_level(logging.ERROR):
+        assert decode(decoder, bytes(bad) + FRAMES[1]) == FRAMES[1:2]
+    assert decoder.crcerror == 1
+    assert decoder.dropped == len(bad)
+    assert 'bad CRC' in caplog.text
+
+
+def test_runs_of_markers():
+    decoder = FrameDecoder()
+    # only the last M_STARTEND of a run starts a frame
+    assert decode(decoder, b'\x7e' * 5, FRAMES[0] + b'\x7e\x7e',
+                  FRAMES[1]) == FRAMES[:2]
+    assert decoder.dropped == 7
+
+
+def test_bad_lengths(caplog):
+    decoder = FrameDecoder()
+    with caplog.at_level(logging.ERROR):
+        assert decode(decoder, b'\x7e\x01' + FRAMES[0]) == FRAMES[:1]
+        assert decode(decoder, b'\x7e\xff' + FRAMES[1]) == FRAMES[1:2]
+    assert decoder.dropped == 4
+    assert [record.getMessage() for record in caplog.records] == [
+        'Bad length: 1', 'Length Too Long: 255']
+
+
+def test_frames_are_views_until_the_next_feed():
+    decoder = FrameDecoder()
+    frame, = decoder.feed(FRAMES[0])
+    assert isinstance(frame, memoryview)
+    kept = bytes(frame)
+    decoder.feed(FRAMES[1])
+    assert kept == FRAMES[0]
+
+
+def test_buffer_protocol_on_a_nearly_full_ring():
+    # a ring only a little longer than a status frame, so the partial
+    # frame left over is forever being moved to the front
+    decoder = FrameDecoder(size=40)
+    stream = STREAM * 10
+    frames = []
+    pos = 0
+    while pos < len(stream):
+        buf = decoder.get_buffer(7)
+        assert len(buf) >= 7
+        n = min(len(buf), 7, len(stream) - pos)
+        buf[:n] = stream[pos:pos + n]
+        pos += n
+        frames.extend(bytes(frame) for frame in decoder.buffer_updated(n))
+    assert frames == FRAMES * 10
+    assert decoder.dropped == 0
+
+
+def test_compact_keeps_the_partial_frame():
+    decoder = FrameDecoder(size=40)
+    part = FRAMES[0][:10]
+    assert decode(decoder, FRAMES[1] + part) == FRAMES[1:2]
+    assert decoder.head == len(FRAMES[1])
+    decoder.compact()
+    assert (decoder.head, decoder.tail) == (0, len(part))
+    assert decode(decoder, FRAMES[0][10:]) == FRAMES[:1]
+
+
+def test_more_than_the_ring_holds():
+    decoder = FrameDecoder(size=16)
+    assert decode(decoder, STREAM[:-3], STREAM[-3:]) == FRAMES
@@ -0,0 +1,106 @@
+""" The ring buffer history of a spa's numeric fields. """
+from types import SimpleNamespace
+
+from pybalboa.history import Ring, SpaHistory
+
+
+def rows(view):
+    return [tuple(row) for row in view]
+
+
+def test_a_wrapped_ring_reads_in_two_segments():
+    ring = Ring(4, 2)
+    for t in range(3):
+        ring.append(t, t * 10)
+    assert ring.spans() == [(0, 3)]
+    ring.append(3, 30)
+    # exactly full, still in one piece
+    assert ring.spans() == [(0, 4)]
+    ring.append(4, 40)
+    ring.append(5, 50)
+    assert len(ring) == 4
+    assert ring.spans() == [(2, 4), (0, 2)]
+    segments = ring.query()
+    assert [list(segment[0]) for segment in segments] == [[2, 3], [4, 5]]
+    assert [list(segment[1]) for segment in segments] == [[20, 30],
+                                                         [40, 50]]
+
+
+def test_query_bounds_across_the_wrap():
+    history = SpaHistory(fields=('curtemp',), raw=4, clock=lambda: 0)
+    for t in range(6):
+        history.record(SimpleNamespace(curtemp=90 + t), t)
+
+    def times(start=None, end=None):
+        return [t for t, value in history.query('curtemp', start, end)]
+
+    assert times() == [2, 3, 4, 5]
+    assert times(3, 5) == [3, 4]
+    assert times(2.5, 4.5) == [3, 4]
+    # bounds that fall entirely in one of the two segments
+    assert times(4) == [4, 5]
+    assert times(end=4) == [2, 3]
+    # and outside what is kept
+    assert times(end=2) == []
+    assert times(6) == []
+    view = history.query('curtemp', 3, 5)
+    assert len(view) == 2 and len(view.segments) == 2
+    view.release()
+    assert len(view) == 0
+
+
+def test_tiers_flush_each_bucket_as_the_next_starts():
+    history = SpaHistory(fields=('curtemp',))
+    for t, temp in ((0, 100), (20, 96), (59, 101)):
+        history.record(SimpleNamespace(curtemp=temp), t)
+    assert history.current('curtemp', 'minute') == (0, 96, 101, 99)
+    assert rows(history.query('curtemp', tier='minute')) == []
+    history.record(SimpleNamespace(curtemp=98), 61)
+    assert rows(history.query('curtemp', tier='minute')) == [
+        (0, 96, 101, 99)]
+    assert history.current('curtemp', 'minute') == (60, 98, 98, 98)
+    # the hour bucket is still filling
+    assert rows(history.query('curtemp', tier='hour')) == []
+    assert history.current('curtemp', 'hour') == (0, 96, 101, 98.75)
+    assert history.current('settemp', 'minute') is None
+
+
+def test_a_clock_stepping_back_is_held():
+    history = SpaHistory(fields=('curtemp',))
+    history.record(SimpleNamespace(curtemp=100), 100)
+    history.record(SimpleNamespace(curtemp=101), 90)
+    history.record(SimpleNamespace(curtemp=102), 110)
+    assert rows(history.query('curtemp')) == [(100, 100), (100, 101),
+                                              (110, 102)]
+    assert [t for t, value in history.query('curtemp', 100, 110)] == [100,
+                                                                      100]
+
+
+def test_list_fields_become_a_series_each():
+    now = [0]
+    history = SpaHistory(fields=('pump_status', 'curtemp', 'missing'),
+                         clock=lambda: now[0])
+    history.record(SimpleNamespace(pump_status=(1, 0, 2), curtemp=None))
+    now[0] = 1
+    history.record(SimpleNamespace(pump_status=[0, 0, 2], curtemp=98))
+    assert history.names() == ['pump_status[0]', 'pump_status[1]',
+                               'pump_status[2]', 'curtemp']
+    assert rows(history.query('pump_status[0]')) == [(0, 1), (1, 0)]
+    assert rows(history.query('pump_status[2]')) == [(0, 2), (1, 2)]
+    assert rows(history.query('curtemp')) == [(1, 98)]
+    assert rows(history.query('pump_status')) == []
+
+
+def test_memory_is_known_up_front():
+    history = SpaHistory(raw=16, minutes=8, hours=4)
+    history.record(SimpleNamespace(curtemp=98, settemp=100, heatstate=1,
+                                   pump_status=(0, 1), temp2=None))
+    assert len(history.series) == 5
+    for series in history.series.values():
+        assert series.nbytes() == history.series_nbytes()
+    assert history.nbytes() == 5 * history.series_nbytes()
+    # and it doesn't grow
+    for t in range(1, 100000, 37):
+        history.record(SimpleNamespace(curtemp=98, settemp=100, heatstate=1,
+                                       pump_status=(0, 1), temp2=None), t)
+    assert history.nbytes() == 5 * history.series_nbytes()
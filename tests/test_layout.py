@@ -0,0 +1,99 @@
+""" Every shipped layout decodes what it encodes. """
+import random
+
+import pytest
+
+from pybalboa import balboa, sundanceRS485
+from pybalboa.balboa import STATUS_LAYOUT
+from pybalboa.layout import Field, Layout
+from pybalboa.sundanceRS485 import SUNDANCE_STATUS_LAYOUT
+
+LAYOUTS = [value for module in (balboa, sundanceRS485)
+           for value in vars(module).values() if isinstance(value, Layout)]
+
+
+def values_of(field):
+    """ Every value field can hold. """
+    if field.flag:
+        return [0, 1]
+    return [bits ^ field.xor for bits in range(field.mask + 1)
+            if bits & ~field.mask == 0 and bits << field.shift <= 0xff]
+
+
+def random_message(layout, rng):
+    return bytes(rng.randrange(256) for i in range(layout.size + 3))
+
+
+def test_all_layouts_are_here():
+    assert {layout.name for layout in LAYOUTS} == {
+        'StatusUpdate', 'FilterCycleInfo', 'DeviceConfiguration',
+        'SystemInformation', 'SetupParameters', 'ModuleIdentification',
+        'SundanceStatus', 'SundanceLights'}
+
+
+def test_each_field_round_trips():
+    for layout in LAYOUTS:
+        for field in layout.fields:
+            if field.size is not None:
+                samples = [bytes(field.size), b'\xff' * field.size,
+                           bytes(range(field.size))]
+            else:
+                samples = values_of(field)
+            for value in samples:
+                data = layout.pack(**{field.name: value})
+                assert getattr(layout.decode(data), field.name) == value, (
+                    layout.name, field.name, value)
+                assert layout.getter(field.name)(data) == value
+
+
+def test_decode_encode_decode():
+    # fields sharing a byte, or the very same bits, come back as they were
+    rng = random.Random(5)
+    for layout in LAYOUTS:
+        for i in range(200):
+            decoded = layout.decode(random_message(layout, rng))
+            data = layout.pack(layout.size + 3, **decoded._asdict())
+            assert len(data) == layout.size + 3
+            assert layout.decode(data) == decoded, layout.name
+            assert layout.unpack(data) == tuple(decoded)
+
+
+def test_fields_sharing_a_byte():
+    data = STATUS_LAYOUT.pack(pump0=1, pump1=2, pump2=0, pump3=3)
+    assert data[16] == 0b11001001
+    decoded = STATUS_LAYOUT.decode(data)
+    assert (decoded.pump0, decoded.pump1, decoded.pump2, decoded.pump3) == (
+        1, 2, 0, 3)
+    # a flag is any bit of its mask, and encodes as the lowest one
+    data = STATUS_LAYOUT.pack(blower=3, circ_pump=2)
+    assert STATUS_LAYOUT.decode(data).blower == 3
+    # shifted, masked and xored in one byte: time_hour is the whole of
+    # byte 0 xor 6, curtemp is byte 5 xor 2
+    data = SUNDANCE_STATUS_LAYOUT.pack(time_hour=23, curtemp=96, pump0=1,
+                                       heatstate=1)
+    assert (data[0], data[5]) == (23 ^ 6, 96 ^ 2)
+    decoded = SUNDANCE_STATUS_LAYOUT.decode(data)
+    assert (decoded.time_hour, decoded.curtemp, decoded.pump0,
+            decoded.heatstate) == (23, 96, 1, 1)
+
+
+def test_flags_and_offsets():
+    layout = Layout('Test', [
+        Field('low', 1, mask=0x0f),
+        Field('high', 1, shift=4, mask=0x0f),
+        Field('any', 2, shift=2, mask=0x03, flag=True),
+        Field('name', 3, size=4),
+        Field('last', 9, xor=0x55),
+    ])
+    data = layout.pack(low=5, high=10, any=1, name=b'spa!', last=0x55)
+    assert data == bytearray(b'\x00\xa5\x04spa!\x00\x00\x00')
+    assert layout.decode(data) == (5, 10, 1, b'spa!', 0x55)
+    # decoding from an offset, as the Balboa layouts do inside a frame
+    assert layout.unpack(b'\x7e\x7e' + bytes(data), 2) == (5, 10, 1,
+                                                            b'spa!', 0x55)
+    with pytest.raises(TypeError):
+        layout.pack(nope=1)
+    with pytest.raises(ValueError):
+        Layout('Bad', [Field('byte', 0), Field('raw', 0, size=2)])
+    with pytest.raises(ValueError):
+        Layout('Bad', [Field('raw', 0, size=2), Field('byte', 1)])
@@ -0,0 +1,95 @@
+""" How BalboaSpaWifi paces and coalesces what it sends to the spa. """
+import asyncio
+import time
+
+from pybalboa import BalboaSpaWifi
+from pybalboa.balboa import (BMTS_CONFIG_REQ, BMTS_CONTROL_REQ,
+                             BMTS_PANEL_REQ, BMTS_SET_TEMP, C_LIGHT1, C_PUMP1,
+                             C_PUMP2, PRESS_COST, PUMP_PRESS_COST, mtypes)
+from pybalboa.emulator import SpaEmulator
+from pybalboa.outbound import OutboundScheduler, TokenBucket
+
+# Fast enough for a test, slow enough to tell the presses apart
+RATE = 20.0
+
+
+def test_press_costs():
+    spa = BalboaSpaWifi('emulator')
+    assert spa.message_cost(*mtypes[BMTS_CONFIG_REQ]) == 0
+    assert spa.message_cost(*mtypes[BMTS_PANEL_REQ], 0, 0, 1) == 0
+    assert spa.message_cost(*mtypes[BMTS_CONTROL_REQ], C_PUMP1, 0) == \
+        PUMP_PRESS_COST
+    assert spa.message_cost(*mtypes[BMTS_CONTROL_REQ], C_LIGHT1, 0) == \
+        PRESS_COST
+    assert spa.message_cost(*mtypes[BMTS_SET_TEMP], 100) == PRESS_COST
+
+
+def test_bucket_goes_into_debt():
+    now = [0.0]
+    bucket = TokenBucket(2.0, clock=lambda: now[0])
+    # a pump press costs more than the bucket holds, it waits for a full
+    # one and leaves it a token short
+    assert bucket.delay(2) == 0.0
+    bucket.take(2)
+    assert bucket.delay(1) == 1.0
+    assert bucket.delay(0) == 0.0
+    now[0] = 0.5
+    assert bucket.delay(1) == 0.5
+    now[0] = 1.0
+    assert bucket.delay(1) == 0.0
+
+
+def test_presses_are_paced_and_queries_ride_along():
+    async def main():
+        emulator = SpaEmulator(port=0, rate=RATE)
+        await emulator.start()
+        spa = BalboaSpaWifi('127.0.0.1', emulator.port)
+        assert await spa.connect()
+        spa.outbound.bucket.rate = RATE
+        try:
+            sent = await asyncio.gather(
+                spa.send_message(*mtypes[BMTS_CONTROL_REQ], C_PUMP1, 0),
+                spa.send_message(*mtypes[BMTS_CONTROL_REQ], C_PUMP2, 0),
+                spa.send_message(*mtypes[BMTS_PANEL_REQ], 0, 0, 1),
+                spa.send_message(*mtypes[BMTS_CONTROL_REQ], C_LIGHT1, 0))
+            # let the emulator read the last one
+            while len(emulator.commands) < 4:
+                await asyncio.sleep(0.01)
+        finally:
+            await spa.disconnect()
+            await emulator.stop()
+        return spa, emulator, sent
+
+    spa, emulator, sent = asyncio.run(main())
+    assert sent == [True] * 4
+    assert [data[5] for stamp, data in emulator.commands] == [
+        C_PUMP1, 0, C_PUMP2, C_LIGHT1]
+    # the free panel request went out in the first press's write
+    assert (spa.outbound.writes, spa.outbound.frames) == (3, 4)
+    stamps = [stamp for stamp, data in emulator.commands]
+    # each press after a pump press waits for the pump's cost to drip back
+    assert stamps[2] - stamps[0] >= 0.9 * PUMP_PRESS_COST / RATE
+    assert stamps[3] - stamps[2] >= 0.9 * PUMP_PRESS_COST / RATE
+    assert emulator.spa.pump_status[:2] == [1, 1]
+    assert emulator.spa.light_status[0] == 1
+
+
+def test_clear_fails_what_is_still_queued():
+    written = []
+
+    async def write(data):
+        written.append(data)
+        return True
+
+    async def main():
+        outbound = OutboundScheduler(write, rate=1.0)
+        first = outbound.send(b'first')
+        second = outbound.send(b'second')
+        assert await first
+        outbound.clear()
+        return await second
+
+    start = time.monotonic()
+    assert asyncio.run(main()) is False
+    assert written == [b'first']
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,77 @@
+""" The clear to send slot queue, on its own and on the emulated bus. """
+from concurrent.futures import Future
+
+from pybalboa import SundanceProtocol
+from pybalboa.slots import (PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL,
+                            SlotScheduler)
+from pybalboa.sundanceRS485 import BTN_LIGHT_ON, BTN_P1, BTN_P2
+from pybalboa.sundance_emulator import SundanceBus
+
+
+def scheduler():
+    now = [0.0]
+    return SlotScheduler(ttl=10.0, clock=lambda: now[0]), now
+
+
+def test_priority_then_first_pushed():
+    slots, now = scheduler()
+    slots.push('light', b'L', PRIORITY_LOW)
+    slots.push('temp', b'T', PRIORITY_NORMAL)
+    slots.push('pump', b'P', PRIORITY_HIGH)
+    slots.push('temp2', b'U', PRIORITY_NORMAL)
+    assert [slots.pop() for i in range(5)] == [b'P', b'T', b'U', b'L', None]
+    assert slots.stats()['utilisation'] == 0.8
+
+
+def test_a_waiting_key_is_pressed_once():
+    slots, now = scheduler()
+    first, second = Future(), Future()
+    slots.push('pump', b'P', PRIORITY_LOW, future=first)
+    slots.push('light', b'L', PRIORITY_NORMAL)
+    # pushing it again raises its priority rather than queueing it twice
+    slots.push('pump', b'P', PRIORITY_HIGH, future=second)
+    assert len(slots) == 2 and 'pump' in slots
+    assert slots.pop() == b'P'
+    assert first.result() is True and second.result() is True
+    assert slots.pop() == b'L'
+    assert slots.pop() is None
+    assert slots.stats()['deduped'] == 1
+
+
+def test_stale_presses_are_dropped():
+    slots, now = scheduler()
+    stale, kept, gone = Future(), Future(), Future()
+    slots.push('old', b'O', future=stale)
+    slots.push('new', b'N', ttl=30.0, future=kept)
+    slots.push('gone', b'G', future=gone)
+    slots.discard('gone')
+    now[0] = 20.0
+    assert slots.pop() == b'N'
+    assert stale.result() is False and kept.result() is True
+    assert gone.result() is False
+    assert slots.stats()['expired'] == 1
+    assert slots.empty()
+
+
+def joined(bus):
+    """ A SundanceProtocol that has its own channel on bus. """
+    spa = SundanceProtocol()
+    assert bus.drive(spa, lambda spa: spa.channel in spa.discoveredChannels)
+    return spa
+
+
+def test_one_press_per_clear_to_send_in_priority_order():
+    bus = SundanceBus(panels=2, seed=1)
+    spa = joined(bus)
+    spa.queue_CCmessage(BTN_LIGHT_ON)
+    spa.queue_CCmessage(BTN_P1)
+    spa.queue_CCmessage(BTN_P2)
+    spa.queue_CCmessage(BTN_P1)
+    pressed = []
+    for trip in range(4):
+        bus.drive(spa, lambda spa: True)
+        pressed.append([button for stamp, channel, button in bus.presses])
+        bus.presses.clear()
+    assert pressed == [[BTN_P1], [BTN_P2], [BTN_LIGHT_ON], []]
+    assert bus.tub.pumps == [1, 1]
+    assert bus.tub.brightness != 0
@@ -0,0 +1,64 @@
+""" The immutable, versioned SpaState snapshots. """
+import pytest
+
+from pybalboa import BalboaProtocol, SundanceProtocol
+from pybalboa.checksum import calc_cs
+from pybalboa.emulator import EmulatedSpa
+from pybalboa.state import SpaState
+
+
+def configured():
+    emulated = EmulatedSpa(clock=lambda: 0)
+    spa = BalboaProtocol()
+    spa.receive_data(emulated.device_configuration()
+                     + emulated.status_frame())
+    return emulated, spa
+
+
+def test_states_cannot_be_changed():
+    emulated, spa = configured()
+    state = spa.state
+    for name in ('version', 'values', 'settemp', 'pump_status', 'other'):
+        with pytest.raises(AttributeError):
+            setattr(state, name, 1)
+        with pytest.raises(AttributeError):
+            delattr(state, name)
+    assert not hasattr(state, '__dict__')
+    assert state.pump_status == (0, 0, 0, 0, 0, 0)
+    assert spa.state is state
+
+
+def test_version_only_goes_up_on_a_change():
+    emulated, spa = configured()
+    version = spa.state.version
+    spa.receive_data(emulated.status_frame())
+    assert spa.state.version == version
+    # a frame that differs only in a byte nothing is decoded from
+    frame = bytearray(emulated.status_frame())
+    frame[12] ^= 0xff
+    frame[-2] = calc_cs(frame[1:-2])
+    assert spa.receive_data(bytes(frame))
+    assert spa.state.version == version
+    emulated.settemp = 90
+    spa.receive_data(emulated.status_frame())
+    assert spa.state.version == version + 1
+    assert spa.state.settemp == 90.0
+
+
+def test_equal_when_the_fields_are():
+    emulated, spa = configured()
+    state = spa.state
+    again = SpaState.capture(spa, version=state.version + 5)
+    assert again == state and hash(again) == hash(state)
+    assert again.as_dict()['version'] == state.version + 5
+    emulated.settemp = 90
+    spa.receive_data(emulated.status_frame())
+    assert spa.state != state
+    # evolve() left the old state alone
+    assert state.settemp == 102.0
+    assert state != object()
+    # states of another class never equal this one
+    sundance = SundanceProtocol().state
+    assert sundance.__class__ is not SpaState
+    assert sundance != SpaState(sundance.values[:len(SpaState.FIELDS)])
+    assert {state: 1}[again] == 1
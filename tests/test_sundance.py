@@ -0,0 +1,160 @@
+""" SundanceProtocol against captured frames and the emulated RS485 bus.
+
+The expected values are what the parsers decoded these frames to before
+they moved into the sans-IO core, except UnknownField9: the original
+parser copied UnknownField3 into it.
+"""
+import logging
+import time
+
+import pytest
+
+from pybalboa import LazySundanceProtocol, SundanceProtocol
+from pybalboa.sundance_emulator import EmulatedTub, SundanceBus
+
+PROTOCOLS = [SundanceProtocol, LazySundanceProtocol]
+
+# Frames captured off a Sundance 780 and a Jacuzzi: C4 status, CA lights
+# and a 16 status update
+C4_FRAME = bytes.fromhex(
+    '7E26FFAFC4AEA7AAABA4A1C95DA5A1C2A19CBDCEBBE2B9BBADB4B5A7B7DFB1B29BD38D'
+    '8E8F88F97E')
+CA_FRAME = bytes.fromhex(
+    '7E22FFAFCA8A36CACBC4C5C6FBC0C1C23CDCDDDEDFD8D9DADBD4D5D6D7D0D1D2D3ECE5'
+    '7E')
+JACUZZI_16_FRAME = bytes.fromhex(
+    '7E25FFAF161012270B16420026FA260A140181000042011C00098000000A000000FF00'
+    '00002F7E')
+
+CAPTURED = [
+    (C4_FRAME, {
+        'time_hour': 14, 'time_minute': 17, 'month': 4, 'day': 14,
+        'pump_status': [0, 0, 0, 0, 0, 0], 'circ_pump_status': 0,
+        'settemp': 90.0, 'curtemp': 96.0, 'heatstate': 0, 'displayText': 40,
+        'heatMode': 32, 'autoCirc': 0, 'manualCirc': 0, 'temp2': 95.0,
+        'unknownCirc': 0, 'UnknownField3': 149, 'UnknownField9': 23,
+        'UnknownField12': 111, 'displayTextS': 'unknown',
+        'heatModeText': 'AUTO',
+    }),
+    (CA_FRAME, {
+        'lightBrightnes': 0, 'lightMode': 0, 'lightR': 0, 'lightG': 0,
+        'lightB': 0, 'lightCycleTime': 0, 'lightModeText': 'Off',
+        'lightUnknown1': 189, 'lightUnknown3': 60, 'lightUnknown4': 255,
+        'lightUnknown7': 0, 'lightUnknown9': 0,
+    }),
+    (JACUZZI_16_FRAME, {
+        'time_hour': 5, 'time_minute': 1, 'month': 1, 'day': 0,
+        'pump_status': [1, 1, 0, 0, 0, 0], 'circ_pump_status': 0,
+        'settemp': 66.0, 'curtemp': 29.0, 'heatstate': 0, 'displayText': 1,
+        'heatMode': 129, 'autoCirc': 0, 'manualCirc': 0, 'temp2': 254.0,
+        'unknownCirc': 1, 'UnknownField3': 39, 'UnknownField9': 29,
+        'UnknownField12': 11, 'displayTextS': 'unknown',
+        'heatModeText': 'unknown',
+    }),
+]
+
+# The emulated tub as it starts, then with everything switched on; the
+# clock fields are checked against its clock
+EMULATED = [
+    ({
+        'pump_status': [0, 0, 0, 0, 0, 0], 'circ_pump_status': 0,
+        'settemp': 100.0, 'curtemp': 98.0, 'heatstate': 1, 'displayText': 23,
+        'heatMode': 32, 'autoCirc': 0, 'manualCirc': 0, 'temp2': 98.0,
+        'unknownCirc': 0, 'UnknownField3': 145, 'UnknownField9': 107,
+        'UnknownField12': 107, 'displayTextS': 'Current Temp',
+        'heatModeText': 'AUTO',
+    }, {
+        'lightBrightnes': 0, 'lightMode': 0, 'lightR': 0, 'lightG': 0,
+        'lightB': 0, 'lightCycleTime': 2, 'lightModeText': 'Off',
+        'lightUnknown1': 0, 'lightUnknown3': 0, 'lightUnknown4': 0,
+        'lightUnknown7': 0, 'lightUnknown9': 2,
+    }),
+    ({
+        'pump_status': [1, 1, 1, 0, 0, 0], 'circ_pump_status': 1,
+        'settemp': 95.0, 'curtemp': 101.0, 'heatstate': 0, 'displayText': 30,
+        'heatMode': 34, 'autoCirc': 1, 'manualCirc': 0, 'temp2': 133.0,
+        'unknownCirc': 1, 'UnknownField3': 145, 'UnknownField9': 107,
+        'UnknownField12': 107, 'displayTextS': 'Set Temp',
+        'heatModeText': 'ECO',
+    }, {
+        'lightBrightnes': 66, 'lightMode': 7, 'lightR': 0, 'lightG': 0,
+        'lightB': 0, 'lightCycleTime': 2, 'lightModeText': 'Violet',
+        'lightUnknown1': 0, 'lightUnknown3': 0, 'lightUnknown4': 0,
+        'lightUnknown7': 0, 'lightUnknown9': 2,
+    }),
+]
+
+
+def decoded(spa, expected):
+    return {name: getattr(spa, name) for name in expected}
+
+
+@pytest.mark.parametrize('protocol', PROTOCOLS)
+def test_captured_frames_decode_like_the_original_parsers(protocol):
+    spa = protocol()
+    for frame, expected in CAPTURED:
+        spa.receive_data(frame)
+        assert decoded(spa, expected) == expected
+
+
+@pytest.mark.parametrize('variant', ['sundance', 'jacuzzi'])
+@pytest.mark.parametrize('protocol', PROTOCOLS)
+def test_emulated_frames_decode_like_the_original_parsers(protocol,
+                                                          variant):
+    tub = EmulatedTub(clock=lambda: 0)
+    bus = SundanceBus(variant=variant, tub=tub)
+    spa = protocol()
+    clock = time.localtime(0)
+    for i, (status, lights) in enumerate(EMULATED):
+        if i:
+            tub.pumps[:] = [1, 1]
+            tub.circ = 1
+            tub.settemp, tub.curtemp = 95, 101
+            tub.brightness, tub.light_mode = 66, 7
+            tub.heat_mode, tub.display = 34, 30
+            bus.cycles += 1
+        # the spa says everything at least twice, the original parser
+        # only got temp2 right on the second go after circulation changed
+        spa.receive_data(bus.status_frame() * 2 + bus.lights_frame())
+        assert decoded(spa, status) == status
+        assert decoded(spa, lights) == lights
+        assert (spa.time_hour, spa.time_minute, spa.month, spa.day) == (
+            clock.tm_hour, clock.tm_min, clock.tm_mon, clock.tm_mday)
+
+
+@pytest.mark.parametrize('protocol', PROTOCOLS)
+def test_temp2_follows_circulation_in_the_same_frame(protocol):
+    tub = EmulatedTub(curtemp=40)
+    bus = SundanceBus(tub=tub)
+    spa = protocol()
+
+    spa.receive_data(bus.status_frame())
+    assert spa.temp2 == 40.0
+
+    # the update that turns circulation on, then the spa repeating it
+    tub.circ = 1
+    bus.cycles += 1
+    frame = bus.status_frame()
+    spa.receive_data(frame)
+    assert spa.circ_pump_status == 1
+    assert spa.temp2 == 72.0
+    spa.receive_data(frame)
+    # what the parser before repeat skipping ended up with here
+    assert spa.temp2 == 72.0
+
+    tub.circ = 0
+    bus.cycles += 1
+    spa.receive_data(bus.status_frame())
+    assert spa.temp2 == 40.0
+
+
+def test_joining_keeps_the_channel_the_bus_hands_out(caplog):
+    bus = SundanceBus(panels=2, seed=1)
+    spa = SundanceProtocol()
+    with caplog.at_level(logging.WARNING):
+        assert bus.drive(spa, lambda spa: spa.channel is not None)
+        channel = spa.channel
+        bus.drive(spa, lambda spa: False, limit=10)
+    assert [assigned for stamp, assigned in bus.assigned] == [channel]
+    assert spa.channel == channel
+    assert caplog.records == []
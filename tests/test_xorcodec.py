@@ -0,0 +1,59 @@
+""" The pair XOR coding of Sundance message bodies. """
+import random
+
+from pybalboa import SundanceProtocol
+from pybalboa.benchmark import C4_FRAME, CA_FRAME, legacy_xormsg
+from pybalboa.xorcodec import decode_button, xor_decode, xor_encode
+
+
+def test_round_trip():
+    rng = random.Random(3)
+    for n in range(40):
+        for seed in [0, 255] + [rng.randrange(1 << 16) for i in range(5)]:
+            values = bytes(rng.randrange(256) for i in range(n))
+            body = xor_encode(values, seed=seed)
+            assert len(body) == 2 * n
+            assert xor_decode(body) == values
+            assert legacy_xormsg(body) == list(values)
+
+
+def test_odd_sizes():
+    rng = random.Random(4)
+    for n in range(40):
+        values = bytes(rng.randrange(256) for i in range(n))
+        # padded out to an odd length, the trailing byte is ignored
+        body = xor_encode(values, size=2 * n + 1, seed=n)
+        assert len(body) == 2 * n + 1
+        assert xor_decode(body) == values
+        # as are the pairs of zeroes padding decodes to
+        body = xor_encode(values, size=2 * n + 5)
+        assert xor_decode(body) == values + b'\x01\x01'
+        noise = bytes(rng.randrange(256) for i in range(2 * n + 1))
+        assert list(xor_decode(noise)) == legacy_xormsg(noise)
+
+
+def test_long_bodies():
+    # past the 256 byte ramp the first bytes of the pairs wrap around
+    values = bytes(range(256)) * 2 + b'\x7e'
+    body = xor_encode(values, seed=200)
+    assert body[0:2 * 300:2] == bytes((200 + i) & 0xff for i in range(300))
+    assert xor_decode(body) == values
+
+
+def test_captured_frames_decode_like_xormsg_did():
+    spa = SundanceProtocol()
+    for frame in (C4_FRAME, CA_FRAME):
+        body = frame[5:len(frame) - 2]
+        assert list(xor_decode(body)) == legacy_xormsg(body)
+        assert spa.xormsg(body) == legacy_xormsg(body)
+        out = [None] * 20
+        assert spa.xormsg(body, out) is out
+        assert out[:len(body) // 2] == legacy_xormsg(body)
+        # and encode back to a body that decodes the same
+        assert xor_decode(xor_encode(xor_decode(body), len(body),
+                                     seed=body[0])) == xor_decode(body)
+
+
+def test_buttons():
+    # a CC frame's one pair is XOR'd without the 1
+    assert decode_button(b'\x7e\x08\x10\xbf\xcc\x21\x27') == 0x06